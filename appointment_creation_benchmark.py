@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Appointment Creation Benchmark
+Measures POST /api/appointments throughput and latency under concurrency:
+1. Login as the test provider
+2. Create appointments from N concurrent workers
+3. Report throughput and latency percentiles
+4. Delete the TEST_ appointments that were created
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://docstream-sync.preview.emergentagent.com').rstrip('/')
+API_URL = f"{BASE_URL}/api"
+
+TEST_PROVIDER = {"username": "testprovider", "password": "test123"}
+
+
+def login(credentials):
+    response = requests.post(f"{API_URL}/login", json=credentials, timeout=30)
+    if response.status_code != 200:
+        print(f"❌ Login failed for {credentials['username']}: {response.status_code}")
+        sys.exit(1)
+    return response.json()["access_token"]
+
+
+def create_appointment(session, headers, index):
+    appointment_data = {
+        "patient": {
+            "name": f"TEST_Bench_Patient_{index}",
+            "age": 40,
+            "gender": "female",
+            "vitals": {"blood_pressure": "120/80", "heart_rate": 72},
+            "history": "Benchmark run",
+            "area_of_consultation": "General Medicine"
+        },
+        "appointment_type": "emergency" if index % 4 == 0 else "non_emergency",
+        "consultation_notes": "Created by appointment_creation_benchmark.py"
+    }
+    started = time.perf_counter()
+    response = session.post(f"{API_URL}/appointments", json=appointment_data, headers=headers, timeout=30)
+    elapsed = time.perf_counter() - started
+    appointment_id = response.json().get("id") if response.status_code == 200 else None
+    return elapsed, appointment_id
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark concurrent appointment creation")
+    parser.add_argument("--requests", type=int, default=200, help="total appointments to create")
+    parser.add_argument("--concurrency", type=int, default=20, help="concurrent workers")
+    parser.add_argument("--keep", action="store_true", help="do not delete created appointments")
+    args = parser.parse_args()
+
+    token = login(TEST_PROVIDER)
+    headers = {"Authorization": f"Bearer {token}"}
+    session = requests.Session()
+    session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency))
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency))
+
+    print(f"🚀 Creating {args.requests} appointments with {args.concurrency} workers against {API_URL}")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(lambda i: create_appointment(session, headers, i), range(args.requests)))
+    wall_time = time.perf_counter() - started
+
+    latencies = [elapsed for elapsed, _ in results]
+    created = [appointment_id for _, appointment_id in results if appointment_id]
+
+    print("\n📊 Results")
+    print(f"   Succeeded:  {len(created)}/{args.requests}")
+    print(f"   Wall time:  {wall_time:.2f}s")
+    print(f"   Throughput: {len(created) / wall_time:.1f} appointments/s")
+    print(f"   Latency p50: {statistics.median(latencies) * 1000:.1f}ms")
+    print(f"   Latency p95: {percentile(latencies, 95) * 1000:.1f}ms")
+    print(f"   Latency max: {max(latencies) * 1000:.1f}ms")
+
+    if not args.keep:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(
+                lambda appointment_id: session.delete(f"{API_URL}/appointments/{appointment_id}", headers=headers, timeout=30),
+                created
+            ))
+        print(f"🧹 Deleted {len(created)} benchmark appointments")
+
+    return 0 if len(created) == args.requests else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
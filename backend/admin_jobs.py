@@ -0,0 +1,260 @@
+# Background jobs for long-running admin operations
+# Jobs run outside the HTTP request, delete in bounded batches, persist their
+# progress in the `admin_jobs` collection and push it to the requesting admin
+# over WebSocket.
+
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from archive_service import ARCHIVE_SUFFIX
+from stats_service import apply_appointments_removed, reconcile_counters
+
+# Batch size and pause between batches for bulk deletes
+JOB_BATCH_SIZE = int(os.environ.get('ADMIN_JOB_BATCH_SIZE', '500'))
+JOB_THROTTLE_SECONDS = float(os.environ.get('ADMIN_JOB_THROTTLE_SECONDS', '0.05'))
+
+# Minimum time between persisted/pushed progress updates within a stage
+JOB_REPORT_INTERVAL_SECONDS = 1.0
+
+# Collections whose documents point at an appointment by `appointment_id`
+APPOINTMENT_CHILD_COLLECTIONS = ["appointment_notes", "call_attempts"]
+
+# Shown in place of the author on records kept after their author is deleted
+DELETED_USER_NAME = "Deleted user"
+
+class JobContext:
+    """Handle passed to a running job for reporting progress"""
+    def __init__(self, runner: "JobRunner", job: dict):
+        self.runner = runner
+        self.job = job
+        self.progress: Dict[str, Any] = {"stage": "starting", "deleted": {}}
+        self.last_report = 0.0
+
+    def count(self, collection: str, deleted: int, kind: str = "deleted"):
+        counts = self.progress.setdefault(kind, {})
+        counts[collection] = counts.get(collection, 0) + deleted
+
+    async def report(self, stage: Optional[str] = None):
+        """Publish progress; stage changes always go out, batch updates at most once per interval"""
+        now = time.monotonic()
+        if stage:
+            self.progress["stage"] = stage
+        elif now - self.last_report < JOB_REPORT_INTERVAL_SECONDS:
+            return
+        self.last_report = now
+        await self.runner.update(self.job, {"progress": self.progress})
+
+class JobRunner:
+    def __init__(self, db, notify: Callable[[dict, str], Awaitable[Any]]):
+        self.db = db
+        self.notify = notify  # async (message, user_id) -> delivery over WebSocket
+        self.tasks: Dict[str, asyncio.Task] = {}
+
+    async def start(self, job_type: str, created_by: str, params: dict, work: Callable[[JobContext], Awaitable[dict]]) -> dict:
+        """Persist a queued job and run `work` in the background"""
+        job = {
+            "id": str(uuid.uuid4()),
+            "type": job_type,
+            "status": "queued",
+            "created_by": created_by,
+            "params": params,
+            "progress": {"stage": "queued", "deleted": {}},
+            "result": None,
+            "error": None,
+            "created_at": datetime.now(timezone.utc),
+            "started_at": None,
+            "finished_at": None
+        }
+        await self.db.admin_jobs.insert_one(dict(job))
+        self.tasks[job["id"]] = asyncio.create_task(self._run(job, work))
+        print(f"🧵 Admin job queued: {job_type} ({job['id']})")
+        return job
+
+    async def _run(self, job: dict, work: Callable[[JobContext], Awaitable[dict]]):
+        context = JobContext(self, job)
+        try:
+            await self.update(job, {"status": "running", "started_at": datetime.now(timezone.utc)})
+            result = await work(context)
+            await self.update(job, {
+                "status": "completed",
+                "progress": {**context.progress, "stage": "completed"},
+                "result": result,
+                "finished_at": datetime.now(timezone.utc)
+            })
+            print(f"✅ Admin job completed: {job['type']} ({job['id']})")
+        except Exception as e:
+            await self.update(job, {
+                "status": "failed",
+                "progress": context.progress,
+                "error": str(e),
+                "finished_at": datetime.now(timezone.utc)
+            })
+            print(f"❌ Admin job failed: {job['type']} ({job['id']}): {e}")
+        finally:
+            self.tasks.pop(job["id"], None)
+
+    async def update(self, job: dict, fields: dict):
+        job.update(fields)
+        await self.db.admin_jobs.update_one({"id": job["id"]}, {"$set": fields})
+        try:
+            await self.notify({
+                "type": "admin_job_progress",
+                "job_id": job["id"],
+                "job_type": job["type"],
+                "status": job["status"],
+                "progress": job["progress"],
+                "error": job["error"],
+                "timestamp": datetime.now(timezone.utc).isoformat()
+            }, job["created_by"])
+        except Exception as e:
+            print(f"⚠️ Failed to send job progress for {job['id']}: {e}")
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await self.db.admin_jobs.find_one({"id": job_id}, {"_id": 0})
+
+async def delete_in_batches(collection, query: dict, batch_size: int = None, throttle: float = None):
+    """Delete documents matching `query` in bounded batches, yielding each batch's count"""
+    batch_size = batch_size or JOB_BATCH_SIZE
+    throttle = JOB_THROTTLE_SECONDS if throttle is None else throttle
+    while True:
+        batch = await collection.find(query, {"_id": 1}).limit(batch_size).to_list(batch_size)
+        if not batch:
+            return
+        result = await collection.delete_many({"_id": {"$in": [doc["_id"] for doc in batch]}})
+        yield result.deleted_count
+        if throttle:
+            await asyncio.sleep(throttle)
+
+async def anonymize_in_batches(collection, query: dict, replacement: dict):
+    """Overwrite `replacement` fields on documents matching `query` in bounded batches, yielding each batch's count
+
+    `replacement` must stop the documents matching `query`, or the loop never ends.
+    """
+    while True:
+        batch = await collection.find(query, {"_id": 1}).limit(JOB_BATCH_SIZE).to_list(JOB_BATCH_SIZE)
+        if not batch:
+            return
+        result = await collection.update_many({"_id": {"$in": [doc["_id"] for doc in batch]}}, {"$set": replacement})
+        yield result.modified_count
+        if JOB_THROTTLE_SECONDS:
+            await asyncio.sleep(JOB_THROTTLE_SECONDS)
+
+async def delete_appointments_cascade(db, query: dict, context: JobContext, suffix: str = ""):
+    """Delete appointments matching `query` together with their notes, call attempts and patients
+
+    `suffix` selects the hot ("") or archive collections.
+    """
+    appointments = db["appointments" + suffix]
+    while True:
+        # Every field counter_keys reads, so the right counters are decremented
+        projection = {"_id": 1, "id": 1, "patient_id": 1, "status": 1, "provider_id": 1, "doctor_id": 1, "district": 1}
+        batch = await appointments.find(query, projection).limit(JOB_BATCH_SIZE).to_list(JOB_BATCH_SIZE)
+        if not batch:
+            return
+        appointment_ids = [a["id"] for a in batch]
+        patient_ids = [a["patient_id"] for a in batch if a.get("patient_id")]
+
+        # Children first, so an interrupted job never leaves orphans behind
+        for name in APPOINTMENT_CHILD_COLLECTIONS:
+            result = await db[name + suffix].delete_many({"appointment_id": {"$in": appointment_ids}})
+            context.count(name + suffix, result.deleted_count)
+        result = await db["patients" + suffix].delete_many({"id": {"$in": patient_ids}})
+        context.count("patients" + suffix, result.deleted_count)
+        result = await appointments.delete_many({"_id": {"$in": [a["_id"] for a in batch]}})
+        context.count(appointments.name, result.deleted_count)
+        # Archived appointments are counted too
+        await apply_appointments_removed(db, batch)
+
+        await context.report()
+        if JOB_THROTTLE_SECONDS:
+            await asyncio.sleep(JOB_THROTTLE_SECONDS)
+
+async def _sweep_unreferenced(collection, field: str, referenced: Callable[[list], Awaitable[set]], context: JobContext):
+    last_id = None
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        batch = await collection.find(query, {"_id": 1, field: 1}).sort("_id", 1).limit(JOB_BATCH_SIZE).to_list(JOB_BATCH_SIZE)
+        if not batch:
+            return
+        last_id = batch[-1]["_id"]
+
+        existing = await referenced(list({doc.get(field) for doc in batch}))
+        orphan_ids = [doc["_id"] for doc in batch if doc.get(field) not in existing]
+        if orphan_ids:
+            result = await collection.delete_many({"_id": {"$in": orphan_ids}})
+            context.count(collection.name, result.deleted_count)
+            await context.report()
+        if JOB_THROTTLE_SECONDS:
+            await asyncio.sleep(JOB_THROTTLE_SECONDS)
+
+async def sweep_orphans(db, context: JobContext, suffix: str = ""):
+    """Remove notes, call attempts and patients whose appointment no longer exists"""
+    await context.report("orphan_sweep" + suffix)
+    appointments = db["appointments" + suffix]
+
+    async def existing_appointment_ids(ids: list) -> set:
+        return set(await appointments.distinct("id", {"id": {"$in": ids}}))
+
+    async def referenced_patient_ids(ids: list) -> set:
+        return set(await appointments.distinct("patient_id", {"patient_id": {"$in": ids}}))
+
+    for name in APPOINTMENT_CHILD_COLLECTIONS:
+        await _sweep_unreferenced(db[name + suffix], "appointment_id", existing_appointment_ids, context)
+    await _sweep_unreferenced(db["patients" + suffix], "id", referenced_patient_ids, context)
+
+async def permanent_delete_user_job(db, user_id: str, context: JobContext) -> dict:
+    """Cascade a permanent user deletion through everything that references the user"""
+    await context.report("user")
+    result = await db.users.delete_one({"id": user_id})
+    context.count("users", result.deleted_count)
+
+    await context.report("appointments")
+    for suffix in ["", ARCHIVE_SUFFIX]:
+        await delete_appointments_cascade(db, {"$or": [{"provider_id": user_id}, {"doctor_id": user_id}]}, context, suffix)
+
+    # Records the user authored on their own appointments went with the cascade;
+    # the rest belong to appointments that survive, so only the author is removed
+    await context.report("authored_records")
+    authored = [
+        ("appointment_notes", "sender_id", {"sender_id": None, "sender_name": DELETED_USER_NAME}),
+        ("appointment_notes", "created_by", {"created_by": None}),
+        ("call_attempts", "doctor_id", {"doctor_id": None}),
+        ("call_attempts", "provider_id", {"provider_id": None})
+    ]
+    for suffix in ["", ARCHIVE_SUFFIX]:
+        for name, field, replacement in authored:
+            async for anonymized in anonymize_in_batches(db[name + suffix], {field: user_id}, replacement):
+                context.count(name + suffix, anonymized, "anonymized")
+                await context.report()
+    async for deleted in delete_in_batches(db.push_subscriptions, {"user_id": user_id}):
+        context.count("push_subscriptions", deleted)
+        await context.report()
+
+    for suffix in ["", ARCHIVE_SUFFIX]:
+        await sweep_orphans(db, context, suffix)
+    return {"deleted": context.progress["deleted"], "anonymized": context.progress.get("anonymized", {})}
+
+# Children before parents, so an interrupted cleanup never strands orphans
+CLEANUP_COLLECTIONS = [
+    name + suffix
+    for suffix in ["", ARCHIVE_SUFFIX]
+    for name in APPOINTMENT_CHILD_COLLECTIONS + ["patients", "appointments"]
+]
+
+async def cleanup_appointments_job(db, context: JobContext) -> dict:
+    """Delete all appointments and related data in throttled batches"""
+    context.progress["totals"] = {name: await db[name].estimated_document_count() for name in CLEANUP_COLLECTIONS}
+    for name in CLEANUP_COLLECTIONS:
+        context.count(name, 0)
+        await context.report(name)
+        async for deleted in delete_in_batches(db[name], {}):
+            context.count(name, deleted)
+            await context.report()
+    # Appointments created while the job ran may survive it; recount rather than zero
+    await context.report("counters")
+    await reconcile_counters(db)
+    return {"deleted": context.progress["deleted"]}
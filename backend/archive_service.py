@@ -0,0 +1,132 @@
+# Hot/cold archival of finished appointments
+# Completed and cancelled appointments older than ARCHIVE_AFTER_DAYS are moved,
+# together with their notes, call attempts and patient record, into the
+# `*_archive` collections. Hot collections stay small for dashboard polling;
+# archived records stay reachable through the helpers below.
+
+import asyncio
+import os
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+
+from pymongo import DeleteOne, ReplaceOne
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '30'))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '200'))
+ARCHIVE_THROTTLE_SECONDS = float(os.environ.get('ARCHIVE_THROTTLE_SECONDS', '0.2'))
+ARCHIVE_INTERVAL_SECONDS = int(os.environ.get('ARCHIVE_INTERVAL_SECONDS', '3600'))
+
+ARCHIVABLE_STATUSES = ["completed", "cancelled"]
+ARCHIVE_SUFFIX = "_archive"
+
+def archive_query(cutoff: datetime) -> dict:
+    return {"status": {"$in": ARCHIVABLE_STATUSES}, "updated_at": {"$lt": cutoff}}
+
+async def _copy_to_archive(db, name: str, docs: list):
+    # Upsert by _id so a batch interrupted after copying can simply be re-run
+    if docs:
+        await db[name + ARCHIVE_SUFFIX].bulk_write(
+            [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in docs],
+            ordered=False
+        )
+
+def _related_queries(appointments: list) -> dict:
+    appointment_ids = [a["id"] for a in appointments]
+    return {
+        "appointment_notes": {"appointment_id": {"$in": appointment_ids}},
+        "call_attempts": {"appointment_id": {"$in": appointment_ids}},
+        "patients": {"id": {"$in": [a["patient_id"] for a in appointments if a.get("patient_id")]}}
+    }
+
+async def archive_batch(db, cutoff: datetime, batch_size: int = None) -> dict:
+    """Move one batch of finished appointments and their related records to the archive
+
+    An appointment is only deleted from the hot side if its status and
+    updated_at still match the copy. One that changed in between is skipped:
+    its archive copies are removed and it stays hot for a later batch.
+    """
+    batch_size = batch_size or ARCHIVE_BATCH_SIZE
+    appointments = await db.appointments.find(archive_query(cutoff)).limit(batch_size).to_list(batch_size)
+    if not appointments:
+        return {}
+
+    # Copy everything first - children before parents, so an interrupted batch never loses records
+    copied = {}
+    for name, query in _related_queries(appointments).items():
+        docs = await db[name].find(query).to_list(None)
+        await _copy_to_archive(db, name, docs)
+        copied[name] = {doc["_id"] for doc in docs}
+    await _copy_to_archive(db, "appointments", appointments)
+
+    await db.appointments.bulk_write(
+        [DeleteOne({"_id": a["_id"], "status": a["status"], "updated_at": a.get("updated_at")}) for a in appointments],
+        ordered=False
+    )
+    remaining = {doc["_id"] for doc in await db.appointments.find({"_id": {"$in": [a["_id"] for a in appointments]}}, {"_id": 1}).to_list(None)}
+    archived = [a for a in appointments if a["_id"] not in remaining]
+    skipped = [a for a in appointments if a["_id"] in remaining]
+
+    if skipped:
+        await db["appointments" + ARCHIVE_SUFFIX].delete_many({"_id": {"$in": [a["_id"] for a in skipped]}})
+        for name, query in _related_queries(skipped).items():
+            await db[name + ARCHIVE_SUFFIX].delete_many(query)
+
+    moved = {"appointments": len(archived), "skipped": len(skipped)}
+    if not archived:
+        return moved
+    for name, query in _related_queries(archived).items():
+        # Records added after the copy are archived too before the hot side is cleared
+        ids = [doc["_id"] for doc in await db[name].find(query, {"_id": 1}).to_list(None)]
+        late = [_id for _id in ids if _id not in copied[name]]
+        if late:
+            await _copy_to_archive(db, name, await db[name].find({"_id": {"$in": late}}).to_list(None))
+        result = await db[name].delete_many({"_id": {"$in": ids}})
+        moved[name] = result.deleted_count
+    # Counters are left alone - archived appointments are still counted
+    return moved
+
+async def archive_finished_appointments(db, context=None, older_than_days: int = None) -> dict:
+    """Archive all eligible appointments in throttled batches
+
+    `context` is an optional admin JobContext used to report progress.
+    """
+    days = ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    totals = {}
+    while True:
+        moved = await archive_batch(db, cutoff)
+        if not moved:
+            break
+        for name, count in moved.items():
+            totals[name] = totals.get(name, 0) + count
+        if context:
+            context.progress["archived"] = totals
+            await context.report()
+        await asyncio.sleep(ARCHIVE_THROTTLE_SECONDS)
+
+    if totals:
+        print(f"🗄️ Archived {totals.get('appointments', 0)} appointments older than {days} days: {totals}")
+    return {"archived": totals, "cutoff": cutoff.isoformat()}
+
+async def archive_loop(db):
+    """Periodically archive finished appointments"""
+    while True:
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+        try:
+            await archive_finished_appointments(db)
+        except Exception as e:
+            print(f"❌ Appointment archival error: {e}")
+
+async def find_appointment(db, appointment_id: str, include_archived: bool = True, projection: Optional[dict] = None) -> Optional[dict]:
+    """Look up an appointment in the hot collection, falling back to the archive"""
+    appointment = await db.appointments.find_one({"id": appointment_id}, projection)
+    if appointment or not include_archived:
+        return appointment
+    appointment = await db["appointments" + ARCHIVE_SUFFIX].find_one({"id": appointment_id}, projection)
+    if appointment:
+        appointment["archived"] = True
+    return appointment
+
+def collection_for(db, name: str, archived: bool):
+    """Hot or archive collection holding records of an appointment"""
+    return db[name + ARCHIVE_SUFFIX] if archived else db[name]
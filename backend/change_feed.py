@@ -0,0 +1,179 @@
+# Change feed for long-polling clients
+# Every write bumps a version number and notifies an asyncio.Condition, so
+# waiters blocked in wait() return the moment something changes instead of
+# polling on a fixed interval. Recent changes are kept so a waiter can be told
+# what changed since its version, not only that something did.
+#
+# ChangeFeed lives in one process. SharedChangeFeed gives every worker the same
+# versions and changes: versions come from one counter document and changes are
+# written to a log collection, which each worker polls once per interval (not
+# once per waiter) to wake its own waiters about writes made elsewhere.
+
+import asyncio
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+class ChangeFeed:
+    def __init__(self, name: str, history: int = 1000):
+        self.name = name
+        # Start from the wall clock in ms, so versions keep increasing across restarts
+        # and a client holding a version from before one is not mistaken as current
+        self.version = time.time_ns() // 1_000_000
+        self.changes = deque(maxlen=history)  # (version, change)
+        self.condition = asyncio.Condition()
+        self.waiters = 0
+        self.metrics = {"published": 0, "waits": 0, "woken": 0, "timed_out": 0}
+
+    async def publish(self, change: dict) -> int:
+        """Record a change and wake every waiter; returns the new version"""
+        async with self.condition:
+            self.version += 1
+            self.changes.append((self.version, change))
+            self.metrics["published"] += 1
+            self.condition.notify_all()
+        return self.version
+
+    def changes_since(self, since: int) -> Optional[list]:
+        """Changes after `since`, or None if some of them are no longer kept"""
+        if since > self.version:
+            return None
+        oldest = self.changes[0][0] if self.changes else self.version + 1
+        if since < oldest - 1:
+            return None
+        return [{**change, "version": version} for version, change in self.changes if version > since]
+
+    async def wait(self, since: int, timeout: float) -> int:
+        """Block until the version moves past `since` or `timeout` seconds pass"""
+        if self.version != since:
+            return self.version
+        self.metrics["waits"] += 1
+        self.waiters += 1
+        try:
+            async with self.condition:
+                await asyncio.wait_for(self.condition.wait_for(lambda: self.version != since), timeout)
+            self.metrics["woken"] += 1
+        except asyncio.TimeoutError:
+            self.metrics["timed_out"] += 1
+        finally:
+            self.waiters -= 1
+        return self.version
+
+    async def wait_for_changes(self, since: int, timeout: float, visible: Callable[[dict], bool] = lambda change: True) -> Optional[list]:
+        """Wait until a change `visible` to the caller arrives; [] on timeout, None when the caller must resync"""
+        deadline = time.monotonic() + timeout
+        while True:
+            changes = self.changes_since(since)
+            if changes is None:
+                return None
+            changes = [change for change in changes if visible(change)]
+            remaining = deadline - time.monotonic()
+            if changes or remaining <= 0:
+                return changes
+            # Everything up to now was invisible to the caller; wait for what comes next
+            current = self.version
+            since = max(since, current)
+            await self.wait(current, remaining)
+
+    def get_status(self) -> dict:
+        return {**self.metrics, "version": self.version, "waiters": self.waiters, "history": len(self.changes)}
+
+class SharedChangeFeed(ChangeFeed):
+    def __init__(self, name: str, db, history: int = 1000, poll_interval: float = 1.0, gap_timeout: float = 5.0):
+        super().__init__(name, history)
+        self.versions = db.change_feed_versions
+        self.log = db[f"{name}_change_log"]
+        self.poll_interval = poll_interval
+        self.gap_timeout = gap_timeout
+        # Versions are allocated before their change is logged, so a worker may see them
+        # out of order; they wait here until the versions before them arrive
+        self.staged: Dict[int, Tuple[dict, float]] = {}  # version -> (change, staged_at)
+        self.known = self.version  # Highest version known to have been handed out
+        self.metrics.update({"received": 0, "gaps_skipped": 0})
+
+    async def start(self):
+        """Continue from the shared version and start following other workers' changes"""
+        doc = await self.versions.find_one({"_id": self.name})
+        if doc:
+            self.version = self.known = doc["version"]
+        asyncio.create_task(self.poll_loop())
+
+    async def publish(self, change: dict) -> int:
+        # Seeded from this process's clock-based version, so versions keep increasing
+        # for clients that polled before the shared counter existed
+        doc = await self.versions.find_one_and_update(
+            {"_id": self.name},
+            [{"$set": {"version": {"$add": [{"$ifNull": ["$version", self.version]}, 1]}}}],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        version = doc["version"]
+        self.known = max(self.known, version)
+        await self.log.insert_one({"_id": version, "change": change, "created_at": datetime.now(timezone.utc)})
+        self.metrics["published"] += 1
+        self._stage(version, change)
+        await self._advance()
+        return version
+
+    def _stage(self, version: int, change: dict):
+        if version > self.version and version not in self.staged:
+            self.staged[version] = (change, time.monotonic())
+            self.known = max(self.known, version)
+
+    async def _advance(self):
+        """Move the version through every staged change that has no missing predecessor"""
+        advanced = False
+        now = time.monotonic()
+        while self.staged:
+            if self.version + 1 in self.staged:
+                self.version += 1
+                self.changes.append((self.version, self.staged.pop(self.version)[0]))
+                advanced = True
+                continue
+            oldest = min(self.staged)
+            if now - self.staged[oldest][1] <= self.gap_timeout:
+                break
+            # The writer allocated these versions but never logged them
+            self.metrics["gaps_skipped"] += oldest - self.version - 1
+            self.version = oldest - 1
+        if advanced:
+            async with self.condition:
+                self.condition.notify_all()
+
+    async def sync(self):
+        """Take in changes other workers logged since this worker's version"""
+        docs = await self.log.find({"_id": {"$gt": self.version}}).sort("_id", 1).limit(self.changes.maxlen).to_list(None)
+        for doc in docs:
+            if doc["_id"] > self.version and doc["_id"] not in self.staged:
+                self.metrics["received"] += 1
+                self._stage(doc["_id"], doc["change"])
+        await self._advance()
+
+    async def poll_loop(self):
+        while True:
+            try:
+                await self.sync()
+            except Exception as e:
+                print(f"❌ Change feed {self.name} poll error: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def wait_for_changes(self, since: int, timeout: float, visible: Callable[[dict], bool] = lambda change: True) -> Optional[list]:
+        if since > self.known:
+            # Handed out by another worker since the last poll, or never - the shared counter tells
+            await self.sync()
+            doc = await self.versions.find_one({"_id": self.name})
+            if doc:
+                self.known = max(self.known, doc["version"])
+        return await super().wait_for_changes(since, timeout, visible)
+
+    def changes_since(self, since: int) -> Optional[list]:
+        # Versions handed out elsewhere that have not reached this worker yet are waited for
+        if self.version < since <= self.known:
+            return []
+        return super().changes_since(since)
+
+    def get_status(self) -> dict:
+        return {**super().get_status(), "staged": len(self.staged), "poll_interval_seconds": self.poll_interval}
@@ -0,0 +1,155 @@
+# Data migrations for the Telehealth backend
+# Each migration is batched and resumable: progress is checkpointed in the
+# `migrations` collection, so an interrupted run picks up where it stopped.
+#
+# Usage: python migrations.py <migration_name> [--batch-size N]
+
+import argparse
+import asyncio
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+from archive_service import ARCHIVE_SUFFIX
+from stats_service import reconcile_counters
+
+# Keep in sync with PATIENT_SNAPSHOT_FIELDS in server.py
+PATIENT_SNAPSHOT_FIELDS = ["id", "name", "age", "gender", "vitals", "history", "area_of_consultation", "created_at"]
+# Keep in sync with DISPATCH_PRIORITIES in server.py
+DISPATCH_PRIORITIES = {"emergency": 100, "non_emergency": 0}
+
+async def _load_checkpoint(db, name: str):
+    checkpoint = await db.migrations.find_one({"_id": name})
+    return checkpoint or {"_id": name, "last_id": None, "processed": 0, "completed_at": None}
+
+async def _save_checkpoint(db, checkpoint: dict):
+    checkpoint["updated_at"] = datetime.now(timezone.utc)
+    await db.migrations.replace_one({"_id": checkpoint["_id"]}, checkpoint, upsert=True)
+
+async def backfill_patient_snapshots(db, batch_size: int = 500):
+    """Embed the patient summary into appointments created before it was denormalized"""
+    checkpoint = await _load_checkpoint(db, "patient_snapshots")
+    if checkpoint.get("completed_at"):
+        print(f"✅ patient_snapshots already completed at {checkpoint['completed_at']}")
+        return checkpoint
+
+    while True:
+        query = {"patient": {"$in": [None, {}]}}
+        if checkpoint["last_id"] is not None:
+            query["_id"] = {"$gt": checkpoint["last_id"]}
+
+        batch = await db.appointments.find(query, {"_id": 1, "patient_id": 1}).sort("_id", 1).to_list(batch_size)
+        if not batch:
+            break
+
+        patient_ids = [a["patient_id"] for a in batch if a.get("patient_id")]
+        patients = await db.patients.find({"id": {"$in": patient_ids}}).to_list(None)
+        patients_by_id = {p["id"]: p for p in patients}
+
+        updates = []
+        for appointment in batch:
+            patient = patients_by_id.get(appointment.get("patient_id"))
+            if patient:
+                snapshot = {field: patient.get(field) for field in PATIENT_SNAPSHOT_FIELDS}
+                updates.append(UpdateOne({"_id": appointment["_id"]}, {"$set": {"patient": snapshot}}))
+
+        if updates:
+            await db.appointments.bulk_write(updates, ordered=False)
+
+        checkpoint["last_id"] = batch[-1]["_id"]
+        checkpoint["processed"] += len(updates)
+        await _save_checkpoint(db, checkpoint)
+        print(f"📦 patient_snapshots: {checkpoint['processed']} appointments backfilled")
+
+    checkpoint["completed_at"] = datetime.now(timezone.utc)
+    await _save_checkpoint(db, checkpoint)
+    print(f"✅ patient_snapshots completed: {checkpoint['processed']} appointments backfilled")
+    return checkpoint
+
+async def backfill_appointment_districts(db, batch_size: int = 500):
+    """Stamp the creating provider's district on appointments from before districts were stored
+
+    Hot and archived appointments are checkpointed separately. Providers without a
+    district get an explicit null, so every appointment ends up with the field.
+    Counters are reconciled at the end to build the per-district counters.
+    """
+    for collection in ["appointments", "appointments" + ARCHIVE_SUFFIX]:
+        name = f"districts_{collection}"
+        checkpoint = await _load_checkpoint(db, name)
+        if checkpoint.get("completed_at"):
+            print(f"✅ {name} already completed at {checkpoint['completed_at']}")
+            continue
+
+        while True:
+            query = {"district": {"$exists": False}}
+            if checkpoint["last_id"] is not None:
+                query["_id"] = {"$gt": checkpoint["last_id"]}
+
+            batch = await db[collection].find(query, {"_id": 1, "provider_id": 1}).sort("_id", 1).to_list(batch_size)
+            if not batch:
+                break
+
+            provider_ids = list({a["provider_id"] for a in batch if a.get("provider_id")})
+            providers = await db.users.find({"id": {"$in": provider_ids}}, {"_id": 0, "id": 1, "district": 1}).to_list(None)
+            districts = {p["id"]: p.get("district") for p in providers}
+
+            updates = [
+                UpdateOne({"_id": a["_id"]}, {"$set": {"district": districts.get(a.get("provider_id"))}})
+                for a in batch
+            ]
+            await db[collection].bulk_write(updates, ordered=False)
+
+            checkpoint["last_id"] = batch[-1]["_id"]
+            checkpoint["processed"] += len(updates)
+            await _save_checkpoint(db, checkpoint)
+            print(f"📦 {name}: {checkpoint['processed']} appointments backfilled")
+
+        checkpoint["completed_at"] = datetime.now(timezone.utc)
+        await _save_checkpoint(db, checkpoint)
+        print(f"✅ {name} completed: {checkpoint['processed']} appointments backfilled")
+
+    await reconcile_counters(db)
+
+async def backfill_dispatch_priorities(db, batch_size: int = 500):
+    """Give appointments from before the dispatch queue their priority
+
+    One update per appointment type; appointments that already have a priority
+    are left alone, so re-running is safe and no checkpoint is needed.
+    """
+    processed = 0
+    for appointment_type, priority in DISPATCH_PRIORITIES.items():
+        result = await db.appointments.update_many(
+            {"appointment_type": appointment_type, "priority": {"$exists": False}},
+            {"$set": {"priority": priority}}
+        )
+        processed += result.modified_count
+    result = await db.appointments.update_many({"priority": {"$exists": False}}, {"$set": {"priority": 0}})
+    processed += result.modified_count
+    print(f"✅ dispatch_priorities completed: {processed} appointments backfilled")
+    return {"processed": processed}
+
+MIGRATIONS = {
+    "patient_snapshots": backfill_patient_snapshots,
+    "appointment_districts": backfill_appointment_districts,
+    "dispatch_priorities": backfill_dispatch_priorities,
+}
+
+async def run_migration(name: str, batch_size: int):
+    root_dir = Path(__file__).parent
+    load_dotenv(root_dir / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    try:
+        await MIGRATIONS[name](client[os.environ['DB_NAME']], batch_size=batch_size)
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a resumable data migration")
+    parser.add_argument("migration", choices=sorted(MIGRATIONS))
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(run_migration(args.migration, args.batch_size))
@@ -0,0 +1,134 @@
+# Bounded per-user queues for messages to users with no live connection
+# Each user gets a deque capped at max_per_user, so overflow drops the oldest
+# message in O(1). All queues share one byte budget: users are kept in order of
+# their last activity (a message queued for them or a drain of their queue),
+# and when the budget is exceeded the oldest messages of the least recently
+# active users go first. Messages expire after `ttl` seconds, and users idle
+# for longer than `idle_ttl` lose their queue entirely, which also reclaims
+# queues of users that were deleted and never come back. Both happen on push
+# and in sweep(), which the owner runs periodically so memory is reclaimed
+# even when nothing is being queued.
+# Counts and bytes are kept as running totals, so status is O(1).
+
+import json
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from typing import Dict, List
+
+class OfflineQueues:
+    def __init__(self, max_per_user: int = 100, memory_budget: int = 8 * 1024 * 1024, ttl: float = 86400, idle_ttl: float = 7 * 86400):
+        self.max_per_user = max_per_user
+        self.memory_budget = memory_budget
+        self.ttl = ttl
+        self.idle_ttl = idle_ttl
+        self.queues: Dict[str, deque] = {}  # user_id -> deque of (queued_at, size, message)
+        self.last_active: "OrderedDict[str, float]" = OrderedDict()  # Least recently active first
+        self.total_messages = 0
+        self.total_bytes = 0
+        self.metrics = {"queued": 0, "delivered": 0, "dropped_overflow": 0, "dropped_budget": 0, "expired": 0, "evicted_users": 0, "sweeps": 0}
+
+    def _touch(self, user_id: str, now: float):
+        self.last_active[user_id] = now
+        self.last_active.move_to_end(user_id)
+
+    def _pop_oldest(self, user_id: str) -> tuple:
+        entry = self.queues[user_id].popleft()
+        self.total_messages -= 1
+        self.total_bytes -= entry[1]
+        return entry
+
+    def _expire(self, user_id: str, now: float):
+        queue = self.queues[user_id]
+        while queue and now - queue[0][0] > self.ttl:
+            self._pop_oldest(user_id)
+            self.metrics["expired"] += 1
+
+    def push(self, user_id: str, message: dict) -> int:
+        """Queue a copy of `message` stamped with queued_at; returns the user's queue length"""
+        now = time.monotonic()
+        self.evict_idle(now)
+        message = {**message, "queued_at": datetime.now(timezone.utc).isoformat()}
+        size = len(json.dumps(message, default=str))
+
+        queue = self.queues.setdefault(user_id, deque())
+        self._expire(user_id, now)
+        if len(queue) >= self.max_per_user:
+            self._pop_oldest(user_id)
+            self.metrics["dropped_overflow"] += 1
+        queue.append((now, size, message))
+        self.total_messages += 1
+        self.total_bytes += size
+        self.metrics["queued"] += 1
+        self._touch(user_id, now)
+
+        # Over budget: take from the least recently active users, never the new message itself
+        while self.total_bytes > self.memory_budget and self.total_messages > 1:
+            oldest_user = next(iter(self.last_active))
+            if oldest_user not in self.queues:
+                del self.last_active[oldest_user]  # Drained since; nothing left to take
+                continue
+            if oldest_user == user_id and len(queue) == 1:
+                break
+            self._pop_oldest(oldest_user)
+            self.metrics["dropped_budget"] += 1
+            if not self.queues[oldest_user]:
+                self.drop(oldest_user)
+        return len(queue)
+
+    def pop_all(self, user_id: str) -> List[dict]:
+        """Remove and return the user's unexpired messages, oldest first"""
+        if user_id not in self.queues:
+            return []
+        now = time.monotonic()
+        self._expire(user_id, now)
+        messages = [message for _, _, message in self.queues[user_id]]
+        self._remove_queue(user_id)
+        self._touch(user_id, now)  # A drain is activity too
+        self.metrics["delivered"] += len(messages)
+        return messages
+
+    def _remove_queue(self, user_id: str):
+        queue = self.queues.pop(user_id, None)
+        if queue:
+            self.total_messages -= len(queue)
+            self.total_bytes -= sum(size for _, size, _ in queue)
+
+    def drop(self, user_id: str):
+        """Forget a user's queue, e.g. when the user is deleted"""
+        self._remove_queue(user_id)
+        self.last_active.pop(user_id, None)
+
+    def evict_idle(self, now: float = None):
+        """Drop queues of users with no activity for idle_ttl; stops at the first recent user"""
+        now = time.monotonic() if now is None else now
+        while self.last_active:
+            user_id, last_active = next(iter(self.last_active.items()))
+            if now - last_active <= self.idle_ttl:
+                break
+            if user_id in self.queues:
+                self.metrics["evicted_users"] += 1
+            self.drop(user_id)
+
+    def sweep(self, now: float = None):
+        """Expire old messages in every queue and evict idle users"""
+        now = time.monotonic() if now is None else now
+        for user_id in list(self.queues):
+            self._expire(user_id, now)
+            if not self.queues[user_id]:
+                self._remove_queue(user_id)
+        self.evict_idle(now)
+        self.metrics["sweeps"] += 1
+
+    def get_status(self) -> dict:
+        return {
+            **self.metrics,
+            "messages": self.total_messages,
+            "bytes": self.total_bytes,
+            "users": len(self.queues),
+            "tracked_users": len(self.last_active),
+            "memory_budget": self.memory_budget,
+            "max_per_user": self.max_per_user,
+            "ttl_seconds": self.ttl,
+            "idle_ttl_seconds": self.idle_ttl
+        }
@@ -0,0 +1,133 @@
+# Retention policies for collections that otherwise grow without bound
+# Every policy is declared here and enforced by a MongoDB TTL index on the
+# policy's date field. Documents without that field (e.g. an active push
+# subscription) are never expired. Sessions that were opened but never ended are
+# marked ended once they are ABANDONED_SESSION_HOURS old, so their ended_at
+# policy applies to them too.
+#
+# Offline notification queues are not persisted; they live in memory in
+# ConnectionManager and are bounded there.
+
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+
+def _days(env_name: str, default: int) -> int:
+    return int(os.environ.get(env_name, str(default)))
+
+RETENTION_POLICIES = {
+    "call_attempts": {
+        "field": "initiated_at",
+        "days": _days('CALL_ATTEMPT_RETENTION_DAYS', 90),
+        "description": "Call attempts, counted from when the call was started"
+    },
+    "call_attempts_archive": {
+        "field": "initiated_at",
+        "days": _days('CALL_ATTEMPT_RETENTION_DAYS', 90),
+        "description": "Archived call attempts, counted from when the call was started"
+    },
+    "push_subscriptions": {
+        "field": "deactivated_at",
+        "days": _days('INACTIVE_PUSH_SUBSCRIPTION_RETENTION_DAYS', 7),
+        "description": "Push subscriptions after delivery failures marked them inactive"
+    },
+    "jitsi_sessions": {
+        "field": "ended_at",
+        "days": _days('VIDEO_SESSION_RETENTION_DAYS', 7),
+        "description": "Jitsi sessions after they ended, or were abandoned"
+    },
+    "video_sessions": {
+        "field": "ended_at",
+        "days": _days('VIDEO_SESSION_RETENTION_DAYS', 7),
+        "description": "Video call sessions after they ended, or were abandoned"
+    },
+    "appointments_change_log": {
+        "field": "created_at",
+        "days": 1,
+        "description": "Appointment changes shared with other workers' long-poll clients"
+    },
+    "admin_jobs": {
+        "field": "finished_at",
+        "days": _days('ADMIN_JOB_RETENTION_DAYS', 30),
+        "description": "Background admin jobs after they finished"
+    },
+}
+
+# Session collections, with the fields that mark one ended
+ABANDONED_SESSION_HOURS = int(os.environ.get('ABANDONED_SESSION_HOURS', '48'))
+ABANDONED_SESSION_CHECK_SECONDS = 3600
+SESSION_END_FIELDS = {
+    "video_sessions": {"status": "ended"},
+    "jitsi_sessions": {}
+}
+
+async def end_abandoned_sessions(db) -> dict:
+    """Mark sessions that were never ended as ended once they are ABANDONED_SESSION_HOURS old
+
+    Age comes from the ObjectId, which every session has whatever writer created it.
+    """
+    now = datetime.now(timezone.utc)
+    oldest_open = ObjectId.from_datetime(now - timedelta(hours=ABANDONED_SESSION_HOURS))
+    ended = {}
+    for collection, fields in SESSION_END_FIELDS.items():
+        result = await db[collection].update_many(
+            {"ended_at": None, "_id": {"$lt": oldest_open}},
+            {"$set": {"ended_at": now, **fields}}
+        )
+        ended[collection] = result.modified_count
+    if any(ended.values()):
+        print(f"⏳ Ended abandoned sessions older than {ABANDONED_SESSION_HOURS}h: {ended}")
+    return ended
+
+async def abandoned_sessions_loop(db):
+    """Periodically end abandoned sessions"""
+    while True:
+        try:
+            await end_abandoned_sessions(db)
+        except Exception as e:
+            print(f"❌ Abandoned session cleanup error: {e}")
+        await asyncio.sleep(ABANDONED_SESSION_CHECK_SECONDS)
+
+async def ensure_retention_indexes(db):
+    """Create or update the TTL index for every retention policy"""
+    for collection, policy in RETENTION_POLICIES.items():
+        index_name = f"ttl_{policy['field']}"
+        expire_after = policy["days"] * 24 * 60 * 60
+        try:
+            await db[collection].create_index([(policy["field"], 1)], name=index_name, expireAfterSeconds=expire_after)
+        except OperationFailure as e:
+            # IndexOptionsConflict: the TTL changed since the index was created
+            if e.code != 85:
+                print(f"⚠️ Failed to create TTL index on {collection}: {e}")
+                continue
+            await db.command("collMod", collection, index={"name": index_name, "expireAfterSeconds": expire_after})
+            print(f"🔁 TTL on {collection}.{policy['field']} updated to {policy['days']} days")
+    print(f"⏳ Retention TTL indexes ensured for {len(RETENTION_POLICIES)} collections")
+
+async def storage_report(db) -> dict:
+    """Document counts and sizes per collection, with the retention policy that applies"""
+    collections = []
+    for name in sorted(await db.list_collection_names()):
+        stats = await db.command("collStats", name)
+        policy = RETENTION_POLICIES.get(name)
+        collections.append({
+            "collection": name,
+            "documents": stats.get("count", 0),
+            "size_bytes": stats.get("size", 0),
+            "storage_bytes": stats.get("storageSize", 0),
+            "index_bytes": stats.get("totalIndexSize", 0),
+            "avg_document_bytes": stats.get("avgObjSize", 0),
+            "retention": {**policy, "enforced_by": "ttl_index"} if policy else None
+        })
+    return {
+        "collections": collections,
+        "totals": {
+            "documents": sum(c["documents"] for c in collections),
+            "size_bytes": sum(c["size_bytes"] for c in collections),
+            "storage_bytes": sum(c["storage_bytes"] for c in collections),
+            "index_bytes": sum(c["index_bytes"] for c in collections)
+        }
+    }
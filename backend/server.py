@@ -1,20 +1,29 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, WebSocket, WebSocketDisconnect, Request, Response
+from fastapi.responses import StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi import status as http_status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import WriteConcern, ReturnDocument
+from pymongo.errors import OperationFailure, PyMongoError
 import os
 import logging
 import asyncio
+import time
+import random
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
 from typing import List, Optional, Dict, Any
+from collections import deque
 import uuid
 from datetime import datetime, timezone, timedelta
 import jwt
 from passlib.context import CryptContext
 import json
+import msgpack
+import hashlib
 from pywebpush import webpush, WebPushException
 import base64
 import firebase_admin
@@ -28,6 +37,13 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
+# Writes that must survive a primary failover before the API acknowledges them
+MAJORITY_WRITE_CONCERN = WriteConcern(w="majority", wtimeout=5000)
+
+# None until the first transaction attempt tells us whether the deployment
+# supports them (replica set / mongos) or is a standalone server
+TRANSACTIONS_SUPPORTED: Optional[bool] = None
+
 # Initialize Firebase Admin SDK
 # TODO: Add your Firebase service account JSON file
 try:
@@ -42,6 +58,14 @@ except Exception as e:
 
 # Import FCM service
 from fcm_service import save_fcm_token, send_notification_to_user
+from admin_jobs import JobRunner, permanent_delete_user_job, cleanup_appointments_job
+from archive_service import ARCHIVE_SUFFIX, archive_finished_appointments, archive_loop, find_appointment, collection_for
+from retention_service import abandoned_sessions_loop, ensure_retention_indexes, storage_report
+from stats_service import AdminStatsCache, apply_appointment_change, get_counters, district_counter_key, reconcile_counters, counters_reconcile_loop
+from timer_scheduler import TimerScheduler
+from change_feed import SharedChangeFeed
+from offline_queue import OfflineQueues
+from cachetools import TTLCache
 
 # Create the main app with proper configuration
 app = FastAPI(
@@ -117,199 +141,834 @@ VAPID_CLAIMS = {
     "sub": "mailto:admin@greenstar-health.com"
 }
 
+# How long a targeted call event waits for a device ack before falling back to push
+WS_ACK_TIMEOUT_SECONDS = float(os.environ.get('WS_ACK_TIMEOUT_SECONDS', '3'))
+
+# Heartbeats are scheduled per connection with jitter, so pings are spread across the
+# interval instead of going out in one burst, and are skipped while the client is talking
+WS_HEARTBEAT_INTERVAL_SECONDS = float(os.environ.get('WS_HEARTBEAT_INTERVAL_SECONDS', '30'))
+WS_HEARTBEAT_JITTER = 0.2  # +/- fraction of the interval
+WS_HEARTBEAT_MAX_MISSED = int(os.environ.get('WS_HEARTBEAT_MAX_MISSED', '3'))  # 0 = only count misses
+# Set when the ASGI server sends protocol ping frames itself (uvicorn --ws websockets
+# --ws-ping-interval N); it then closes dead peers and no JSON heartbeats are sent
+WS_PROTOCOL_PINGS = os.environ.get('WS_PROTOCOL_PINGS', 'false').lower() == 'true'
+
+# Wire encodings a client can choose with ?encoding= on /api/ws/{user_id}. JSON goes out
+# as text frames, msgpack as binary frames.
+WS_ENCODINGS = ("json", "msgpack")
+
+# Server-Sent Events fallback for clients behind proxies that break WebSockets.
+# Recent fan-out events are kept so a reconnecting stream can resume from Last-Event-ID.
+SSE_REPLAY_BUFFER_SIZE = int(os.environ.get('SSE_REPLAY_BUFFER_SIZE', '1000'))
+SSE_RETRY_MS = 3000  # Reconnect delay advertised to EventSource
+SSE_MAX_PENDING_FRAMES = 500  # A stream further behind than this is dropped like a dead socket
+
+# Connections may ask (?coalesce_ms=) for events about the same appointment or user to be held
+# for a short window and delivered as one frame. A later state snapshot replaces an earlier
+# one of the same type; other events (notes, activity) are all kept. Call events always go
+# out immediately.
+WS_COALESCE_WINDOW_MS = int(os.environ.get('WS_COALESCE_WINDOW_MS', '0'))  # Default for connections that don't ask
+WS_COALESCE_MAX_WINDOW_MS = 1000
+URGENT_EVENT_TYPES = {"incoming_video_call", "jitsi_call_invitation", "call_cancelled"}
+SUPERSEDING_EVENT_TYPES = {"appointment_updated"}
+
+# Entity events are published to topics and reach only the connections subscribed to one
+# of them. Connections start with their role's defaults and can add more, e.g. an
+# appointment they have open, with {"type": "subscribe", "topics": [...]}.
+# provider:<id> and doctor:<id> address one user, who gets the event queued while offline.
+TOPIC_KINDS = ("appointment", "role", "provider", "doctor", "district", "admin")
+PERSONAL_TOPIC_KINDS = ("provider", "doctor")
+WS_MAX_TOPICS_PER_CONNECTION = 200
+
+#
+# Doctors are routed by district: appointments of a district go to district:<name>, which
+# doctors of that district follow, and to district:*, the opt-in cross-district view that
+# doctors without a district follow by default. Appointments without a district go to all doctors.
+ALL_DISTRICTS_TOPIC = "district:*"
+
+def default_topics(user_id: str, role: Optional[str], district: Optional[str] = None) -> List[str]:
+    topics = [f"role:{role}"] if role else []
+    if role == "provider":
+        topics.append(f"provider:{user_id}")
+    elif role == "doctor":
+        topics.append(f"doctor:{user_id}")
+        topics.append(f"district:{district}" if district else ALL_DISTRICTS_TOPIC)
+    elif role == "admin":
+        topics.append("admin")
+    return topics
+
+def doctor_topics(district: Optional[str]) -> List[str]:
+    return [f"district:{district}", ALL_DISTRICTS_TOPIC] if district else ["role:doctor"]
+
+def appointment_topics(appointment: dict) -> List[str]:
+    """Who hears about an appointment: watchers of it, its provider, its doctors and admins"""
+    return [
+        f"appointment:{appointment['id']}",
+        f"provider:{appointment['provider_id']}",
+        *([f"doctor:{appointment['doctor_id']}"] if appointment.get("doctor_id") else []),
+        *doctor_topics(appointment.get("district")),
+        "admin"
+    ]
+
+# Emergency dispatch: doctors claim the next unassigned pending appointment, highest
+# priority first and oldest within a priority
+DISPATCH_PRIORITIES = {"emergency": 100, "non_emergency": 0}
+DISPATCH_SORT = [("priority", -1), ("created_at", 1)]
+
+# Messages for users without a live connection are queued until they reconnect, within a
+# per-user cap and a byte budget shared by all queues. Stale messages expire, and queues of
+# users who stay away (or were deleted) are evicted.
+WS_QUEUE_MAX_PER_USER = int(os.environ.get('WS_QUEUE_MAX_PER_USER', '100'))
+WS_QUEUE_MEMORY_BUDGET_BYTES = int(os.environ.get('WS_QUEUE_MEMORY_BUDGET_BYTES', str(8 * 1024 * 1024)))
+WS_QUEUE_MESSAGE_TTL_SECONDS = float(os.environ.get('WS_QUEUE_MESSAGE_TTL_SECONDS', '86400'))
+WS_QUEUE_IDLE_EVICT_SECONDS = float(os.environ.get('WS_QUEUE_IDLE_EVICT_SECONDS', str(7 * 86400)))
+WS_QUEUE_SWEEP_INTERVAL_SECONDS = float(os.environ.get('WS_QUEUE_SWEEP_INTERVAL_SECONDS', '300'))
+
+def coalesce_window(requested_ms: Optional[int]) -> float:
+    window_ms = WS_COALESCE_WINDOW_MS if requested_ms is None else requested_ms
+    return min(max(window_ms, 0), WS_COALESCE_MAX_WINDOW_MS) / 1000
+
+def is_urgent_event(message: dict) -> bool:
+    return (
+        message.get("type") in URGENT_EVENT_TYPES
+        or message.get("priority") == "urgent"
+        or bool(message.get("requires_ack"))
+    )
+
+def coalesce_key(message: dict) -> Optional[str]:
+    """The entity an event is about, if events for it can be merged"""
+    if message.get("appointment_id"):
+        return f"appointment:{message['appointment_id']}"
+    if message.get("type", "").startswith("user_") and message.get("user_id"):
+        return f"user:{message['user_id']}"
+    return None
+
+def encode_frame(message: dict, encoding: str = "json", event_id: Optional[str] = None):
+    if encoding == "msgpack":
+        return msgpack.packb(message, default=str)
+    if encoding == "sse":
+        data = f"data: {json.dumps(message, default=str)}\n\n"
+        return f"id: {event_id}\n{data}" if event_id else data
+    return json.dumps(message, default=str)
+
+def decode_frame(data) -> dict:
+    if isinstance(data, bytes):
+        return msgpack.unpackb(data)
+    return json.loads(data)
+
+# A single WebSocket of a user - users may be connected from several devices or tabs
+class ClientConnection:
+    def __init__(self, websocket: WebSocket, user_id: str, encoding: str = "json", coalesce_window: float = 0):
+        self.id = str(uuid.uuid4())
+        self.websocket = websocket
+        self.user_id = user_id
+        self.encoding = encoding
+        self.connected_at = datetime.now(timezone.utc)
+        self.last_received = time.monotonic()
+        self.ping_sent_at: Optional[float] = None
+        self.missed_pongs = 0
+        self.coalesce_window = coalesce_window
+        self.coalesced: Dict[str, List[tuple]] = {}  # entity key -> [(message, frame, event_id)]
+        self.topics: set = set()
+    
+    # Clients answer heartbeats, so missing answers mean a dead connection
+    bidirectional = True
+    
+    async def send(self, message: dict):
+        await self.send_frame(encode_frame(message, self.encoding))
+    
+    async def send_frame(self, frame):
+        """Send an already encoded frame, so fan-out serializes each message once per encoding"""
+        if isinstance(frame, bytes):
+            await self.websocket.send_bytes(frame)
+        else:
+            await self.websocket.send_text(frame)
+    
+    def mark_received(self):
+        """Any inbound frame proves the client is alive and answers an outstanding ping"""
+        self.last_received = time.monotonic()
+        self.ping_sent_at = None
+        self.missed_pongs = 0
+
+# An SSE stream of a user, registered and fanned out to like a WebSocket.
+# Frames are buffered for the streaming response; the client cannot talk back,
+# so heartbeats only keep proxies from timing the stream out.
+class SSEConnection:
+    bidirectional = False
+    
+    def __init__(self, user_id: str, coalesce_window: float = 0):
+        self.id = str(uuid.uuid4())
+        self.user_id = user_id
+        self.encoding = "sse"
+        self.connected_at = datetime.now(timezone.utc)
+        self.last_received = time.monotonic()
+        self.ping_sent_at: Optional[float] = None
+        self.missed_pongs = 0
+        self.coalesce_window = coalesce_window
+        self.coalesced: Dict[str, List[tuple]] = {}
+        self.topics: set = set()
+        self.frames: asyncio.Queue = asyncio.Queue(maxsize=SSE_MAX_PENDING_FRAMES)
+    
+    async def send(self, message: dict):
+        await self.send_frame(encode_frame(message, self.encoding))
+    
+    async def send_frame(self, frame):
+        try:
+            self.frames.put_nowait(frame)
+        except asyncio.QueueFull:
+            raise ConnectionError("SSE client is not reading its stream")
+    
+    def mark_received(self):
+        self.last_received = time.monotonic()
+
 # WebSocket connection manager
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
-        self.message_queue: Dict[str, List[dict]] = {}  # Queue for offline users
-        self.connection_timestamps: Dict[str, datetime] = {}  # Track when users connected
-        self.max_queue_size = 100  # Maximum queued messages per user
-    
-    async def connect(self, websocket: WebSocket, user_id: str):
+        self.active_connections: Dict[str, Dict[str, ClientConnection]] = {}  # user_id -> {connection_id: connection}
+        self.offline_queues = OfflineQueues(
+            max_per_user=WS_QUEUE_MAX_PER_USER,
+            memory_budget=WS_QUEUE_MEMORY_BUDGET_BYTES,
+            ttl=WS_QUEUE_MESSAGE_TTL_SECONDS,
+            idle_ttl=WS_QUEUE_IDLE_EVICT_SECONDS
+        )
+        self.queue_sweeper = TimerScheduler("ws_queue_sweep")
+        self.pending_acks: Dict[str, tuple] = {}  # message_id -> (user_id, future)
+        self.ack_metrics = {"sent": 0, "acked": 0, "timed_out": 0, "undeliverable": 0}
+        self.ack_latencies_ms = deque(maxlen=500)  # Recent ack latencies for percentiles
+        self.heartbeats = TimerScheduler("ws_heartbeats")
+        self.heartbeat_metrics = {"sent": 0, "skipped": 0, "missed_pongs": 0, "closed": 0}
+        self.coalescer = TimerScheduler("ws_coalesce")
+        self.coalesce_metrics = {"held": 0, "superseded": 0, "batches": 0, "frames_saved": 0, "urgent_bypass": 0}
+        self.topic_subscribers: Dict[str, Dict[str, Any]] = {}  # topic -> {connection_id: connection}
+        self.topic_metrics = {"published": 0, "deliveries": 0, "no_subscribers": 0}
+        # Replay log of fanned-out events: (sequence, target user, target topics, message);
+        # an event with neither target went to everyone.
+        # Ids carry a per-process epoch, so ids from another worker or before a restart
+        # are recognised as unknown instead of resuming from the wrong place.
+        self.event_epoch = uuid.uuid4().hex[:8]
+        self.event_seq = 0
+        self.event_log = deque(maxlen=SSE_REPLAY_BUFFER_SIZE)
+    
+    async def connect(self, websocket: WebSocket, user_id: str, encoding: str = "json", coalesce_window: float = 0) -> ClientConnection:
         await websocket.accept()
-        self.active_connections[user_id] = websocket
-        self.connection_timestamps[user_id] = datetime.now(timezone.utc)
-        print(f"✅ User {user_id} connected to WebSocket at {self.connection_timestamps[user_id]}")
-        
-        # Send any queued messages to the newly connected user
-        if user_id in self.message_queue and len(self.message_queue[user_id]) > 0:
-            queued_count = len(self.message_queue[user_id])
-            print(f"📨 Sending {queued_count} queued messages to user {user_id}")
+        connection = ClientConnection(websocket, user_id, encoding, coalesce_window)
+        self.register(connection)
+        await self.flush_queue(connection)
+        return connection
+    
+    def register(self, connection):
+        """Add a WebSocket or SSE connection to the registry used by every fan-out path"""
+        user_id = connection.user_id
+        self.active_connections.setdefault(user_id, {})[connection.id] = connection
+        self._schedule_heartbeat(connection, random.uniform(0, WS_HEARTBEAT_INTERVAL_SECONDS))
+        print(f"✅ User {user_id} connected via {connection.encoding} at {connection.connected_at} ({len(self.active_connections[user_id])} device(s))")
+    
+    async def flush_queue(self, connection):
+        user_id = connection.user_id
+        # Send any unexpired queued messages to the newly connected user
+        queued_messages = self.offline_queues.pop_all(user_id)
+        if queued_messages:
+            print(f"📨 Sending {len(queued_messages)} queued messages to user {user_id}")
             
-            for queued_message in self.message_queue[user_id]:
+            for queued_message in queued_messages:
                 try:
-                    await websocket.send_text(json.dumps(queued_message))
+                    await connection.send(queued_message)
                     print(f"   ✅ Queued message sent: {queued_message.get('type', 'unknown')}")
                 except Exception as e:
                     print(f"   ❌ Failed to send queued message: {e}")
             
-            # Clear the queue after sending
-            self.message_queue[user_id] = []
             print(f"✅ Message queue cleared for user {user_id}")
     
-    def disconnect(self, user_id: str):
-        if user_id in self.active_connections:
-            connection_duration = (datetime.now(timezone.utc) - self.connection_timestamps.get(user_id, datetime.now(timezone.utc))).total_seconds()
+    def disconnect(self, user_id: str, connection_id: Optional[str] = None):
+        """Drop one connection of a user, or all of them when no connection id is given"""
+        connections = self.active_connections.get(user_id)
+        if not connections:
+            return
+        if connection_id is None:
+            targets = list(connections.values())
+        else:
+            targets = [connections[connection_id]] if connection_id in connections else []
+        for connection in targets:
+            connection_duration = (datetime.now(timezone.utc) - connection.connected_at).total_seconds()
             print(f"🔌 User {user_id} disconnected after {connection_duration:.1f}s")
+            del connections[connection.id]
+            self.heartbeats.cancel(connection.id)
+            self.coalescer.cancel(connection.id)
+            self.unsubscribe(connection)
+        if not connections:
             del self.active_connections[user_id]
-            if user_id in self.connection_timestamps:
-                del self.connection_timestamps[user_id]
+            self._queue_held(user_id, targets)
+    
+    def _queue_held(self, user_id: str, connections: list):
+        """Keep events still held in coalescing windows for the user's next connection"""
+        seen = set()
+        for connection in connections:
+            held, connection.coalesced = connection.coalesced, {}
+            for entries in held.values():
+                for message, _, _ in entries:
+                    # The same fan-out message may be held by several of the user's devices
+                    if id(message) not in seen:
+                        seen.add(id(message))
+                        self._queue_message(user_id, message)
+    
+    def _schedule_heartbeat(self, connection: ClientConnection, delay: float):
+        # Protocol pings only exist on WebSockets; SSE streams always need their comment heartbeat
+        if not WS_PROTOCOL_PINGS or not connection.bidirectional:
+            self.heartbeats.schedule(connection.id, delay, self._heartbeat, connection)
+    
+    def _next_heartbeat_delay(self) -> float:
+        return WS_HEARTBEAT_INTERVAL_SECONDS * random.uniform(1 - WS_HEARTBEAT_JITTER, 1 + WS_HEARTBEAT_JITTER)
+    
+    async def _heartbeat(self, connection: ClientConnection):
+        if connection.id not in self.active_connections.get(connection.user_id, {}):
+            return
+        now = time.monotonic()
+        
+        # SSE streams cannot answer; an SSE comment line just keeps intermediaries from idling them out
+        if not connection.bidirectional:
+            try:
+                await connection.send_frame(": heartbeat\n\n")
+            except Exception:
+                self.disconnect(connection.user_id, connection.id)
+                return
+            self.heartbeat_metrics["sent"] += 1
+            self._schedule_heartbeat(connection, self._next_heartbeat_delay())
+            return
+        
+        # The previous ping got no answer and nothing else arrived since
+        if connection.ping_sent_at is not None:
+            connection.missed_pongs += 1
+            self.heartbeat_metrics["missed_pongs"] += 1
+            if WS_HEARTBEAT_MAX_MISSED and connection.missed_pongs >= WS_HEARTBEAT_MAX_MISSED:
+                print(f"💔 User {connection.user_id} missed {connection.missed_pongs} heartbeats - closing connection")
+                self.heartbeat_metrics["closed"] += 1
+                self.disconnect(connection.user_id, connection.id)
+                try:
+                    await connection.websocket.close(code=1001)
+                except Exception:
+                    pass
+                return
+        
+        # Recent client traffic already proves liveness - check again one interval after it
+        idle = now - connection.last_received
+        if connection.ping_sent_at is None and idle < WS_HEARTBEAT_INTERVAL_SECONDS:
+            self.heartbeat_metrics["skipped"] += 1
+            self._schedule_heartbeat(connection, WS_HEARTBEAT_INTERVAL_SECONDS - idle + random.uniform(0, WS_HEARTBEAT_INTERVAL_SECONDS * WS_HEARTBEAT_JITTER))
+            return
+        
+        try:
+            await connection.send({"type": "heartbeat", "timestamp": datetime.now(timezone.utc).isoformat(), "server_status": "healthy"})
+        except Exception as e:
+            print(f"💔 Heartbeat failed for user {connection.user_id}: {e}")
+            self.disconnect(connection.user_id, connection.id)
+            return
+        if connection.ping_sent_at is None:
+            connection.ping_sent_at = now
+        self.heartbeat_metrics["sent"] += 1
+        self._schedule_heartbeat(connection, self._next_heartbeat_delay())
+    
+    def subscribe(self, connection, topics: List[str]):
+        for topic in topics:
+            if len(connection.topics) >= WS_MAX_TOPICS_PER_CONNECTION:
+                break
+            self.topic_subscribers.setdefault(topic, {})[connection.id] = connection
+            connection.topics.add(topic)
+    
+    def unsubscribe(self, connection, topics: Optional[List[str]] = None):
+        """Remove a connection from some of its topics, or from all of them"""
+        for topic in list(connection.topics if topics is None else topics):
+            subscribers = self.topic_subscribers.get(topic)
+            if subscribers is not None:
+                subscribers.pop(connection.id, None)
+                if not subscribers:
+                    del self.topic_subscribers[topic]
+            connection.topics.discard(topic)
+    
+    def is_connected(self, user_id: str) -> bool:
+        return user_id in self.active_connections
+    
+    def iter_connections(self):
+        for connections in list(self.active_connections.values()):
+            yield from list(connections.values())
+    
+    def _record_event(self, message: dict, user_id: Optional[str] = None, topics: Optional[List[str]] = None) -> str:
+        """Assign the next event id and keep the event for Last-Event-ID replay"""
+        self.event_seq += 1
+        self.event_log.append((self.event_seq, user_id, topics, message))
+        return f"{self.event_epoch}-{self.event_seq}"
+    
+    def events_since(self, last_event_id: str, user_id: str, topics: set = frozenset()) -> Optional[List[tuple]]:
+        """(event_id, message) pairs for `user_id`, subscribed to `topics`, after `last_event_id`
+        
+        None when the id is unknown or already evicted from the log - the client has to refetch.
+        """
+        epoch, _, seq = last_event_id.partition("-")
+        if epoch != self.event_epoch or not seq.isdigit() or int(seq) > self.event_seq:
+            return None
+        seq = int(seq)
+        oldest = self.event_log[0][0] if self.event_log else self.event_seq + 1
+        if seq < oldest - 1:
+            return None
+        return [
+            (f"{self.event_epoch}-{event_seq}", message)
+            for event_seq, target, target_topics, message in self.event_log
+            if event_seq > seq and (
+                target == user_id
+                or (target is None and (target_topics is None or not topics.isdisjoint(target_topics)))
+            )
+        ]
+    
+    async def _deliver(self, connection, message: dict, frames: dict, event_id: Optional[str] = None):
+        """Send a fan-out message to one connection, or hold it in the connection's coalescing window"""
+        if connection.encoding not in frames:
+            frames[connection.encoding] = encode_frame(message, connection.encoding, event_id)
+        key = coalesce_key(message) if connection.coalesce_window else None
+        if key is None:
+            await connection.send_frame(frames[connection.encoding])
+            return
+        if is_urgent_event(message):
+            self.coalesce_metrics["urgent_bypass"] += 1
+            await connection.send_frame(frames[connection.encoding])
+            return
+        
+        entries = connection.coalesced.setdefault(key, [])
+        # A newer snapshot of the same entity supersedes the held one
+        if message.get("type") in SUPERSEDING_EVENT_TYPES:
+            kept = [entry for entry in entries if entry[0].get("type") != message.get("type")]
+            self.coalesce_metrics["superseded"] += len(entries) - len(kept)
+            entries[:] = kept
+        entries.append((message, frames[connection.encoding], event_id))
+        self.coalesce_metrics["held"] += 1
+        if not self.coalescer.is_scheduled(connection.id):
+            self.coalescer.schedule(connection.id, connection.coalesce_window, self._flush_coalesced, connection)
+    
+    async def _flush_coalesced(self, connection):
+        """Send everything held for a connection: one frame per entity"""
+        held, connection.coalesced = connection.coalesced, {}
+        try:
+            for key in list(held):
+                entries = held[key]
+                if len(entries) == 1:
+                    await connection.send_frame(entries[0][1])
+                    del held[key]
+                    continue
+                batch = {
+                    "type": "event_batch",
+                    "entity": key,
+                    "events": [message for message, _, _ in entries],
+                    "timestamp": datetime.now(timezone.utc).isoformat()
+                }
+                await connection.send_frame(encode_frame(batch, connection.encoding, entries[-1][2]))
+                del held[key]
+                self.coalesce_metrics["batches"] += 1
+                self.coalesce_metrics["frames_saved"] += len(entries) - 1
+        except Exception as e:
+            print(f"❌ Coalesced send failed for user {connection.user_id}: {e}")
+            connection.coalesced = held  # Unsent events go to the offline queue on disconnect
+            self.disconnect(connection.user_id, connection.id)
+    
+    async def _send_to_user(self, message: dict, user_id: str) -> int:
+        """Send to every device of a user, dropping dead connections; returns devices reached"""
+        delivered = 0
+        frames = {}
+        event_id = self._record_event(message, user_id)
+        for connection in list(self.active_connections.get(user_id, {}).values()):
+            try:
+                await self._deliver(connection, message, frames, event_id)
+                delivered += 1
+            except Exception as e:
+                print(f"❌ WebSocket send failed for user {user_id}: {e}")
+                self.disconnect(user_id, connection.id)
+        return delivered
     
     async def send_personal_message(self, message: dict, user_id: str):
         if user_id in self.active_connections:
-            try:
-                await self.active_connections[user_id].send_text(json.dumps(message))
+            if await self._send_to_user(message, user_id):
                 print(f"✅ WebSocket message sent successfully to user {user_id}: {message.get('type', 'unknown')}")
                 return True
-            except Exception as e:
-                print(f"❌ WebSocket send failed for user {user_id}: {e}")
-                print(f"📨 Queuing message for user {user_id}")
-                self._queue_message(user_id, message)
-                self.disconnect(user_id)
-                return False
+            print(f"📨 Queuing message for user {user_id}")
+            self._queue_message(user_id, message)
+            return False
         else:
             print(f"⚠️ User {user_id} not in active WebSocket connections - queuing message")
             self._queue_message(user_id, message)
             return False
     
+    async def send_with_ack(self, message: dict, user_id: str, timeout: Optional[float] = None) -> bool:
+        """Send only to the user's devices and wait until one of them acks the message id
+        
+        Returns False when the user has no live connection or no ack arrives in time.
+        """
+        message_id = message.setdefault("message_id", str(uuid.uuid4()))
+        message["requires_ack"] = True
+        future = asyncio.get_running_loop().create_future()
+        self.pending_acks[message_id] = (user_id, future)
+        sent_at = time.monotonic()
+        try:
+            if not await self._send_to_user(message, user_id):
+                self.ack_metrics["undeliverable"] += 1
+                return False
+            self.ack_metrics["sent"] += 1
+            await asyncio.wait_for(future, timeout or WS_ACK_TIMEOUT_SECONDS)
+            latency_ms = (time.monotonic() - sent_at) * 1000
+            self.ack_metrics["acked"] += 1
+            self.ack_latencies_ms.append(latency_ms)
+            print(f"✅ {message.get('type', 'unknown')} {message_id} acked by user {user_id} in {latency_ms:.0f}ms")
+            return True
+        except asyncio.TimeoutError:
+            self.ack_metrics["timed_out"] += 1
+            print(f"⏱️ No ack from user {user_id} for {message.get('type', 'unknown')} {message_id}")
+            return False
+        finally:
+            self.pending_acks.pop(message_id, None)
+    
+    def ack(self, message_id: str, user_id: str):
+        """Resolve a pending delivery; acks from other users are ignored"""
+        pending = self.pending_acks.get(message_id)
+        if pending and pending[0] == user_id and not pending[1].done():
+            pending[1].set_result(True)
+    
+    def schedule_queue_sweep(self):
+        """Expire and evict offline queues periodically, not only when something is queued"""
+        self.queue_sweeper.schedule("sweep", WS_QUEUE_SWEEP_INTERVAL_SECONDS, self._sweep_queues)
+    
+    def _sweep_queues(self):
+        self.schedule_queue_sweep()
+        self.offline_queues.sweep()
+    
     def _queue_message(self, user_id: str, message: dict):
         """Queue a message for delivery when user reconnects"""
-        if user_id not in self.message_queue:
-            self.message_queue[user_id] = []
-        
-        # Add timestamp to message
-        message['queued_at'] = datetime.now(timezone.utc).isoformat()
+        queue_size = self.offline_queues.push(user_id, message)
+        print(f"📨 Message queued for user {user_id} (queue size: {queue_size})")
+    
+    async def publish(self, message: dict, topics: List[str]) -> int:
+        """Send to each connection subscribed to any of `topics`, once; returns connections reached
         
-        # Add to queue (maintain max size)
-        self.message_queue[user_id].append(message)
-        if len(self.message_queue[user_id]) > self.max_queue_size:
-            self.message_queue[user_id] = self.message_queue[user_id][-self.max_queue_size:]
+        Recipients come from the topic index, so the cost follows the subscriber count,
+        not the number of connected users. Users addressed by a personal topic
+        (provider:<id>, doctor:<id>) that no live connection received it for get it
+        queued for their next connection, as with send_personal_message.
+        """
+        recipients = {}
+        for topic in topics:
+            recipients.update(self.topic_subscribers.get(topic, {}))
+        self.topic_metrics["published"] += 1
+        if not recipients:
+            self.topic_metrics["no_subscribers"] += 1
+            self._queue_for_addressed(message, topics, set())
+            return 0
         
-        print(f"📨 Message queued for user {user_id} (queue size: {len(self.message_queue[user_id])})")
-    
-    async def broadcast_to_role(self, message: dict, role: str):
-        """Broadcast message to all users with specific role"""
-        failed_users = []
+        failed_connections = []
         success_count = 0
-        
-        for user_id, websocket in self.active_connections.items():
+        frames = {}
+        event_id = self._record_event(message, topics=topics)
+        for connection in recipients.values():
             try:
-                await websocket.send_text(json.dumps(message))
+                await self._deliver(connection, message, frames, event_id)
                 success_count += 1
-                print(f"✅ Broadcast sent to user {user_id}")
             except Exception as e:
-                print(f"❌ Broadcast failed for user {user_id}: {e}")
-                failed_users.append(user_id)
+                print(f"❌ Publish failed for user {connection.user_id}: {e}")
+                failed_connections.append(connection)
         
-        # Clean up failed connections
-        for user_id in failed_users:
-            self.disconnect(user_id)
-            
-        print(f"📡 Broadcast completed: {success_count} successful, {len(failed_users)} failed")
+        for connection in failed_connections:
+            self.disconnect(connection.user_id, connection.id)
+        reached = {connection.user_id for connection in recipients.values() if connection not in failed_connections}
+        self._queue_for_addressed(message, topics, reached)
+        
+        self.topic_metrics["deliveries"] += success_count
+        print(f"📡 Published {message.get('type', 'unknown')} to {', '.join(topics)}: {success_count} delivered, {len(failed_connections)} failed")
         return success_count
     
+    def _queue_for_addressed(self, message: dict, topics: List[str], reached: set):
+        for topic in topics:
+            kind, _, user_id = topic.partition(":")
+            if kind in PERSONAL_TOPIC_KINDS and user_id not in reached:
+                self._queue_message(user_id, message)
+                reached.add(user_id)  # Once, even if addressed by several topics
+    
+    async def broadcast_to_role(self, message: dict, role: str):
+        """Send message to all connected users with a specific role"""
+        return await self.publish(message, [f"role:{role}"])
+    
     async def broadcast(self, message: dict):
         """Broadcast message to ALL connected users AND queue for offline users"""
-        failed_users = []
+        failed_connections = []
         success_count = 0
+        frames = {}  # Serialize once per encoding, not once per socket
+        event_id = self._record_event(message)
         
-        # Send to all connected users
-        for user_id, websocket in self.active_connections.items():
+        # Send to all connected devices
+        for connection in self.iter_connections():
             try:
-                await websocket.send_text(json.dumps(message))
+                await self._deliver(connection, message, frames, event_id)
                 success_count += 1
-                print(f"✅ Broadcast sent to user {user_id}")
+                print(f"✅ Broadcast sent to user {connection.user_id}")
             except Exception as e:
-                print(f"❌ Broadcast failed for user {user_id}: {e}")
-                failed_users.append(user_id)
-                self._queue_message(user_id, message)
+                print(f"❌ Broadcast failed for user {connection.user_id}: {e}")
+                failed_connections.append(connection)
         
-        # Clean up failed connections
-        for user_id in failed_users:
-            self.disconnect(user_id)
+        # Clean up failed connections, queueing for users left without any device
+        for connection in failed_connections:
+            self.disconnect(connection.user_id, connection.id)
+            if not self.is_connected(connection.user_id):
+                self._queue_message(connection.user_id, message)
         
-        # Also queue for ALL users (even connected ones) as backup
-        # This ensures message delivery even if WebSocket sends fail
-        print(f"📡 Broadcast completed: {success_count} successful, {len(failed_users)} failed")
-        print(f"📡 Total active connections: {len(self.active_connections)}")
+        print(f"📡 Broadcast completed: {success_count} successful, {len(failed_connections)} failed")
+        print(f"📡 Total active connections: {sum(len(c) for c in self.active_connections.values())}")
         
         return success_count
     
     def get_connection_status(self):
         """Get current WebSocket connection status"""
+        latencies = sorted(self.ack_latencies_ms)
+        encodings = {}
+        for connection in self.iter_connections():
+            encodings[connection.encoding] = encodings.get(connection.encoding, 0) + 1
         return {
-            "total_connections": len(self.active_connections),
+            "total_connections": sum(len(connections) for connections in self.active_connections.values()),
+            "connections_by_encoding": encodings,
             "connected_users": list(self.active_connections.keys()),
-            "total_queued_messages": sum(len(queue) for queue in self.message_queue.values()),
-            "users_with_queued_messages": len([u for u, q in self.message_queue.items() if len(q) > 0])
+            "total_queued_messages": self.offline_queues.total_messages,
+            "users_with_queued_messages": len(self.offline_queues.queues),
+            "offline_queues": {
+                **self.offline_queues.get_status(),
+                "sweep_interval_seconds": WS_QUEUE_SWEEP_INTERVAL_SECONDS,
+                "sweep_scheduled": self.queue_sweeper.is_scheduled("sweep")
+            },
+            "acks": {
+                **self.ack_metrics,
+                "pending": len(self.pending_acks),
+                "latency_ms_p50": round(latencies[len(latencies) // 2], 1) if latencies else None,
+                "latency_ms_p95": round(latencies[int(len(latencies) * 0.95)], 1) if latencies else None
+            },
+            "heartbeat": {
+                **self.heartbeat_metrics,
+                "mode": "protocol" if WS_PROTOCOL_PINGS else "application",
+                "interval_seconds": WS_HEARTBEAT_INTERVAL_SECONDS,
+                "scheduled": self.heartbeats.pending_count
+            },
+            "coalescing": {
+                **self.coalesce_metrics,
+                "connections": sum(1 for connection in self.iter_connections() if connection.coalesce_window),
+                "pending_flushes": self.coalescer.pending_count
+            },
+            "topics": {
+                **self.topic_metrics,
+                "topics": len(self.topic_subscribers),
+                "subscriptions": sum(len(subscribers) for subscribers in self.topic_subscribers.values())
+            },
+            "sse": {
+                "streams": sum(1 for connection in self.iter_connections() if not connection.bidirectional),
+                "replay_buffer": len(self.event_log),
+                "last_event_id": f"{self.event_epoch}-{self.event_seq}"
+            }
         }
 
-# WebSocket connection manager for video calls
+# WebRTC signaling hub for video calls
+# Each socket in a room gets its own peer id. Relayed messages are serialized once
+# and sent to all recipients concurrently, and trickled ICE candidates are
+# coalesced into short batches.
+ICE_BATCH_WINDOW_SECONDS = 0.05
+
+class SignalingPeer:
+    def __init__(self, websocket: WebSocket):
+        self.id = f"peer-{uuid.uuid4().hex[:12]}"
+        self.websocket = websocket
+        self.user_id: Optional[str] = None  # Set by the client's join message
+        self.user_name: Optional[str] = None
+        self.pending_ice: Dict[Optional[str], List[dict]] = {}  # target peer (None = everyone) -> candidates
+
+class SignalingRoom:
+    def __init__(self, session_token: str):
+        self.session_token = session_token
+        self.peers: Dict[str, SignalingPeer] = {}
+        self.created_at = datetime.now(timezone.utc)
+        self.metrics = {"messages_relayed": 0, "frames_sent": 0, "bytes_sent": 0, "ice_candidates": 0, "ice_batches": 0}
+        self.relay_latencies_ms = deque(maxlen=200)
+    
+    def get_status(self) -> dict:
+        latencies = sorted(self.relay_latencies_ms)
+        return {
+            "participants": len(self.peers),
+            "created_at": self.created_at.isoformat(),
+            **self.metrics,
+            "relay_latency_ms_p50": round(latencies[len(latencies) // 2], 2) if latencies else None,
+            "relay_latency_ms_p95": round(latencies[int(len(latencies) * 0.95)], 2) if latencies else None
+        }
+
+# Session-token lookups for video signaling, so reconnect storms and invalid-token
+# floods don't each reach MongoDB. Entries are per worker: other workers see an
+# ended session once their cached entry expires.
+SESSION_TOKEN_TTL_SECONDS = int(os.environ.get('SESSION_TOKEN_TTL_SECONDS', '60'))
+SESSION_TOKEN_NEGATIVE_TTL_SECONDS = int(os.environ.get('SESSION_TOKEN_NEGATIVE_TTL_SECONDS', '15'))
+SESSION_TOKEN_ENDED_TTL_SECONDS = 86400  # Tokens ended here are refused for at least this long
+
+class SessionTokenCache:
+    def __init__(self, maxsize: int = 10000):
+        self.valid = TTLCache(maxsize=maxsize, ttl=SESSION_TOKEN_TTL_SECONDS)  # token -> session document
+        self.invalid = TTLCache(maxsize=maxsize, ttl=SESSION_TOKEN_NEGATIVE_TTL_SECONDS)  # tokens known not to exist
+        self.ended = TTLCache(maxsize=maxsize, ttl=SESSION_TOKEN_ENDED_TTL_SECONDS)  # tokens invalidated by this worker
+        self.metrics = {"hits": 0, "negative_hits": 0, "misses": 0}
+    
+    async def lookup(self, session_token: str) -> Optional[dict]:
+        """The live (not ended) video session for a token, or None"""
+        if self.is_ended(session_token):
+            self.metrics["negative_hits"] += 1
+            return None
+        if session_token in self.valid:
+            self.metrics["hits"] += 1
+            return self.valid[session_token]
+        if session_token in self.invalid:
+            self.metrics["negative_hits"] += 1
+            return None
+        self.metrics["misses"] += 1
+        session = await db.video_sessions.find_one({"session_token": session_token, "ended_at": None}, {"_id": 0})
+        if session:
+            self.valid[session_token] = session
+        else:
+            self.invalid[session_token] = True
+        return session
+    
+    def remember(self, session: dict):
+        """Prime the cache when a video session is created"""
+        self.invalid.pop(session["session_token"], None)
+        self.valid[session["session_token"]] = session
+    
+    def invalidate(self, session_token: str):
+        self.valid.pop(session_token, None)
+        self.invalid[session_token] = True
+        self.ended[session_token] = True
+    
+    def is_ended(self, session_token: str) -> bool:
+        return session_token in self.ended
+    
+    def get_status(self) -> dict:
+        return {**self.metrics, "valid_entries": len(self.valid), "invalid_entries": len(self.invalid), "ended_entries": len(self.ended)}
+
+session_token_cache = SessionTokenCache()
+
+async def end_video_sessions(appointment_id: str):
+    """Mark an appointment's open video sessions ended and stop accepting their tokens"""
+    tokens = await db.video_sessions.distinct("session_token", {"appointment_id": appointment_id, "ended_at": None})
+    if not tokens:
+        return
+    await db.video_sessions.update_many(
+        {"session_token": {"$in": tokens}},
+        {"$set": {"ended_at": datetime.now(timezone.utc), "status": "ended"}}
+    )
+    for session_token in tokens:
+        session_token_cache.invalidate(session_token)
+
 class VideoCallManager:
     def __init__(self):
-        self.active_sessions: Dict[str, Dict[str, WebSocket]] = {}  # session_token -> {user_id: websocket}
+        self.active_sessions: Dict[str, SignalingRoom] = {}  # session_token -> room
     
-    async def join_session(self, session_token: str, user_id: str, websocket: WebSocket, user_name: str):
-        await websocket.accept()
-        
-        if session_token not in self.active_sessions:
-            self.active_sessions[session_token] = {}
-        
-        self.active_sessions[session_token][user_id] = websocket
-        
-        # Notify other users in the session
-        for other_user_id, other_ws in self.active_sessions[session_token].items():
-            if other_user_id != user_id:
-                try:
-                    await other_ws.send_text(json.dumps({
-                        "type": "user-joined",
-                        "userId": user_id,
-                        "userName": user_name
-                    }))
-                except Exception:
-                    pass
+    async def validate_token(self, session_token: str) -> bool:
+        """A live room means its token was already validated, unless the session was ended since"""
+        if session_token_cache.is_ended(session_token):
+            return False
+        if session_token in self.active_sessions:
+            return True
+        return await session_token_cache.lookup(session_token) is not None
     
-    def leave_session(self, session_token: str, user_id: str):
-        if session_token in self.active_sessions and user_id in self.active_sessions[session_token]:
-            # Notify other users
-            for other_user_id, other_ws in self.active_sessions[session_token].items():
-                if other_user_id != user_id:
-                    try:
-                        asyncio.create_task(other_ws.send_text(json.dumps({
-                            "type": "user-left",
-                            "userId": user_id
-                        })))
-                    except Exception:
-                        pass
-            
-            del self.active_sessions[session_token][user_id]
-            
+    async def join_room(self, session_token: str, websocket: WebSocket) -> SignalingPeer:
+        room = self.active_sessions.setdefault(session_token, SignalingRoom(session_token))
+        peer = SignalingPeer(websocket)
+        room.peers[peer.id] = peer
+        await websocket.send_text(json.dumps({
+            "type": "connection-established",
+            "session": session_token,
+            "userId": peer.id,
+            "peers": [other.id for other in room.peers.values() if other is not peer]
+        }))
+        print(f"🔌 Video call session active: {len(room.peers)} participants")
+        return peer
+    
+    async def leave_room(self, session_token: str, peer: SignalingPeer):
+        room = self.active_sessions.get(session_token)
+        if not room or room.peers.pop(peer.id, None) is None:
+            return
+        if room.peers:
+            await self._send(room, {"type": "user-left", "userId": peer.id}, list(room.peers.values()))
+        else:
             # Remove session if empty
-            if not self.active_sessions[session_token]:
-                del self.active_sessions[session_token]
+            del self.active_sessions[session_token]
     
-    async def relay_message(self, session_token: str, from_user_id: str, message: dict):
-        if session_token in self.active_sessions:
-            target_user_id = message.get('target')
-            
-            # If target specified, send only to target
-            if target_user_id and target_user_id in self.active_sessions[session_token]:
-                try:
-                    message['from'] = from_user_id
-                    await self.active_sessions[session_token][target_user_id].send_text(json.dumps(message))
-                except Exception:
-                    pass
-            else:
-                # Broadcast to all other users in session
-                for user_id, ws in self.active_sessions[session_token].items():
-                    if user_id != from_user_id:
-                        try:
-                            message['from'] = from_user_id
-                            await ws.send_text(json.dumps(message))
-                        except Exception:
-                            pass
+    async def handle_message(self, session_token: str, peer: SignalingPeer, message: dict):
+        room = self.active_sessions.get(session_token)
+        if not room:
+            return
+        message_type = message.get("type")
+        
+        if message_type == "join":
+            # Announce the newcomer to everyone already in the room; they send the offers
+            peer.user_id = message.get("userId")
+            peer.user_name = message.get("userName")
+            others = [other for other in room.peers.values() if other is not peer]
+            await self._send(room, {"type": "user-joined", "userId": peer.id, "userName": peer.user_name}, others)
+        elif message_type == "ice-candidate":
+            target = message.get("target")
+            batch = peer.pending_ice.setdefault(target, [])
+            batch.append(message.get("candidate"))
+            room.metrics["ice_candidates"] += 1
+            if len(batch) == 1:
+                run_in_background(self._flush_ice(room, peer, target))
+        else:
+            await self.relay_message(room, peer, message)
+    
+    async def _flush_ice(self, room: SignalingRoom, peer: SignalingPeer, target: Optional[str]):
+        await asyncio.sleep(ICE_BATCH_WINDOW_SECONDS)
+        candidates = peer.pending_ice.pop(target, [])
+        if candidates and peer.id in room.peers:
+            room.metrics["ice_batches"] += 1
+            await self.relay_message(room, peer, {"type": "ice-candidates", "candidates": candidates, "target": target})
+    
+    async def relay_message(self, room: SignalingRoom, peer: SignalingPeer, message: dict):
+        started = time.monotonic()
+        target_peer_id = message.get("target")
+        
+        # If target specified, send only to target; otherwise to all other participants
+        if target_peer_id:
+            recipients = [room.peers[target_peer_id]] if target_peer_id in room.peers else []
+        else:
+            recipients = [other for other in room.peers.values() if other is not peer]
+        if not recipients:
+            return
+        
+        await self._send(room, {**message, "from": peer.id}, recipients)
+        room.metrics["messages_relayed"] += 1
+        room.relay_latencies_ms.append((time.monotonic() - started) * 1000)
+    
+    async def _send(self, room: SignalingRoom, message: dict, recipients: List[SignalingPeer]):
+        frame = json.dumps(message)
+        results = await asyncio.gather(*(recipient.websocket.send_text(frame) for recipient in recipients), return_exceptions=True)
+        delivered = sum(1 for result in results if not isinstance(result, Exception))
+        room.metrics["frames_sent"] += delivered
+        room.metrics["bytes_sent"] += delivered * len(frame)
+    
+    def get_status(self) -> dict:
+        return {
+            "rooms": len(self.active_sessions),
+            "participants": sum(len(room.peers) for room in self.active_sessions.values()),
+            "sessions": {token[:8]: room.get_status() for token, room in self.active_sessions.items()},
+            "token_cache": session_token_cache.get_status()
+        }
 
 # Call monitoring and auto-redial system
+# Call sessions live in the `call_sessions` collection so every worker gives the
+# same status answer and timers survive restarts. Pending timers are stored on
+# the session document; the worker holding the session's lease arms them in its
+# local TimerScheduler, and a lease that stops being renewed is taken over.
+WORKER_ID = f"{os.uname().nodename}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+CALL_LEASE_SECONDS = 30
+CALL_STATUS_CACHE_SECONDS = 2
+
+def as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """MongoDB returns naive UTC datetimes - make them timezone-aware"""
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
 class CallSession:
     def __init__(self, appointment_id: str, caller_id: str, provider_id: str):
         self.appointment_id = appointment_id
@@ -317,67 +976,165 @@ class CallSession:
         self.provider_id = provider_id
         self.start_time = datetime.now(timezone.utc)
         self.end_time = None
-        self.status = "active"  # active, ended, completed
+        self.status = "active"  # active, stable, ended
         self.retry_count = 0
         self.max_retries = 3
+    
+    def to_document(self) -> dict:
+        return {
+            "_id": self.appointment_id,
+            "caller_id": self.caller_id,
+            "provider_id": self.provider_id,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "status": self.status,
+            "retry_count": self.retry_count,
+            "max_retries": self.max_retries
+        }
+    
+    @classmethod
+    def from_document(cls, doc: dict) -> "CallSession":
+        call_session = cls(doc["_id"], doc["caller_id"], doc["provider_id"])
+        call_session.start_time = as_utc(doc["start_time"])
+        call_session.end_time = as_utc(doc.get("end_time"))
+        call_session.status = doc["status"]
+        call_session.retry_count = doc.get("retry_count", 0)
+        call_session.max_retries = doc.get("max_retries", 3)
+        return call_session
         
 class CallManager:
     def __init__(self):
-        self.active_calls: Dict[str, CallSession] = {}  # appointment_id -> CallSession
         self.retry_delay = 30  # seconds between retries
+        self.stable_after = 300  # seconds before an active call is considered stable
+        self.stale_after = 2 * 60 * 60  # seconds before a never-ended call session is expired
+        # One scheduler drives monitoring, redial and expiry timers for the sessions this worker leases
+        self.timers = TimerScheduler("call_timers")
+        # Small per-worker read cache for status polling, invalidated on writes and change events
+        self.status_cache = TTLCache(maxsize=1000, ttl=CALL_STATUS_CACHE_SECONDS)
+    
+    def start(self):
+        """Start timers, lease renewal/takeover and cross-worker cache invalidation"""
+        self.timers.start()
+        asyncio.create_task(self.lease_loop())
+        asyncio.create_task(self.watch_invalidations())
+    
+    def _lease(self) -> dict:
+        return {"lease_owner": WORKER_ID, "lease_expires_at": datetime.now(timezone.utc) + timedelta(seconds=CALL_LEASE_SECONDS)}
+    
+    def _arm(self, appointment_id: str, timers: dict):
+        """Mirror the session's persisted timers into the local scheduler"""
+        now = datetime.now(timezone.utc)
+        for kind in ["monitor", "redial", "expire"]:
+            due_at = as_utc(timers.get(kind))
+            if due_at is None:
+                self.timers.cancel((kind, appointment_id))
+            else:
+                delay = max(0.0, (due_at - now).total_seconds())
+                self.timers.schedule((kind, appointment_id), delay, self._fire, kind, appointment_id)
+    
+    def _disarm(self, appointment_id: str):
+        self._arm(appointment_id, {})
     
-    def start_call(self, appointment_id: str, caller_id: str, provider_id: str):
+    async def start_call(self, appointment_id: str, caller_id: str, provider_id: str):
         """Record that a call has started"""
         call_session = CallSession(appointment_id, caller_id, provider_id)
-        self.active_calls[appointment_id] = call_session
-        print(f"📞 Call session started: {appointment_id} between {caller_id} and {provider_id}")
+        now = datetime.now(timezone.utc)
         
-        # Schedule call monitoring
-        asyncio.create_task(self.monitor_call(appointment_id))
+        # Schedule call monitoring and stale-session expiry (replaces timers of a previous session)
+        timers = {
+            "monitor": now + timedelta(seconds=self.stable_after),
+            "expire": now + timedelta(seconds=self.stale_after)
+        }
+        await db.call_sessions.replace_one(
+            {"_id": appointment_id},
+            {**call_session.to_document(), "timers": timers, **self._lease(), "updated_at": now},
+            upsert=True
+        )
+        self._arm(appointment_id, timers)
+        self.status_cache.pop(appointment_id, None)
+        print(f"📞 Call session started: {appointment_id} between {caller_id} and {provider_id}")
         
         return call_session
     
-    def end_call(self, appointment_id: str, reason: str = "normal"):
+    async def end_call(self, appointment_id: str, reason: str = "normal", allow_redial: bool = True):
         """Mark a call as ended"""
-        if appointment_id in self.active_calls:
-            call_session = self.active_calls[appointment_id]
-            call_session.end_time = datetime.now(timezone.utc)
-            call_session.status = "ended"
-            
-            call_duration = (call_session.end_time - call_session.start_time).total_seconds()
-            print(f"📞 Call ended: {appointment_id}, duration: {call_duration}s, reason: {reason}")
-            
-            # If call ended too quickly (less than 2 minutes), schedule auto-redial
-            if call_duration < 120 and call_session.retry_count < call_session.max_retries:
-                print(f"⏰ Call ended too quickly ({call_duration}s), scheduling auto-redial")
-                asyncio.create_task(self.schedule_redial(appointment_id))
-            else:
-                # Remove from active calls
-                del self.active_calls[appointment_id]
-    
-    async def monitor_call(self, appointment_id: str):
-        """Monitor call session and detect if it becomes inactive"""
-        await asyncio.sleep(300)  # Wait 5 minutes
+        doc = await db.call_sessions.find_one({"_id": appointment_id})
+        if not doc:
+            return
+        call_session = CallSession.from_document(doc)
+        call_session.end_time = datetime.now(timezone.utc)
+        call_session.status = "ended"
+        self.status_cache.pop(appointment_id, None)
+        
+        call_duration = (call_session.end_time - call_session.start_time).total_seconds()
+        print(f"📞 Call ended: {appointment_id}, duration: {call_duration}s, reason: {reason}")
+        
+        # If call ended too quickly (less than 2 minutes), schedule auto-redial
+        if allow_redial and call_duration < 120 and call_session.retry_count < call_session.max_retries:
+            print(f"⏰ Call ended too quickly ({call_duration}s), scheduling auto-redial")
+            call_session.retry_count += 1
+            timers = {
+                "redial": call_session.end_time + timedelta(seconds=self.retry_delay),
+                "expire": doc.get("timers", {}).get("expire")
+            }
+            timers = {kind: due_at for kind, due_at in timers.items() if due_at}
+            await db.call_sessions.update_one(
+                {"_id": appointment_id},
+                {"$set": {
+                    "end_time": call_session.end_time,
+                    "status": call_session.status,
+                    "retry_count": call_session.retry_count,
+                    "timers": timers,
+                    **self._lease(),
+                    "updated_at": call_session.end_time
+                }}
+            )
+            self._arm(appointment_id, timers)
+            print(f"🔄 Auto-redial scheduled for {appointment_id} (attempt {call_session.retry_count}/{call_session.max_retries})")
+        else:
+            # Remove from active calls
+            await self._remove_call(appointment_id)
+    
+    async def _remove_call(self, appointment_id: str):
+        await db.call_sessions.delete_one({"_id": appointment_id})
+        self._disarm(appointment_id)
+        self.status_cache.pop(appointment_id, None)
+    
+    async def _fire(self, kind: str, appointment_id: str):
+        """Run a due timer if this worker still owns the session's lease"""
+        doc = await db.call_sessions.find_one_and_update(
+            {"_id": appointment_id, "lease_owner": WORKER_ID, f"timers.{kind}": {"$exists": True}},
+            {"$unset": {f"timers.{kind}": ""}}
+        )
+        if not doc:
+            return  # Ended, rescheduled, or taken over by another worker
+        self.status_cache.pop(appointment_id, None)
+        call_session = CallSession.from_document(doc)
         
-        if appointment_id in self.active_calls:
-            call_session = self.active_calls[appointment_id]
+        if kind == "monitor":
             if call_session.status == "active":
                 # Call has been active for 5+ minutes, assume it's legitimate
+                await db.call_sessions.update_one({"_id": appointment_id, "status": "active"}, {"$set": {"status": "stable"}})
                 print(f"📞 Call {appointment_id} marked as stable after 5 minutes")
-                call_session.status = "stable"
-    
-    async def schedule_redial(self, appointment_id: str):
-        """Schedule automatic redialing after call ends prematurely"""
-        if appointment_id not in self.active_calls:
-            return
-            
-        call_session = self.active_calls[appointment_id]
-        call_session.retry_count += 1
-        
-        print(f"🔄 Auto-redial scheduled for {appointment_id} (attempt {call_session.retry_count}/{call_session.max_retries})")
+        elif kind == "expire":
+            print(f"⌛ Call session {appointment_id} expired after {self.stale_after}s without ending")
+            await self._remove_call(appointment_id)
+        elif kind == "redial":
+            await self.redial(call_session)
+    
+    async def redial(self, call_session: CallSession):
+        """Send the redial invitation once the retry delay has passed"""
+        appointment_id = call_session.appointment_id
         
-        # Wait for retry delay
-        await asyncio.sleep(self.retry_delay)
+        # Ring the room of the attempt the doctor actually opened
+        latest_call = await db.call_attempts.find_one(
+            {"appointment_id": appointment_id},
+            sort=[("initiated_at", -1)]
+        )
+        if not latest_call:
+            print(f"⚠️ No call attempt recorded for {appointment_id}, skipping auto-redial")
+            await self._remove_call(appointment_id)
+            return
         
         # Send redial notification to provider
         redial_notification = {
@@ -389,62 +1146,232 @@ class CallManager:
             "caller_role": "doctor",
             "retry_attempt": call_session.retry_count,
             "max_retries": call_session.max_retries,
-            "jitsi_url": f"https://meet.jit.si/greenstar-{appointment_id}",
-            "room_name": f"greenstar-{appointment_id}"
+            "call_id": latest_call["call_id"],
+            "call_attempt": latest_call["attempt_number"],
+            "jitsi_url": latest_call["jitsi_url"],
+            "room_name": latest_call["room_name"]
         }
         
-        # Send notification to provider
-        await manager.send_personal_message(redial_notification, call_session.provider_id)
-        print(f"📨 Auto-redial notification sent to provider {call_session.provider_id}")
-        
-        # Update call session for new attempt
-        call_session.start_time = datetime.now(timezone.utc)
-        call_session.status = "active"
+        # Send notification to the provider's devices, with push fallback
+        method = await deliver_call_event(
+            redial_notification,
+            call_session.provider_id,
+            f"📞 {redial_notification['title']}",
+            redial_notification["message"],
+            {
+                "type": "jitsi_call_invitation",
+                "appointment_id": appointment_id,
+                "jitsi_url": latest_call["jitsi_url"],
+                "room_name": latest_call["room_name"],
+                "call_id": latest_call["call_id"],
+                "call_attempt": latest_call["attempt_number"]
+            }
+        )
+        print(f"📨 Auto-redial notification sent to provider {call_session.provider_id} via {method}")
         
-        # Monitor the new call attempt
-        asyncio.create_task(self.monitor_call(appointment_id))
+        # Update call session for new attempt and monitor it
+        now = datetime.now(timezone.utc)
+        monitor_at = now + timedelta(seconds=self.stable_after)
+        await db.call_sessions.update_one(
+            {"_id": appointment_id},
+            {"$set": {"start_time": now, "status": "active", "timers.monitor": monitor_at, "updated_at": now}}
+        )
+        self.timers.schedule(("monitor", appointment_id), self.stable_after, self._fire, "monitor", appointment_id)
+        self.status_cache.pop(appointment_id, None)
+    
+    async def lease_loop(self):
+        """Renew this worker's leases and take over sessions whose owner stopped renewing"""
+        while True:
+            try:
+                await db.call_sessions.update_many({"lease_owner": WORKER_ID}, {"$set": self._lease()})
+                while True:
+                    doc = await db.call_sessions.find_one_and_update(
+                        {"lease_expires_at": {"$lt": datetime.now(timezone.utc)}, "timers": {"$exists": True, "$ne": {}}},
+                        {"$set": self._lease()},
+                        return_document=ReturnDocument.AFTER
+                    )
+                    if not doc:
+                        break
+                    self._arm(doc["_id"], doc["timers"])
+                    print(f"🤝 Worker {WORKER_ID} took over call session {doc['_id']}")
+            except Exception as e:
+                print(f"❌ Call session lease error: {e}")
+            await asyncio.sleep(CALL_LEASE_SECONDS / 3)
+    
+    async def watch_invalidations(self):
+        """Drop cached statuses when another worker changes a session (needs a replica set)"""
+        try:
+            async with db.call_sessions.watch() as stream:
+                async for change in stream:
+                    self.status_cache.pop(change["documentKey"]["_id"], None)
+        except OperationFailure as e:
+            print(f"⚠️ Call session change stream unavailable, status cache relies on its {CALL_STATUS_CACHE_SECONDS}s TTL: {e}")
+        except Exception as e:
+            print(f"❌ Call session change stream error: {e}")
+    
+    async def get_call_session(self, appointment_id: str) -> Optional[CallSession]:
+        """Current session for an appointment, served from the read cache when fresh"""
+        if appointment_id in self.status_cache:
+            return self.status_cache[appointment_id]
+        doc = await db.call_sessions.find_one({"_id": appointment_id})
+        call_session = CallSession.from_document(doc) if doc else None
+        self.status_cache[appointment_id] = call_session
+        return call_session
+    
+    @property
+    def pending_timers(self) -> int:
+        return self.timers.pending_count
+
+# Appointment list versions are shared by all workers; each worker polls the change log
+# this often for writes made by the others
+APPOINTMENT_FEED_POLL_SECONDS = float(os.environ.get('APPOINTMENT_FEED_POLL_SECONDS', '1'))
 
 manager = ConnectionManager()
 video_call_manager = VideoCallManager()
 call_manager = CallManager()
+job_runner = JobRunner(db, manager.send_personal_message)
+appointment_changes = SharedChangeFeed("appointments", db, poll_interval=APPOINTMENT_FEED_POLL_SECONDS)
+admin_stats = AdminStatsCache(db, lambda: {"connections": {
+    "connected_users": len(manager.active_connections),
+    "total_connections": sum(len(connections) for connections in manager.active_connections.values())
+}})
+
+# Fire-and-forget tasks started from request handlers, referenced until done
+background_tasks: set = set()
+
+def run_in_background(coroutine):
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+# Long-poll clients wait on this instead of refetching the appointment list on a timer
+APPOINTMENT_WAIT_DEFAULT_SECONDS = 25
+APPOINTMENT_WAIT_MAX_SECONDS = 55  # Stay below common proxy read timeouts (60s)
+
+# Change events carry the appointment as listed by GET /appointments plus the list version
+# it produced, so clients update their list in place instead of all refetching at once.
+# Every delivery of such an event is a refetch saved.
+refetch_metrics = {"entity_events": 0, "refetches_saved": 0, "list_fetches": 0}
+
+async def publish_appointment_change(change_type: str, appointment: Optional[dict]) -> dict:
+    """Bump the appointment list version and return the change for event payloads
+    
+    `appointment` None means the whole list changed and clients have to refetch.
+    """
+    entity = None
+    if appointment and change_type != "deleted":
+        entity = jsonable_encoder((await enrich_appointments([appointment]))[0])
+    appointment = appointment or {}
+    change = {
+        "type": change_type,
+        "appointment_id": appointment.get("id"),
+        "provider_id": appointment.get("provider_id"),
+        "doctor_id": appointment.get("doctor_id"),
+        "district": appointment.get("district"),
+        "appointment": entity
+    }
+    version = await appointment_changes.publish(change)
+    return {**change, "list_version": version}
+
+def carries_entity(message: dict) -> bool:
+    """Whether a client can apply the event to its list without refetching"""
+    if message.get("type") == "appointment_deleted":
+        return bool(message.get("appointment_id"))
+    return message.get("appointment") is not None or message.get("user") is not None
+
+async def publish_entity_event(message: dict, topics: List[str]) -> int:
+    """Publish an event that carries its entity, counting the refetches it replaces"""
+    delivered = await manager.publish(message, topics)
+    if carries_entity(message):
+        refetch_metrics["entity_events"] += 1
+        refetch_metrics["refetches_saved"] += delivered
+    return delivered
+
+def appointment_change_visible(change: dict, user: "User", all_districts: bool = False) -> bool:
+    # Mirrors GET /appointments: providers only see their own appointments, doctors their district's
+    if user.role == "provider":
+        return change["provider_id"] in (None, user.id)
+    if user.role == "doctor" and user.district and not all_districts:
+        return change["district"] in (None, user.district) or change["doctor_id"] == user.id
+    return True
+
+async def topic_allowed(topic: str, user_id: str, role: Optional[str]) -> bool:
+    """Whether a user may subscribe to a topic - the same visibility as GET /appointments"""
+    kind, _, value = topic.partition(":")
+    if kind not in TOPIC_KINDS:
+        return False
+    if role == "admin":
+        return True
+    if kind == "role":
+        return value == role
+    if kind == "provider":
+        return value == user_id or role == "doctor"
+    if kind == "doctor":
+        return value == user_id
+    if kind == "district":
+        return role == "doctor"  # Any district, including the cross-district view
+    if kind == "appointment":
+        if role == "doctor":
+            return True
+        appointment = await db.appointments.find_one({"id": value}, {"_id": 0, "provider_id": 1})
+        return role == "provider" and bool(appointment) and appointment["provider_id"] == user_id
+    return False
+
+async def deliver_call_event(message: dict, user_id: str, push_title: str, push_body: str, push_data: dict) -> str:
+    """Deliver a call event to the user's own devices, falling back to FCM when no device acks in time"""
+    if await manager.send_with_ack(message, user_id):
+        return "websocket"
+    try:
+        await send_notification_to_user(db, user_id, push_title, push_body, {**push_data, "message_id": message["message_id"]})
+        print(f"📱 FCM fallback sent to user {user_id} for {message['type']}")
+        return "fcm"
+    except Exception as e:
+        print(f"⚠️ Error sending FCM fallback to user {user_id}: {e}")
+        return "failed"
+
+# Indexes backing the hot query paths and archival
+async def ensure_indexes():
+    """Create indexes used by list reads, archival and archived lookups (idempotent)"""
+    index_specs = {
+        "appointments": [
+            [("id", 1)], [("provider_id", 1)], [("doctor_id", 1)], [("status", 1), ("updated_at", 1)],
+            [("district", 1), ("status", 1), ("created_at", 1)],
+            [("status", 1), ("district", 1), ("priority", -1), ("created_at", 1)]  # Dispatch queue
+        ],
+        "appointment_notes": [[("appointment_id", 1)]],
+        "call_attempts": [[("appointment_id", 1)]],
+        "call_sessions": [[("lease_owner", 1)], [("lease_expires_at", 1)]],
+        "video_sessions": [[("session_token", 1)], [("appointment_id", 1)]],
+        "patients": [[("id", 1)]],
+        "users": [[("role", 1), ("district", 1)]],
+        "appointments" + ARCHIVE_SUFFIX: [[("id", 1)], [("provider_id", 1)], [("doctor_id", 1)], [("district", 1)]],
+        "appointment_notes" + ARCHIVE_SUFFIX: [[("appointment_id", 1)]],
+        "call_attempts" + ARCHIVE_SUFFIX: [[("appointment_id", 1)]],
+        "patients" + ARCHIVE_SUFFIX: [[("id", 1)]],
+    }
+    for collection, indexes in index_specs.items():
+        for keys in indexes:
+            try:
+                await db[collection].create_index(keys)
+            except PyMongoError as e:
+                print(f"⚠️ Failed to create index {keys} on {collection}: {e}")
+    print("🗂️ Database indexes ensured")
 
-# WebSocket heartbeat task
-async def websocket_heartbeat():
-    """Send periodic heartbeat to all connected clients"""
-    while True:
-        try:
-            await asyncio.sleep(30)  # Send heartbeat every 30 seconds
-            if manager.active_connections:
-                heartbeat_message = {
-                    "type": "heartbeat",
-                    "timestamp": datetime.now(timezone.utc).isoformat(),
-                    "server_status": "healthy"
-                }
-                
-                failed_connections = []
-                for user_id, websocket in manager.active_connections.items():
-                    try:
-                        await websocket.send_text(json.dumps(heartbeat_message))
-                    except Exception as e:
-                        print(f"💔 Heartbeat failed for user {user_id}: {e}")
-                        failed_connections.append(user_id)
-                
-                # Clean up failed connections
-                for user_id in failed_connections:
-                    manager.disconnect(user_id)
-                    
-                if failed_connections:
-                    print(f"🧹 Cleaned up {len(failed_connections)} failed connections")
-                else:
-                    print(f"💓 Heartbeat sent to {len(manager.active_connections)} connections")
-        except Exception as e:
-            print(f"❌ Heartbeat system error: {e}")
-
-# Start heartbeat task
+# Start background tasks
 @app.on_event("startup")
 async def startup_event():
-    asyncio.create_task(websocket_heartbeat())
+    manager.heartbeats.start()
     print("🚀 WebSocket heartbeat system started")
+    manager.schedule_queue_sweep()
+    await appointment_changes.start()
+    call_manager.start()
+    await ensure_indexes()
+    await ensure_retention_indexes(db)
+    asyncio.create_task(abandoned_sessions_loop(db))
+    asyncio.create_task(archive_loop(db))
+    print("🗄️ Appointment archival scheduler started")
+    asyncio.create_task(counters_reconcile_loop(db))
 
 # Pydantic Models and Constants
 class UserRole:
@@ -506,6 +1433,7 @@ class Appointment(BaseModel):
     consultation_notes: Optional[str] = None
     doctor_notes: Optional[str] = None  # Notes from doctor to provider
     call_history: List[Dict[str, Any]] = Field(default_factory=list)  # Track multiple calls
+    call_attempt_count: int = 0  # Atomic counter behind call attempt numbers
     scheduled_time: Optional[datetime] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -513,6 +1441,13 @@ class Appointment(BaseModel):
     # Multiple account support - each appointment belongs to specific provider
     provider_name: Optional[str] = None  # For easy filtering and display
     doctor_name: Optional[str] = None   # Track which doctor is handling
+    
+    # Denormalized patient summary so list reads and notifications don't join `patients`
+    patient: Optional[Dict[str, Any]] = None
+    
+    # District of the creating provider; doctor lists and events are partitioned by it
+    district: Optional[str] = None
+    priority: int = 0  # Dispatch order, from DISPATCH_PRIORITIES
 
 class AppointmentCreate(BaseModel):
     patient: PatientCreate
@@ -622,7 +1557,7 @@ async def send_push_notification(user_id: str, payload: PushNotificationPayload)
                     # Mark subscription as inactive if it fails
                     await db.push_subscriptions.update_one(
                         {"_id": sub_doc["_id"]},
-                        {"$set": {"active": False}}
+                        {"$set": {"active": False, "deactivated_at": datetime.now(timezone.utc)}}
                     )
                     
             except WebPushException as e:
@@ -630,7 +1565,7 @@ async def send_push_notification(user_id: str, payload: PushNotificationPayload)
                 # Mark subscription as inactive
                 await db.push_subscriptions.update_one(
                     {"_id": sub_doc["_id"]},
-                    {"$set": {"active": False}}
+                    {"$set": {"active": False, "deactivated_at": datetime.now(timezone.utc)}}
                 )
             except Exception as e:
                 print(f"Unexpected error sending push notification: {e}")
@@ -667,7 +1602,7 @@ async def send_appointment_reminder_notifications(appointment_id: str):
         if doctor_id:
             doctor_payload = PushNotificationPayload(
                 title="Appointment Reminder", 
-                body=f"You have an upcoming consultation with {appointment['patient_name']}",
+                body=f"You have an upcoming consultation with {appointment.get('patient', {}).get('name', 'your patient')}",
                 type="appointment_reminder",
                 data={
                     "appointment_id": appointment_id,
@@ -734,8 +1669,11 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await user_from_token(credentials.credentials)
+
+async def user_from_token(token: str) -> "User":
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             raise HTTPException(status_code=401, detail="Invalid authentication credentials")
@@ -801,13 +1739,13 @@ async def create_user_admin(user: UserCreate, current_user: User = Depends(get_c
         "username": new_user.username,
         "role": new_user.role,
         "created_by": current_user.full_name,
+        "user": jsonable_encoder(new_user),
         "message": f"New user {new_user.full_name} ({new_user.role}) created by {current_user.full_name}",
-        "timestamp": datetime.now(timezone.utc).isoformat(),
-        "force_refresh": True
+        "timestamp": datetime.now(timezone.utc).isoformat()
     }
-    await manager.broadcast(user_creation_notification)
+    await publish_entity_event(user_creation_notification, ["admin"])
     
-    print("📡 BROADCAST: User creation notification sent to all users")
+    print("📡 PUBLISH: User creation notification sent to admins")
     print(f"   User: {new_user.full_name} ({new_user.username})")
     print(f"   Role: {new_user.role}")
     print(f"   Created by: {current_user.full_name}")
@@ -850,6 +1788,34 @@ async def get_current_user_profile(current_user: User = Depends(get_current_user
     """Get current user's profile - used for token validation across devices"""
     return {k: v for k, v in current_user.dict().items() if k not in ["hashed_password"]}
 
+@api_router.get("/me/counters")
+async def get_my_counters(current_user: User = Depends(get_current_user)):
+    """Appointment counts by status for the current user's dashboard badges
+    
+    Providers get their own appointments, doctors the ones assigned to them plus the
+    shared pending queue of their district (appointments without a district included),
+    admins the totals. Read from maintained counters, not counted.
+    """
+    if current_user.role == "provider":
+        keys = [f"provider:{current_user.id}"]
+    elif current_user.role == "doctor" and current_user.district:
+        keys = [f"doctor:{current_user.id}", district_counter_key(current_user.district), district_counter_key(None)]
+    elif current_user.role == "doctor":
+        keys = [f"doctor:{current_user.id}", "all"]
+    else:
+        keys = ["all"]
+    
+    try:
+        counters = await get_counters(db, keys)
+    except PyMongoError as e:
+        print(f"❌ Error reading counters for {current_user.id}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to load counters")
+    
+    result = {"role": current_user.role, "counters": counters[keys[0]]}
+    if current_user.role == "doctor":
+        result["pending_queue"] = sum(counters[key]["pending"] for key in keys[1:])
+    return result
+
 @api_router.get("/users/{user_role}", response_model=List[User])
 async def get_users_by_role(user_role: str, current_user: User = Depends(get_current_user)):
     users = await db.users.find({"role": user_role, "is_active": True}).to_list(1000)
@@ -893,7 +1859,7 @@ async def delete_user(user_id: str, current_user: User = Depends(get_current_use
         }}
     )
     
-    # Broadcast deletion to ALL users for instant UI update
+    # Tell admin dashboards for instant UI update
     user_deletion_notification = {
         "type": "user_deleted",
         "user_id": user_id,
@@ -904,17 +1870,21 @@ async def delete_user(user_id: str, current_user: User = Depends(get_current_use
         "timestamp": datetime.now(timezone.utc).isoformat(),
         "force_refresh": True
     }
-    await manager.broadcast(user_deletion_notification)
+    await manager.publish(user_deletion_notification, ["admin"])
     
-    print("📡 BROADCAST: User soft deletion notification sent to all users")
+    print("📡 PUBLISH: User soft deletion notification sent to admins")
     print(f"   User: {user['full_name']} ({user_id})")
     print(f"   Deleted by: {current_user.full_name}")
     
     return {"message": f"User {user['full_name']} soft deleted successfully"}
 
-@api_router.delete("/admin/users/{user_id}/permanent")
+@api_router.delete("/admin/users/{user_id}/permanent", status_code=http_status.HTTP_202_ACCEPTED)
 async def permanent_delete_user(user_id: str, current_user: User = Depends(get_current_user)):
-    """Permanently delete user and all associated data - Admin only"""
+    """Permanently delete user and all associated data - Admin only
+    
+    The cascade runs as a background job; progress is reported over WebSocket
+    (admin_job_progress) and at GET /api/admin/jobs/{job_id}.
+    """
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Only administrators can permanently delete users")
     
@@ -926,30 +1896,112 @@ async def permanent_delete_user(user_id: str, current_user: User = Depends(get_c
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Delete user and all associated data
-    await db.users.delete_one({"id": user_id})
-    await db.appointments.delete_many({"provider_id": user_id})
-    await db.appointments.delete_many({"doctor_id": user_id})
-    await db.appointment_notes.delete_many({"created_by": user_id})
+    async def run_cascade(context):
+        result = await permanent_delete_user_job(db, user_id, context)
+        await publish_appointment_change("reset", None)
+        
+        # Tell admin dashboards for instant UI update
+        user_permanent_deletion_notification = {
+            "type": "user_permanently_deleted",
+            "user_id": user_id,
+            "user_name": user['full_name'],
+            "deletion_type": "permanent",
+            "deleted_by": current_user.full_name,
+            "message": f"User {user['full_name']} has been permanently removed",
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "force_refresh": True
+        }
+        await manager.publish(user_permanent_deletion_notification, ["admin"])
+        manager.offline_queues.drop(user_id)  # The user will never reconnect to receive it
+        
+        print("📡 PUBLISH: User permanent deletion notification sent to admins")
+        print(f"   User: {user['full_name']} ({user_id})")
+        print(f"   Permanently deleted by: {current_user.full_name}")
+        return result
+    
+    job = await job_runner.start(
+        "permanent_delete_user",
+        current_user.id,
+        {"user_id": user_id, "user_name": user["full_name"]},
+        run_cascade
+    )
     
-    # Broadcast permanent deletion to ALL users for instant UI update
-    user_permanent_deletion_notification = {
-        "type": "user_permanently_deleted",
-        "user_id": user_id,
-        "user_name": user['full_name'],
-        "deletion_type": "permanent",
-        "deleted_by": current_user.full_name,
-        "message": f"User {user['full_name']} has been permanently removed",
-        "timestamp": datetime.now(timezone.utc).isoformat(),
-        "force_refresh": True
+    return {
+        "message": f"Permanent deletion of user {user['full_name']} started",
+        "job_id": job["id"],
+        "status": job["status"]
     }
-    await manager.broadcast(user_permanent_deletion_notification)
+
+@api_router.post("/admin/archive/run", status_code=http_status.HTTP_202_ACCEPTED)
+async def run_appointment_archival(older_than_days: Optional[int] = None, current_user: User = Depends(get_current_user)):
+    """Archive finished appointments now instead of waiting for the scheduler - Admin only"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    if older_than_days is not None and older_than_days < 0:
+        raise HTTPException(status_code=400, detail="older_than_days must not be negative")
     
-    print("📡 BROADCAST: User permanent deletion notification sent to all users")
-    print(f"   User: {user['full_name']} ({user_id})")
-    print(f"   Permanently deleted by: {current_user.full_name}")
+    async def run_archival(context):
+        return await archive_finished_appointments(db, context, older_than_days)
+    
+    job = await job_runner.start("archive_appointments", current_user.id, {"older_than_days": older_than_days}, run_archival)
+    return {"message": "Appointment archival started", "job_id": job["id"], "status": job["status"]}
+
+@api_router.get("/admin/storage")
+async def get_storage_report(current_user: User = Depends(get_current_user)):
+    """Per-collection document counts, sizes and retention policies - Admin only"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    try:
+        report = await storage_report(db)
+    except PyMongoError as e:
+        print(f"❌ Error building storage report: {e}")
+        raise HTTPException(status_code=500, detail="Failed to collect storage statistics")
+    return {**report, "timestamp": datetime.now(timezone.utc).isoformat()}
+
+@api_router.get("/admin/stats")
+async def get_admin_stats(request: Request, response: Response, current_user: User = Depends(get_current_user)):
+    """Dashboard counts by role, status, type and district - Admin only
+    
+    Served from a short-lived cache; send the previous ETag in If-None-Match to get a 304 when nothing changed.
+    """
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    try:
+        stats = await admin_stats.get()
+    except PyMongoError as e:
+        print(f"❌ Error computing admin stats: {e}")
+        raise HTTPException(status_code=500, detail="Failed to compute statistics")
+    
+    cache_headers = {"ETag": f'W/"{stats["version"]}"', "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == cache_headers["ETag"]:
+        return Response(status_code=http_status.HTTP_304_NOT_MODIFIED, headers=cache_headers)
+    response.headers.update(cache_headers)
+    return stats
+
+@api_router.post("/admin/counters/reconcile", status_code=http_status.HTTP_202_ACCEPTED)
+async def run_counter_reconciliation(current_user: User = Depends(get_current_user)):
+    """Recount per-user appointment counters from the appointments collection - Admin only"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    async def run_reconcile(context):
+        return await reconcile_counters(db, context)
+    
+    job = await job_runner.start("reconcile_counters", current_user.id, {}, run_reconcile)
+    return {"message": "Counter reconciliation started", "job_id": job["id"], "status": job["status"]}
+
+@api_router.get("/admin/jobs/{job_id}")
+async def get_admin_job(job_id: str, current_user: User = Depends(get_current_user)):
+    """Get status and progress of a background admin job - Admin only"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
     
-    return {"message": f"User {user['full_name']} permanently deleted successfully"}
+    job = await job_runner.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 @api_router.put("/users/{user_id}/status")
 async def update_user_status(user_id: str, status_update: dict, current_user: User = Depends(get_current_user)):
@@ -1028,19 +2080,57 @@ async def update_user(user_id: str, user_update: dict, current_user: User = Depe
     updated_user = await db.users.find_one({"id": user_id})
     return {k: v for k, v in updated_user.items() if k not in ["hashed_password", "_id"]}
 
+# Appointment helpers
+PATIENT_SNAPSHOT_FIELDS = ["id", "name", "age", "gender", "vitals", "history", "area_of_consultation", "created_at"]
+
+def patient_snapshot(patient: dict) -> dict:
+    """Patient summary embedded in appointment documents"""
+    return {field: patient.get(field) for field in PATIENT_SNAPSHOT_FIELDS}
+
+async def insert_appointment_with_patient(patient_doc: dict, appointment_doc: dict):
+    """Insert a patient and its appointment as a single atomic unit.
+    
+    Runs both inserts in one multi-document transaction committed with majority
+    write concern. Standalone servers (local development) cannot run
+    transactions, so there we fall back to majority-acknowledged inserts and
+    remove the patient again if the appointment insert fails.
+    """
+    global TRANSACTIONS_SUPPORTED
+    
+    if TRANSACTIONS_SUPPORTED is not False:
+        async def insert_both(session):
+            await db.patients.insert_one(patient_doc, session=session)
+            await db.appointments.insert_one(appointment_doc, session=session)
+        
+        try:
+            async with await client.start_session() as session:
+                await session.with_transaction(insert_both, write_concern=MAJORITY_WRITE_CONCERN)
+            TRANSACTIONS_SUPPORTED = True
+            return
+        except OperationFailure as e:
+            # IllegalOperation: transaction numbers need a replica set member or mongos
+            if e.code != 20:
+                raise
+            TRANSACTIONS_SUPPORTED = False
+            print("⚠️ MongoDB transactions unavailable (standalone server) - using compensating writes")
+    
+    patients = db.patients.with_options(write_concern=MAJORITY_WRITE_CONCERN)
+    appointments = db.appointments.with_options(write_concern=MAJORITY_WRITE_CONCERN)
+    await patients.insert_one(patient_doc)
+    try:
+        await appointments.insert_one(appointment_doc)
+    except PyMongoError:
+        await patients.delete_one({"id": patient_doc["id"]})
+        raise
+
 # Appointment endpoints
 @api_router.post("/appointments", response_model=Appointment)
 async def create_appointment(appointment_data: AppointmentCreate, current_user: User = Depends(get_current_user)):
     if current_user.role != "provider":
         raise HTTPException(status_code=403, detail="Only providers can create appointments")
     
-    # Create patient record
+    # Create patient and appointment records
     patient = Patient(**appointment_data.patient.dict())
-    patient_insert_result = await db.patients.insert_one(patient.dict())
-    
-    # Wait for write to be acknowledged
-    if not patient_insert_result.acknowledged:
-        raise HTTPException(status_code=500, detail="Failed to create patient record")
     
     # Create appointment with enhanced multiple account support
     appointment = Appointment(
@@ -1049,64 +2139,53 @@ async def create_appointment(appointment_data: AppointmentCreate, current_user:
         provider_name=current_user.full_name,  # For easy filtering per provider account
         appointment_type=appointment_data.appointment_type,
         consultation_notes=appointment_data.consultation_notes,
-        call_history=[]  # Initialize empty call history
+        call_history=[],  # Initialize empty call history
+        patient=patient_snapshot(patient.dict()),
+        district=current_user.district,
+        priority=DISPATCH_PRIORITIES.get(appointment_data.appointment_type, 0)
     )
     
-    appointment_insert_result = await db.appointments.insert_one(appointment.dict())
-    
-    # CRITICAL: Wait for write to be acknowledged before returning
-    if not appointment_insert_result.acknowledged:
+    # CRITICAL: Both documents are written atomically and majority-acknowledged
+    # before returning, so no read-back is needed to confirm durability
+    try:
+        await insert_appointment_with_patient(patient.dict(), appointment.dict())
+    except PyMongoError as e:
+        print(f"❌ Appointment creation failed: {e}")
         raise HTTPException(status_code=500, detail="Failed to create appointment")
+    await apply_appointment_change(db, None, appointment.dict())
+    change = await publish_appointment_change("created", appointment.dict())
     
-    # Double-check the appointment was actually written to database
-    db_check = await db.appointments.find_one({"id": appointment.id})
-    if not db_check:
-        raise HTTPException(status_code=500, detail="Appointment creation not confirmed in database")
-    
-    print(f"✅ Appointment created and confirmed in database: {appointment.id}")
+    print(f"✅ Appointment created and committed: {appointment.id}")
     print(f"   Provider ID: {current_user.id}")
     print(f"   Patient: {patient.name}")
     print(f"   Type: {appointment.appointment_type}")
     
-    # Send DETAILED notification to ALL users for INSTANT sync
+    # Send DETAILED notification to ALL users for INSTANT sync - the full appointment
+    # lets dashboards add it to their list without refetching
     full_appointment_data = {
         "type": "new_appointment_created",
         "appointment_id": appointment.id,
-        "appointment": {
-            "id": appointment.id,
-            "patient": {
-                "name": patient.name,
-                "age": patient.age,
-                "gender": patient.gender,
-                "history": patient.history,
-                "area_of_consultation": patient.area_of_consultation,
-                "vitals": patient.vitals
-            },
-            "provider_id": current_user.id,
-            "provider_name": current_user.full_name,
-            "appointment_type": appointment.appointment_type,
-            "status": "pending",
-            "consultation_notes": appointment.consultation_notes,
-            "created_at": appointment.created_at.isoformat(),
-            "call_history": []
-        },
+        "appointment": change["appointment"],
+        "list_version": change["list_version"],
         "message": f"🚨 NEW {appointment.appointment_type.upper()} APPOINTMENT: {patient.name}",
         "timestamp": datetime.now(timezone.utc).isoformat(),
-        "force_refresh": True,  # Flag to force immediate refresh
         "show_in_notification": True  # Show full details in notification panel
     }
     
-    # Broadcast to ALL connected users (doctors AND providers)
-    await manager.broadcast(full_appointment_data)
+    # Doctors, admins and the creating provider's devices
+    await publish_entity_event(full_appointment_data, appointment_topics(appointment.dict()))
     
-    print("📡 BROADCAST: New appointment notification sent to all users")
+    print("📡 PUBLISH: New appointment notification sent to doctors, admins and provider")
     print(f"   Patient: {patient.name}")
     print(f"   Type: {appointment.appointment_type}")
     print(f"   Provider: {current_user.full_name}")
     
-    # Send FCM Push Notifications to all doctors
+    # Send FCM Push Notifications to the doctors who will see it
     try:
-        doctors = await db.users.find({"role": "doctor"}).to_list(100)
+        doctor_query = {"role": "doctor"}
+        if appointment.district:
+            doctor_query["district"] = {"$in": [appointment.district, None]}
+        doctors = await db.users.find(doctor_query).to_list(100)
         for doctor in doctors:
             if "fcm_token" in doctor and doctor["fcm_token"]:
                 await send_notification_to_user(
@@ -1127,48 +2206,171 @@ async def create_appointment(appointment_data: AppointmentCreate, current_user:
     
     return appointment
 
+def doctor_appointments_query(doctor: User, all_districts: bool = False) -> dict:
+    """A doctor's district, appointments without a district and their own, unless all districts are asked for"""
+    if all_districts or not doctor.district:
+        return {}
+    return {"$or": [{"district": {"$in": [doctor.district, None]}}, {"doctor_id": doctor.id}]}
+
 @api_router.get("/appointments", response_model=List[dict])
-async def get_appointments(current_user: User = Depends(get_current_user)):
+async def get_appointments(include_archived: bool = False, all_districts: bool = False, current_user: User = Depends(get_current_user)):
     print(f"📋 GET /appointments called by user: {current_user.full_name} (ID: {current_user.id}, Role: {current_user.role})")
     
     if current_user.role == "provider":
         # Providers can ONLY see their own created appointments
         print(f"🔍 Provider querying appointments with provider_id: {current_user.id}")
-        appointments = await db.appointments.find({"provider_id": current_user.id}).to_list(1000)
-        print(f"📊 Found {len(appointments)} appointments for provider {current_user.id}")
+        query = {"provider_id": current_user.id}
     elif current_user.role == "doctor":
-        # Doctors can see ALL appointments (not just pending or their own)
-        appointments = await db.appointments.find().to_list(1000)
-        print(f"📊 Found {len(appointments)} total appointments for doctor")
+        # Doctors see their district's appointments, or every district when they opt in
+        query = doctor_appointments_query(current_user, all_districts)
     elif current_user.role == "admin":
-        # Admins can see all appointments
-        appointments = await db.appointments.find().to_list(1000)
-        print(f"📊 Found {len(appointments)} total appointments for admin")
+        # Admins can see ALL appointments
+        query = {}
     else:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    # Enrich with patient and user details
+    appointments = await db.appointments.find(query).to_list(1000)
+    print(f"📊 Found {len(appointments)} appointments for {current_user.role} {current_user.id}")
+    
+    # Archived (finished, aged-out) appointments are only read when explicitly requested
+    if include_archived:
+        archived = await db["appointments" + ARCHIVE_SUFFIX].find(query).to_list(1000)
+        appointments.extend({**appointment, "archived": True} for appointment in archived)
+        print(f"🗄️ Including {len(archived)} archived appointments")
+    
+    refetch_metrics["list_fetches"] += 1
+    return await enrich_appointments(appointments)
+
+async def enrich_appointments(appointments: List[dict]) -> List[dict]:
+    """Appointments as listed by GET /appointments, with patient, provider and doctor attached"""
+    # Patients are embedded on the appointment, users are fetched in one batched
+    # query instead of per appointment
+    appointments = [{k: v for k, v in appointment.items() if k != "_id"} for appointment in appointments]
+    
+    # Appointments created before the patient snapshot existed still need a lookup
+    legacy_patient_ids = [a["patient_id"] for a in appointments if not a.get("patient")]
+    patients_by_id = {}
+    if legacy_patient_ids:
+        patients = await db.patients.find({"id": {"$in": legacy_patient_ids}}, {"_id": 0}).to_list(None)
+        patients_by_id = {p["id"]: p for p in patients}
+    
+    user_ids = {a["provider_id"] for a in appointments} | {a["doctor_id"] for a in appointments if a.get("doctor_id")}
+    users = await db.users.find({"id": {"$in": list(user_ids)}}, {"_id": 0, "hashed_password": 0}).to_list(None)
+    users_by_id = {u["id"]: u for u in users}
+    
     enriched_appointments = []
     for appointment in appointments:
-        # Remove MongoDB _id field from appointment
-        appointment = {k: v for k, v in appointment.items() if k != "_id"}
-        
-        patient = await db.patients.find_one({"id": appointment["patient_id"]})
-        provider = await db.users.find_one({"id": appointment["provider_id"]})
-        doctor = None
-        if appointment.get("doctor_id"):
-            doctor = await db.users.find_one({"id": appointment["doctor_id"]})
-        
         enriched_appointment = {
             **appointment,
-            "patient": {k: v for k, v in patient.items() if k != "_id"} if patient else None,
-            "provider": {k: v for k, v in provider.items() if k not in ["hashed_password", "_id"]} if provider else None,
-            "doctor": {k: v for k, v in doctor.items() if k not in ["hashed_password", "_id"]} if doctor else None
+            "patient": appointment.get("patient") or patients_by_id.get(appointment["patient_id"]),
+            "provider": users_by_id.get(appointment["provider_id"]),
+            "doctor": users_by_id.get(appointment["doctor_id"]) if appointment.get("doctor_id") else None
         }
         enriched_appointments.append(enriched_appointment)
     
     return enriched_appointments
 
+@api_router.get("/appointments/changes/wait")
+async def wait_for_appointment_changes(since: Optional[int] = None, timeout: float = APPOINTMENT_WAIT_DEFAULT_SECONDS, all_districts: bool = False, current_user: User = Depends(get_current_user)):
+    """Long-poll for appointment list changes
+    
+    Without `since` the current version is returned at once. With it, the request is held
+    until an appointment the caller can see changes or `timeout` seconds pass. Each change
+    carries the appointment as listed (deletions only the id), so clients apply it in place
+    and wait again from `version`. A change of type "reset", or `resync` when the changes
+    since `since` are no longer known, means the client has to refetch /appointments.
+    """
+    if since is None:
+        return {"version": appointment_changes.version, "changed": False, "changes": []}
+    timeout = min(max(timeout, 0), APPOINTMENT_WAIT_MAX_SECONDS)
+    
+    changes = await appointment_changes.wait_for_changes(since, timeout, lambda change: appointment_change_visible(change, current_user, all_districts))
+    if changes and all(change["type"] != "reset" for change in changes):
+        refetch_metrics["refetches_saved"] += 1
+    return {
+        # Never behind `since`, which may come from a worker this one has not caught up with
+        "version": appointment_changes.version if changes is None else max(since, appointment_changes.version),
+        "changed": changes is None or bool(changes),
+        "resync": changes is None,
+        "changes": [
+            {key: change[key] for key in ("type", "appointment_id", "appointment", "version")}
+            for change in changes or []
+        ]
+    }
+
+def dispatch_query(user: User, all_districts: bool = False) -> dict:
+    """Unassigned pending appointments a user can claim - the doctor's district unless all are asked for"""
+    query = {"status": "pending", "doctor_id": None}
+    if user.role == "doctor" and user.district and not all_districts:
+        query["district"] = {"$in": [user.district, None]}
+    return query
+
+@api_router.get("/dispatch/queue")
+async def get_dispatch_queue(limit: int = 20, all_districts: bool = False, current_user: User = Depends(get_current_user)):
+    """Unassigned pending appointments in the order claim-next hands them out"""
+    if current_user.role not in ["doctor", "admin"]:
+        raise HTTPException(status_code=403, detail="Only doctors and admins can view the dispatch queue")
+    limit = min(max(limit, 1), 100)
+    appointments = await db.appointments.find(dispatch_query(current_user, all_districts)).sort(DISPATCH_SORT).to_list(limit)
+    return {"appointments": await enrich_appointments(appointments), "count": len(appointments)}
+
+@api_router.post("/dispatch/claim-next")
+async def claim_next_appointment(all_districts: bool = False, current_user: User = Depends(get_current_user)):
+    """Assign the most urgent unassigned pending appointment to the calling doctor
+    
+    Selecting and assigning is a single find_one_and_update, so concurrent claims
+    never get the same appointment. Only the claimed appointment's provider and
+    topics are notified, instead of every doctor racing on the same list.
+    """
+    if current_user.role != "doctor":
+        raise HTTPException(status_code=403, detail="Only doctors can claim appointments")
+    
+    claimed = await db.appointments.find_one_and_update(
+        dispatch_query(current_user, all_districts),
+        {"$set": {
+            "status": "accepted",
+            "doctor_id": current_user.id,
+            "doctor_name": current_user.full_name,
+            "updated_at": datetime.now(timezone.utc)
+        }},
+        sort=DISPATCH_SORT,
+        return_document=ReturnDocument.AFTER
+    )
+    if not claimed:
+        return {"claimed": False, "appointment": None}
+    
+    await apply_appointment_change(db, {**claimed, "status": "pending", "doctor_id": None}, claimed)
+    change = await publish_appointment_change("updated", claimed)
+    print(f"🚑 Appointment {claimed['id']} ({claimed.get('appointment_type')}) claimed by Dr. {current_user.full_name}")
+    
+    patient = claimed.get("patient") or {}
+    await manager.send_personal_message({
+        "type": "appointment_accepted",
+        "appointment_id": claimed["id"],
+        "patient_name": patient.get("name", "Unknown"),
+        "doctor_name": current_user.full_name,
+        "doctor_specialty": current_user.specialty or "General Medicine",
+        "appointment_type": claimed.get("appointment_type", "non_emergency"),
+        "accepted_at": datetime.now(timezone.utc).isoformat(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "appointment": change["appointment"],
+        "list_version": change["list_version"]
+    }, claimed["provider_id"])
+    await publish_entity_event({
+        "type": "appointment_updated",
+        "appointment_id": claimed["id"],
+        "patient_name": patient.get("name", "Unknown"),
+        "updated_by": current_user.full_name,
+        "updated_by_role": current_user.role,
+        "update_fields": ["status", "doctor_id", "doctor_name"],
+        "appointment": change["appointment"],
+        "list_version": change["list_version"],
+        "message": f"Appointment claimed by Dr. {current_user.full_name}",
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    }, appointment_topics(claimed))
+    
+    return {"claimed": True, "appointment": change["appointment"]}
+
 @api_router.put("/appointments/{appointment_id}", response_model=Appointment)
 async def update_appointment(appointment_id: str, update_data: AppointmentUpdate, current_user: User = Depends(get_current_user)):
     appointment = await db.appointments.find_one({"id": appointment_id})
@@ -1190,16 +2392,38 @@ async def update_appointment(appointment_id: str, update_data: AppointmentUpdate
         raise HTTPException(status_code=403, detail="Access denied")
     
     update_dict = update_data.dict(exclude_unset=True)
+    query = {"id": appointment_id}
+    accepting = current_user.role == "doctor" and update_dict.get("status") == "accepted"
+    if accepting:
+        # Accepting only succeeds while no other doctor holds the appointment, so of
+        # two doctors accepting at once one gets a conflict instead of being overwritten
+        update_dict.setdefault("doctor_id", current_user.id)
+        query["doctor_id"] = {"$in": [None, current_user.id]}
+    updated_appointment = appointment
+    change = None
     if update_dict:
         update_dict["updated_at"] = datetime.now(timezone.utc)
-        await db.appointments.update_one({"id": appointment_id}, {"$set": update_dict})
-    
-    updated_appointment = await db.appointments.find_one({"id": appointment_id})
+        # The pre-image lets counters move from the state actually replaced, even
+        # if another request changed the appointment since it was read above
+        previous = await db.appointments.find_one_and_update(
+            query,
+            {"$set": update_dict},
+            return_document=ReturnDocument.BEFORE
+        )
+        if not previous and accepting:
+            raise HTTPException(status_code=409, detail="Appointment was already accepted by another doctor")
+        if not previous:
+            raise HTTPException(status_code=404, detail="Appointment not found")
+        updated_appointment = {**previous, **update_dict}
+        await apply_appointment_change(db, previous, updated_appointment)
+        change = await publish_appointment_change("updated", updated_appointment)
     
     # Send notifications for important updates
     if update_dict:
         # Get appointment details for notifications
         patient = appointment.get("patient", {})
+        # Every event carries the updated appointment, so no recipient has to refetch
+        entity = {"appointment": change["appointment"], "list_version": change["list_version"]}
         
         # If status changed to accepted by doctor, notify provider
         if update_dict.get("status") == "accepted" and current_user.role == "doctor":
@@ -1213,7 +2437,8 @@ async def update_appointment(appointment_id: str, update_data: AppointmentUpdate
                     "doctor_specialty": current_user.specialty or "General Medicine",
                     "appointment_type": appointment.get("appointment_type", "non_emergency"),
                     "accepted_at": datetime.now(timezone.utc).isoformat(),
-                    "timestamp": datetime.now(timezone.utc).isoformat()
+                    "timestamp": datetime.now(timezone.utc).isoformat(),
+                    **entity
                 }
                 await manager.send_personal_message(notification, provider_id)
         
@@ -1228,7 +2453,8 @@ async def update_appointment(appointment_id: str, update_data: AppointmentUpdate
                     "doctor_name": current_user.full_name,
                     "appointment_type": appointment.get("appointment_type", "non_emergency"),
                     "rejected_at": datetime.now(timezone.utc).isoformat(),
-                    "timestamp": datetime.now(timezone.utc).isoformat()
+                    "timestamp": datetime.now(timezone.utc).isoformat(),
+                    **entity
                 }
                 await manager.send_personal_message(notification, provider_id)
         
@@ -1238,7 +2464,8 @@ async def update_appointment(appointment_id: str, update_data: AppointmentUpdate
             "appointment_id": appointment_id,
             "patient_name": patient.get("name", "Unknown"),
             "updated_by": current_user.full_name,
-            "timestamp": datetime.now(timezone.utc).isoformat()
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            **entity
         }
         
         # Notify provider if they're not the one making the update
@@ -1251,7 +2478,7 @@ async def update_appointment(appointment_id: str, update_data: AppointmentUpdate
         if doctor_id and doctor_id != current_user.id:
             await manager.send_personal_message(general_notification, doctor_id)
         
-        # BROADCAST to ALL users for instant dashboard sync
+        # Publish to everyone whose dashboard lists the appointment
         broadcast_notification = {
             "type": "appointment_updated",
             "appointment_id": appointment_id,
@@ -1259,13 +2486,13 @@ async def update_appointment(appointment_id: str, update_data: AppointmentUpdate
             "updated_by": current_user.full_name,
             "updated_by_role": current_user.role,
             "update_fields": list(update_dict.keys()),
+            **entity,
             "message": f"Appointment updated by {current_user.full_name}",
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "force_refresh": True
+            "timestamp": datetime.now(timezone.utc).isoformat()
         }
-        await manager.broadcast(broadcast_notification)
+        await publish_entity_event(broadcast_notification, appointment_topics(updated_appointment))
         
-        print("📡 BROADCAST: Appointment update notification sent to all users")
+        print("📡 PUBLISH: Appointment update notification sent to appointment topics")
         print(f"   Appointment ID: {appointment_id}")
         print(f"   Updated by: {current_user.full_name} ({current_user.role})")
         print(f"   Fields updated: {list(update_dict.keys())}")
@@ -1305,12 +2532,18 @@ async def add_appointment_note(appointment_id: str, note_data: AppointmentNote,
     
     await db.appointment_notes.insert_one(note_doc)
     
-    # Update appointment with latest note
+    # Update appointment with latest note - notes_count also versions the details ETag
     if current_user.role == "doctor":
-        await db.appointments.update_one(
-            {"id": appointment_id}, 
-            {"$set": {"doctor_notes": note_data.note, "updated_at": datetime.now(timezone.utc)}}
-        )
+        note_update = {
+            "$set": {"doctor_notes": note_data.note, "updated_at": datetime.now(timezone.utc)},
+            "$inc": {"notes_count": 1}
+        }
+    else:
+        note_update = {"$inc": {"notes_count": 1}}
+    updated_appointment = await db.appointments.find_one_and_update(
+        {"id": appointment_id}, note_update, return_document=ReturnDocument.AFTER
+    )
+    change = await publish_appointment_change("note_added", updated_appointment or appointment)
     
     # CRITICAL: Send real-time notification about new note
     note_notification = {
@@ -1324,7 +2557,8 @@ async def add_appointment_note(appointment_id: str, note_data: AppointmentNote,
         "appointment_type": appointment.get("appointment_type", "unknown"),
         "message": f"📝 New note from {current_user.role.title()}: {current_user.full_name}",
         "timestamp": note_doc["timestamp"].isoformat(),
-        "force_refresh": True
+        "appointment": change["appointment"],
+        "list_version": change["list_version"]
     }
     
     # Send to the other party (doctor → provider or provider → doctor)
@@ -1338,23 +2572,24 @@ async def add_appointment_note(appointment_id: str, note_data: AppointmentNote,
             await manager.send_personal_message(note_notification, appointment["doctor_id"])
             print(f"📤 Note notification sent to doctor: {appointment['doctor_id']}")
         else:
-            # If no doctor assigned yet, broadcast to all doctors
-            await manager.broadcast({
+            # If no doctor assigned yet, tell all doctors
+            await manager.publish({
                 **note_notification,
                 "broadcast_to": "doctors",
                 "message": f"📝 New provider note (unassigned): {current_user.full_name}"
-            })
+            }, doctor_topics(appointment.get("district")))
     
-    # Also broadcast to admin panel for real-time updates
-    await manager.broadcast({
+    # Also update the lists of everyone following the appointment
+    await publish_entity_event({
         "type": "note_activity",
         "action": "note_added",
         "appointment_id": appointment_id,
         "sender": current_user.full_name,
         "sender_role": current_user.role,
         "timestamp": note_doc["timestamp"].isoformat(),
-        "force_refresh": True
-    })
+        "appointment": change["appointment"],
+        "list_version": change["list_version"]
+    }, appointment_topics(appointment))
     
     print(f"✅ Note saved and notifications sent - ID: {note_doc['id']}")
     return {"message": "Note added successfully", "note_id": note_doc["id"]}
@@ -1362,7 +2597,7 @@ async def add_appointment_note(appointment_id: str, note_data: AppointmentNote,
 @api_router.get("/appointments/{appointment_id}/notes")
 async def get_appointment_notes(appointment_id: str, current_user: User = Depends(get_current_user)):
     """Get all notes for an appointment"""
-    appointment = await db.appointments.find_one({"id": appointment_id})
+    appointment = await find_appointment(db, appointment_id)
     if not appointment:
         raise HTTPException(status_code=404, detail="Appointment not found")
     
@@ -1381,7 +2616,8 @@ async def get_appointment_notes(appointment_id: str, current_user: User = Depend
     else:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    notes = await db.appointment_notes.find({"appointment_id": appointment_id}).to_list(1000)
+    notes_collection = collection_for(db, "appointment_notes", appointment.get("archived", False))
+    notes = await notes_collection.find({"appointment_id": appointment_id}).to_list(1000)
     
     # Clean MongoDB ObjectId fields
     cleaned_notes = []
@@ -1411,12 +2647,17 @@ async def delete_appointment(appointment_id: str, current_user: User = Depends(g
     else:
         raise HTTPException(status_code=403, detail="Only admins and providers can delete appointments")
     
-    # Delete appointment and related data
-    await db.appointments.delete_one({"id": appointment_id})
+    # Delete appointment and related data; only the request that actually removed
+    # the document adjusts the counters
+    deleted = await db.appointments.find_one_and_delete({"id": appointment_id})
+    list_version = appointment_changes.version
+    if deleted:
+        await apply_appointment_change(db, deleted, None)
+        list_version = (await publish_appointment_change("deleted", deleted))["list_version"]
     await db.appointment_notes.delete_many({"appointment_id": appointment_id})
     await db.patients.delete_one({"id": appointment["patient_id"]})
     
-    # Broadcast deletion to ALL users for instant UI update
+    # Publish deletion to everyone whose dashboard lists the appointment
     deletion_notification = {
         "type": "appointment_deleted",
         "appointment_id": appointment_id,
@@ -1424,45 +2665,68 @@ async def delete_appointment(appointment_id: str, current_user: User = Depends(g
         "deleted_by_role": current_user.role,
         "message": f"Appointment deleted by {current_user.full_name}",
         "timestamp": datetime.now(timezone.utc).isoformat(),
-        "force_refresh": True
+        "list_version": list_version
     }
-    await manager.broadcast(deletion_notification)
+    await publish_entity_event(deletion_notification, appointment_topics(appointment))
     
-    print("📡 BROADCAST: Appointment deletion notification sent to all users")
+    print("📡 PUBLISH: Appointment deletion notification sent to appointment topics")
     print(f"   Appointment ID: {appointment_id}")
     print(f"   Deleted by: {current_user.full_name} ({current_user.role})")
     
     return {"message": "Appointment deleted successfully"}
 
-@api_router.delete("/admin/appointments/cleanup")
+@api_router.delete("/admin/appointments/cleanup", status_code=http_status.HTTP_202_ACCEPTED)
 async def cleanup_all_appointments(current_user: User = Depends(get_current_user)):
-    """Clean up all appointments - Admin only"""
+    """Clean up all appointments - Admin only
+    
+    Deletes in throttled batches as a background job and broadcasts a single
+    appointments_cleanup_completed event when it finishes.
+    """
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Only administrators can perform cleanup operations")
     
-    # Count existing data
-    appointments_count = await db.appointments.count_documents({})
-    notes_count = await db.appointment_notes.count_documents({})
-    patients_count = await db.patients.count_documents({})
+    async def run_cleanup(context):
+        result = await cleanup_appointments_job(db, context)
+        await publish_appointment_change("reset", None)
+        
+        def deleted(name):
+            # Hot and archived records together
+            return result["deleted"].get(name, 0) + result["deleted"].get(name + ARCHIVE_SUFFIX, 0)
+        
+        await manager.broadcast({
+            "type": "appointments_cleanup_completed",
+            "job_id": context.job["id"],
+            "deleted": {
+                "appointments": deleted("appointments"),
+                "notes": deleted("appointment_notes"),
+                "patients": deleted("patients"),
+                "call_attempts": deleted("call_attempts")
+            },
+            "performed_by": current_user.full_name,
+            "message": f"All appointments cleaned up by {current_user.full_name}",
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "force_refresh": True
+        })
+        print("📡 BROADCAST: Appointment cleanup completion sent to all users")
+        return result
     
-    # Delete all appointments and related data
-    await db.appointments.delete_many({})
-    await db.appointment_notes.delete_many({})
-    await db.patients.delete_many({})
+    job = await job_runner.start("cleanup_appointments", current_user.id, {}, run_cleanup)
     
     return {
-        "message": "All appointments cleaned up successfully",
-        "deleted": {
-            "appointments": appointments_count,
-            "notes": notes_count,  
-            "patients": patients_count
-        }
+        "message": "Appointment cleanup started",
+        "job_id": job["id"],
+        "status": job["status"]
     }
 
+def appointment_details_etag(appointment: dict) -> str:
+    """Weak ETag for the detail+notes view, derived from the appointment's write version"""
+    version = "|".join(str(appointment.get(field)) for field in ["id", "updated_at", "notes_count", "status", "doctor_id", "archived"])
+    return f'W/"{hashlib.sha1(version.encode()).hexdigest()}"'
+
 @api_router.get("/appointments/{appointment_id}")
-async def get_appointment_details(appointment_id: str, current_user: User = Depends(get_current_user)):
-    """Get detailed appointment information"""
-    appointment = await db.appointments.find_one({"id": appointment_id})
+async def get_appointment_details(appointment_id: str, request: Request, response: Response, current_user: User = Depends(get_current_user)):
+    """Get detailed appointment information including notes (hot or archived)"""
+    appointment = await find_appointment(db, appointment_id, projection={"_id": 0})
     if not appointment:
         raise HTTPException(status_code=404, detail="Appointment not found")
     
@@ -1479,30 +2743,39 @@ async def get_appointment_details(appointment_id: str, current_user: User = Depe
     else:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    # Enrich with related data
-    patient = await db.patients.find_one({"id": appointment["patient_id"]})
-    provider = await db.users.find_one({"id": appointment["provider_id"]})
-    doctor = None
-    if appointment.get("doctor_id"):
-        doctor = await db.users.find_one({"id": appointment["doctor_id"]})
-    
-    notes = await db.appointment_notes.find({"appointment_id": appointment_id}).to_list(1000)
-    
-    # Clean MongoDB ObjectId fields from all data
-    def clean_mongo_data(data):
-        if isinstance(data, dict):
-            return {k: v for k, v in data.items() if k != "_id"}
-        elif isinstance(data, list):
-            return [clean_mongo_data(item) for item in data]
-        else:
-            return data
+    # Reopening a card the client already holds costs only the appointment lookup
+    etag = appointment_details_etag(appointment)
+    cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=http_status.HTTP_304_NOT_MODIFIED, headers=cache_headers)
+    
+    # Enrich with related data - independent lookups run concurrently
+    async def find_patient():
+        if appointment.get("patient"):
+            return appointment["patient"]
+        patients = collection_for(db, "patients", appointment.get("archived", False))
+        return await patients.find_one({"id": appointment["patient_id"]}, {"_id": 0})
+    
+    async def find_user(user_id: Optional[str]):
+        if not user_id:
+            return None
+        return await db.users.find_one({"id": user_id}, {"_id": 0, "hashed_password": 0})
+    
+    patient, provider, doctor, notes = await asyncio.gather(
+        find_patient(),
+        find_user(appointment["provider_id"]),
+        find_user(appointment.get("doctor_id")),
+        collection_for(db, "appointment_notes", appointment.get("archived", False))
+            .find({"appointment_id": appointment_id}, {"_id": 0}).sort("timestamp", 1).to_list(1000)
+    )
     
+    response.headers.update(cache_headers)
     return {
-        **clean_mongo_data(appointment),
-        "patient": clean_mongo_data(patient) if patient else None,
-        "provider": clean_mongo_data(provider) if provider else None,
-        "doctor": clean_mongo_data(doctor) if doctor else None,
-        "notes": clean_mongo_data(notes) if notes else []
+        **appointment,
+        "patient": patient,
+        "provider": provider,
+        "doctor": doctor,
+        "notes": notes
     }
 
 # Video call endpoints
@@ -1531,9 +2804,49 @@ async def start_video_call(appointment_id: str, current_user: User = Depends(get
     if not provider:
         raise HTTPException(status_code=404, detail="Provider not found")
     
-    # Count existing call attempts for this appointment
-    existing_calls = await db.call_attempts.count_documents({"appointment_id": appointment_id})
-    call_attempt_number = existing_calls + 1
+    # Allocate the next attempt number and record it on the appointment in one atomic update.
+    # Appointments created before the counter existed start from their call history length.
+    # The updated appointment is returned for the change event; the new history entry keeps
+    # the status and doctor this update replaced, so the counters come from that exact state.
+    call_id = str(uuid.uuid4())
+    initiated_at = datetime.now(timezone.utc)
+    updated = await db.appointments.find_one_and_update(
+        {"id": appointment_id},
+        [
+            {"$set": {
+                "call_attempt_count": {"$add": [
+                    {"$ifNull": ["$call_attempt_count", {"$size": {"$ifNull": ["$call_history", []]}}]},
+                    1
+                ]}
+            }},
+            {"$set": {
+                "call_history": {"$concatArrays": [
+                    {"$ifNull": ["$call_history", []]},
+                    [{
+                        "call_id": call_id,
+                        "doctor_name": {"$literal": current_user.full_name},
+                        "attempt_number": "$call_attempt_count",
+                        "initiated_at": initiated_at.isoformat(),
+                        "status": "calling",
+                        "previous_status": "$status",
+                        "previous_doctor_id": "$doctor_id"
+                    }]
+                ]},
+                "status": "in_call",
+                "doctor_id": current_user.id,
+                "doctor_name": {"$literal": current_user.full_name},
+                "updated_at": initiated_at
+            }}
+        ],
+        return_document=ReturnDocument.AFTER
+    )
+    if not updated:
+        raise HTTPException(status_code=404, detail="Appointment not found")
+    call_attempt_number = updated["call_attempt_count"]
+    entry = updated["call_history"][-1]
+    previous = {**updated, "status": entry.get("previous_status"), "doctor_id": entry.get("previous_doctor_id")}
+    await apply_appointment_change(db, previous, updated)
+    await publish_appointment_change("updated", updated)
     
     # Create unique Jitsi room name with call attempt
     room_name = f"emergency-{appointment_id}-call-{call_attempt_number}-{int(datetime.now().timestamp())}"
@@ -1544,44 +2857,29 @@ async def start_video_call(appointment_id: str, current_user: User = Depends(get
     
     # Create new call attempt
     call_attempt = CallAttempt(
+        call_id=call_id,
         appointment_id=appointment_id,
         doctor_id=current_user.id,
         provider_id=appointment["provider_id"],
         attempt_number=call_attempt_number,
         jitsi_url=jitsi_url,
         room_name=room_name,
+        initiated_at=initiated_at,
         status="calling"
     )
     
     # Save call attempt
     await db.call_attempts.insert_one(call_attempt.dict())
     
-    # Update appointment call history
-    await db.appointments.update_one(
-        {"id": appointment_id},
-        {
-            "$push": {
-                "call_history": {
-                    "call_id": call_attempt.call_id,
-                    "doctor_name": current_user.full_name,
-                    "attempt_number": call_attempt_number,
-                    "initiated_at": call_attempt.initiated_at.isoformat(),
-                    "status": "calling"
-                }
-            },
-            "$set": {
-                "status": "in_call",
-                "doctor_id": current_user.id,
-                "doctor_name": current_user.full_name,
-                "updated_at": datetime.now(timezone.utc)
-            }
-        }
-    )
+    # Track the call so monitoring, auto-redial and stale expiry apply to it
+    await call_manager.start_call(appointment_id, current_user.id, appointment["provider_id"])
     
     # Send real-time notification to provider (WhatsApp-like instant delivery)
-    # CRITICAL: Use MULTIPLE delivery methods to ensure provider ALWAYS gets the call
+    # Only the provider's own devices get the invite; the message id lets them dedupe
+    # replays and ack it, and FCM push is used only if no device acks in time
     call_notification = {
         "type": "incoming_video_call",
+        "message_id": str(uuid.uuid4()),
         "call_id": call_attempt.call_id,
         "appointment_id": appointment_id,
         "doctor_name": current_user.full_name,
@@ -1597,48 +2895,37 @@ async def start_video_call(appointment_id: str, current_user: User = Depends(get
         "provider_id": appointment["provider_id"]  # Add provider_id for filtering
     }
     
-    # METHOD 1: Send to provider directly via WebSocket
-    provider_notified_ws = await manager.send_personal_message(call_notification, appointment["provider_id"])
-    print(f"📞 WebSocket notification to provider: {'✅ SUCCESS' if provider_notified_ws else '❌ FAILED'}")
-    
-    # METHOD 2: BROADCAST to ALL users (ensures provider gets it even if WebSocket connection failed)
-    await manager.broadcast(call_notification)
-    print(f"📡 BROADCAST: Video call notification sent to all users (including provider {appointment['provider_id']})")
-    
-    # METHOD 3: Send FCM push notification to provider for GUARANTEED delivery
-    try:
-        # Send FCM notification to the specific provider
-        await send_notification_to_user(
-            db,
-            appointment["provider_id"],
-            f"📞 Incoming Call from Dr. {current_user.full_name}",
-            f"Patient: {appointment.get('patient', {}).get('name', 'Unknown Patient')} - Tap to answer",
-            {
-                "type": "incoming_video_call",
-                "appointment_id": appointment_id,
-                "jitsi_url": jitsi_url,
-                "room_name": room_name,
-                "call_id": call_attempt.call_id,
-                "doctor_name": current_user.full_name,
-                "call_attempt": call_attempt_number
-            }
-        )
-        print(f"📱 FCM notification sent to provider {appointment['provider_id']}")
-    except Exception as e:
-        print(f"⚠️ Error sending FCM notification to provider: {e}")
+    provider_connected = manager.is_connected(appointment["provider_id"])
+    run_in_background(deliver_call_event(
+        call_notification,
+        appointment["provider_id"],
+        f"📞 Incoming Call from Dr. {current_user.full_name}",
+        f"Patient: {appointment.get('patient', {}).get('name', 'Unknown Patient')} - Tap to answer",
+        {
+            "type": "incoming_video_call",
+            "appointment_id": appointment_id,
+            "jitsi_url": jitsi_url,
+            "room_name": room_name,
+            "call_id": call_attempt.call_id,
+            "doctor_name": current_user.full_name,
+            "call_attempt": call_attempt_number
+        }
+    ))
+    print(f"📞 Call invite {call_notification['message_id']} dispatched to provider {appointment['provider_id']} (connected: {provider_connected})")
     
     return {
         "success": True,
         "call_id": call_attempt.call_id,
+        "message_id": call_notification["message_id"],
         "jitsi_url": jitsi_url,
         "room_name": room_name,
         "call_attempt": call_attempt_number,
         "message": f"Call initiated to {provider.get('full_name', 'provider')}",
-        "provider_notified": True,  # Always true now with multiple delivery methods
+        "provider_notified": True,  # Delivery continues in the background with push fallback
         "notification_methods": {
-            "websocket": provider_notified_ws,
-            "broadcast": True,
-            "fcm": True
+            "websocket": provider_connected,
+            "broadcast": False,
+            "fcm": "fallback"
         },
         "appointment_type": "emergency"  # Confirm this is emergency appointment
     }
@@ -1688,7 +2975,8 @@ async def end_video_call(appointment_id: str, current_user: User = Depends(get_c
         raise HTTPException(status_code=403, detail="You can only report end for your assigned appointments")
     
     # End the call tracking
-    call_manager.end_call(appointment_id, reason="user_reported")
+    await call_manager.end_call(appointment_id, reason="user_reported")
+    await end_video_sessions(appointment_id)
     
     return {
         "message": "Call end reported successfully",
@@ -1733,9 +3021,14 @@ async def cancel_video_call(appointment_id: str, cancel_data: dict, current_user
             }}
         )
     
-    # Send cancellation notification to provider
+    # A cancelled call must not trigger auto-redial
+    await call_manager.end_call(appointment_id, reason="cancelled", allow_redial=False)
+    await end_video_sessions(appointment_id)
+    
+    # Send cancellation notification to provider's devices, with push fallback
     cancellation_notification = {
         "type": "call_cancelled",
+        "message_id": str(uuid.uuid4()),
         "appointment_id": appointment_id,
         "call_id": call_id,
         "doctor_name": current_user.full_name,
@@ -1746,14 +3039,15 @@ async def cancel_video_call(appointment_id: str, cancel_data: dict, current_user
         "action": "dismiss_call"  # Tell provider to dismiss the ringing modal
     }
     
-    # METHOD 1: Send directly to provider
     provider_id = appointment["provider_id"]
-    await manager.send_personal_message(cancellation_notification, provider_id)
-    print(f"✅ Call cancellation sent to provider: {provider_id}")
-    
-    # METHOD 2: Broadcast to ensure delivery
-    await manager.broadcast(cancellation_notification)
-    print("📡 BROADCAST: Call cancellation sent to all users")
+    run_in_background(deliver_call_event(
+        cancellation_notification,
+        provider_id,
+        "Call Cancelled",
+        f"Dr. {current_user.full_name} cancelled the call",
+        {"type": "call_cancelled", "appointment_id": appointment_id, "call_id": call_id or ""}
+    ))
+    print(f"✅ Call cancellation dispatched to provider: {provider_id}")
     
     return {
         "success": True,
@@ -1766,8 +3060,8 @@ async def cancel_video_call(appointment_id: str, cancel_data: dict, current_user
 @api_router.get("/video-call/status/{appointment_id}")
 async def get_call_status(appointment_id: str, current_user: User = Depends(get_current_user)):
     """Get current call status for appointment"""
-    if appointment_id in call_manager.active_calls:
-        call_session = call_manager.active_calls[appointment_id]
+    call_session = await call_manager.get_call_session(appointment_id)
+    if call_session:
         return {
             "active": True,
             "appointment_id": appointment_id,
@@ -1776,12 +3070,14 @@ async def get_call_status(appointment_id: str, current_user: User = Depends(get_
             "start_time": call_session.start_time.isoformat(),
             "status": call_session.status,
             "retry_count": call_session.retry_count,
-            "max_retries": call_session.max_retries
+            "max_retries": call_session.max_retries,
+            "pending_timers": call_manager.pending_timers
         }
     else:
         return {
             "active": False,
-            "appointment_id": appointment_id
+            "appointment_id": appointment_id,
+            "pending_timers": call_manager.pending_timers
         }
 
 @api_router.post("/video-call/session-end/{room_name}")
@@ -1802,7 +3098,7 @@ async def end_jitsi_call(room_name: str, current_user: User = Depends(get_curren
 @api_router.get("/video-call/join/{session_token}")
 async def join_video_call(session_token: str, current_user: User = Depends(get_current_user)):
     # Find the video session
-    video_session = await db.video_sessions.find_one({"session_token": session_token})
+    video_session = await session_token_cache.lookup(session_token)
     if not video_session:
         raise HTTPException(status_code=404, detail="Video session not found")
     
@@ -1837,13 +3133,22 @@ async def join_video_call(session_token: str, current_user: User = Depends(get_c
         "video_session": clean_mongo_data(video_session)
     }
 
+@api_router.get("/video-call/signaling/status")
+async def get_signaling_status(current_user: User = Depends(get_current_user)):
+    """Per-room signaling metrics (admin only)"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can view signaling metrics")
+    return video_call_manager.get_status()
+
 @api_router.get("/websocket/status")
 async def websocket_status(current_user: User = Depends(get_current_user)):
     """Get WebSocket connection status for debugging"""
     connection_status = manager.get_connection_status()
     return {
         "websocket_status": connection_status,
-        "current_user_connected": current_user.id in manager.active_connections,
+        "appointment_changes": appointment_changes.get_status(),
+        "refetch": refetch_metrics,
+        "current_user_connected": manager.is_connected(current_user.id),
         "timestamp": datetime.now(timezone.utc).isoformat()
     }
 
@@ -1862,65 +3167,139 @@ async def test_websocket_message(current_user: User = Depends(get_current_user))
     
     return {
         "message_sent": result,
-        "user_connected": current_user.id in manager.active_connections,
+        "user_connected": manager.is_connected(current_user.id),
         "test_message": test_message
     }
 
+@api_router.get("/events/stream")
+async def event_stream(request: Request, token: Optional[str] = None, last_event_id: Optional[str] = None, coalesce_ms: Optional[int] = None):
+    """Server-Sent Events stream of the same notifications the WebSocket delivers
+    
+    EventSource cannot set headers, so the bearer token may be passed as ?token=.
+    On reconnect the browser sends Last-Event-ID and missed events are replayed;
+    if they are no longer available a resync_required event tells the client to refetch.
+    """
+    authorization = request.headers.get("authorization", "")
+    token = token or (authorization[7:] if authorization.lower().startswith("bearer ") else None)
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    current_user = await user_from_token(token)
+    last_event_id = request.headers.get("last-event-id") or last_event_id
+    
+    # Registering and reading the replay log happen without yielding to the loop, so
+    # every event lands exactly once: either in the replay or in the live stream
+    connection = SSEConnection(current_user.id, coalesce_window(coalesce_ms))
+    manager.register(connection)
+    manager.subscribe(connection, default_topics(current_user.id, current_user.role, current_user.district))
+    replay = manager.events_since(last_event_id, current_user.id, connection.topics) if last_event_id else []
+    await manager.flush_queue(connection)
+    print(f"📡 SSE stream opened for user {current_user.id} (resume from {last_event_id or 'start'}, {len(replay or [])} replayed)")
+    
+    async def stream():
+        try:
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            if replay is None:
+                yield encode_frame({
+                    "type": "resync_required",
+                    "reason": "Missed events are no longer available",
+                    "timestamp": datetime.now(timezone.utc).isoformat()
+                }, "sse")
+            else:
+                for event_id, message in replay:
+                    yield encode_frame(message, "sse", event_id)
+            yield encode_frame({
+                "type": "connection_established",
+                "user_id": current_user.id,
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "message": "Event stream connected",
+                "encoding": "sse",
+                "topics": sorted(connection.topics)
+            }, "sse")
+            while True:
+                yield await connection.frames.get()
+        finally:
+            manager.disconnect(current_user.id, connection.id)
+    
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # Keep nginx from buffering the stream
+    })
+
 # CRITICAL: WebSocket endpoint for real-time notifications - MUST NOT BE REMOVED
 @app.websocket("/api/ws/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: str):
-    print(f"🔌 WebSocket connection attempt from user {user_id}")
-    await manager.connect(websocket, user_id)
+async def websocket_endpoint(websocket: WebSocket, user_id: str, encoding: str = "json", coalesce_ms: Optional[int] = None):
+    print(f"🔌 WebSocket connection attempt from user {user_id} (encoding: {encoding})")
+    if encoding not in WS_ENCODINGS:
+        encoding = "json"
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "role": 1, "district": 1}) or {}
+    role = user.get("role")
+    connection = await manager.connect(websocket, user_id, encoding, coalesce_window(coalesce_ms))
+    manager.subscribe(connection, default_topics(user_id, role, user.get("district")))
     print(f"✅ User {user_id} connected to WebSocket")
     
     # Send immediate acknowledgment to prevent idle timeout
     try:
-        await websocket.send_text(json.dumps({
+        await connection.send({
             "type": "connection_established",
             "user_id": user_id,
             "timestamp": datetime.now(timezone.utc).isoformat(),
-            "message": "WebSocket connection successful"
-        }))
+            "message": "WebSocket connection successful",
+            "encoding": encoding,
+            "coalesce_ms": int(connection.coalesce_window * 1000),
+            "topics": sorted(connection.topics)
+        })
         print(f"✅ Connection acknowledgment sent to user {user_id}")
     except Exception as e:
         print(f"❌ Failed to send connection ack: {e}")
     
     try:
         while True:
+            # Keep-alive is driven by the manager's heartbeat scheduler
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            connection.mark_received()
             try:
-                # Use asyncio.wait_for with timeout to prevent indefinite blocking
-                # Wait for 60 seconds for a message, then loop again
-                data = await asyncio.wait_for(websocket.receive_text(), timeout=60.0)
-                message = json.loads(data)
+                # Clients may answer in either encoding, whichever they negotiated
+                message = decode_frame(frame.get("bytes") if frame.get("bytes") is not None else frame.get("text"))
                 
                 # Handle different message types
-                if message.get("type") == "ping":
-                    await websocket.send_text(json.dumps({"type": "pong", "timestamp": datetime.now(timezone.utc).isoformat()}))
+                if message.get("type") == "ack":
+                    manager.ack(message.get("message_id"), user_id)
+                elif message.get("type") == "ping":
+                    await connection.send({"type": "pong", "timestamp": datetime.now(timezone.utc).isoformat()})
                     print(f"🏓 Ping/Pong with user {user_id}")
                 elif message.get("type") == "heartbeat":
-                    await websocket.send_text(json.dumps({"type": "heartbeat_ack", "timestamp": datetime.now(timezone.utc).isoformat()}))
+                    await connection.send({"type": "heartbeat_ack", "timestamp": datetime.now(timezone.utc).isoformat()})
                     print(f"💓 Heartbeat from user {user_id}")
                 elif message.get("type") == "heartbeat_response":
                     print(f"💓 Heartbeat response from user {user_id}")
-                    
-            except asyncio.TimeoutError:
-                # No message received in 60 seconds, send keep-alive
-                try:
-                    await websocket.send_text(json.dumps({
-                        "type": "keep_alive",
+                elif message.get("type") in ("subscribe", "unsubscribe"):
+                    topics = [topic for topic in message.get("topics") or [] if isinstance(topic, str)]
+                    rejected = []
+                    if message["type"] == "subscribe":
+                        allowed = []
+                        for topic in topics:
+                            (allowed if await topic_allowed(topic, user_id, role) else rejected).append(topic)
+                        manager.subscribe(connection, allowed)
+                    else:
+                        manager.unsubscribe(connection, topics)
+                    await connection.send({
+                        "type": "subscriptions",
+                        "topics": sorted(connection.topics),
+                        "rejected": rejected,
                         "timestamp": datetime.now(timezone.utc).isoformat()
-                    }))
-                    print(f"🔄 Keep-alive sent to user {user_id}")
-                except Exception as e:
-                    print(f"❌ Keep-alive failed for user {user_id}: {e}")
-                    break  # Connection is dead, exit loop
+                    })
+                    
+            except (ValueError, msgpack.UnpackException):
+                print(f"⚠️ Ignoring malformed WebSocket frame from user {user_id}")
                     
     except WebSocketDisconnect:
         print(f"🔌 User {user_id} disconnected from WebSocket")
-        manager.disconnect(user_id)
+        manager.disconnect(user_id, connection.id)
     except Exception as e:
         print(f"❌ WebSocket error for user {user_id}: {e}")
-        manager.disconnect(user_id)
+        manager.disconnect(user_id, connection.id)
 
 # Push notification endpoints
 @api_router.post("/push/subscribe")
@@ -2016,51 +3395,33 @@ async def root():
 # Video Call WebSocket endpoint
 @app.websocket("/api/ws/video-call/{session_token}")
 async def video_call_websocket(websocket: WebSocket, session_token: str):
+    peer = None
     try:
         # Validate session token exists in video_sessions
-        session_exists = await db.video_sessions.find_one({"session_token": session_token})
-        if not session_exists:
+        if not await video_call_manager.validate_token(session_token):
             print(f"❌ Invalid session token: {session_token}")
             await websocket.close(code=4000, reason="Invalid session token")
             return
-            
-        # Use session token as unique identifier for this call
-        user_id = f"user-{session_token[:8]}"
-        # user_name = f"Participant-{session_token[:8]}"  # Unused variable
         
         await websocket.accept()
-        print(f"✅ Video call WebSocket accepted: session={session_token}, user={user_id}")
-        
-        if session_token not in video_call_manager.active_sessions:
-            video_call_manager.active_sessions[session_token] = {}
-        
-        video_call_manager.active_sessions[session_token][user_id] = websocket
-        
-        # Send welcome message
-        await websocket.send_text(json.dumps({
-            "type": "connection-established",
-            "session": session_token,
-            "userId": user_id
-        }))
-        
-        print(f"🔌 Video call session active: {len(video_call_manager.active_sessions[session_token])} participants")
+        peer = await video_call_manager.join_room(session_token, websocket)
+        print(f"✅ Video call WebSocket accepted: session={session_token}, peer={peer.id}")
         
         while True:
             data = await websocket.receive_text()
             message = json.loads(data)
-            print(f"📡 Video call message from {user_id}: {message.get('type', 'unknown')}")
             
             # Relay WebRTC signaling messages to other participants
-            await video_call_manager.relay_message(session_token, user_id, message)
+            await video_call_manager.handle_message(session_token, peer, message)
             
     except WebSocketDisconnect:
         print(f"📡 Video call WebSocket disconnected: session={session_token}")
-        if session_token in video_call_manager.active_sessions:
-            user_id = f"user-{session_token[:8]}"
-            video_call_manager.leave_session(session_token, user_id)
     except Exception as e:
         print(f"❌ Video call WebSocket error: {e}")
         await websocket.close(code=1011, reason=str(e))
+    finally:
+        if peer:
+            await video_call_manager.leave_room(session_token, peer)
 
 # Test WebSocket endpoint
 @app.websocket("/test-ws")
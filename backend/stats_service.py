@@ -0,0 +1,245 @@
+# Aggregated statistics for the admin dashboard and per-user appointment counters
+# Counts come from one $facet aggregation per collection and are cached for
+# ADMIN_STATS_TTL_SECONDS, so any number of polling admin tabs costs at most one
+# recomputation per interval. The version tag only changes when a count does,
+# which lets clients poll conditionally with If-None-Match.
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+ADMIN_STATS_TTL_SECONDS = float(os.environ.get('ADMIN_STATS_TTL_SECONDS', '10'))
+
+def _counts(buckets: list) -> Dict[str, int]:
+    return {str(bucket["_id"]) if bucket["_id"] is not None else "unassigned": bucket["count"] for bucket in buckets}
+
+def _total(facet: list) -> int:
+    return facet[0]["count"] if facet else 0
+
+async def compute_admin_stats(db) -> dict:
+    """Counts by role, status, appointment type and district, plus today's activity"""
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    users, appointments, active_calls = await asyncio.gather(
+        db.users.aggregate([{"$facet": {
+            "total": [{"$count": "count"}],
+            "active": [{"$match": {"is_active": {"$ne": False}}}, {"$count": "count"}],
+            "by_role": [{"$group": {"_id": "$role", "count": {"$sum": 1}}}],
+            "by_district": [{"$group": {"_id": "$district", "count": {"$sum": 1}}}]
+        }}]).to_list(1),
+        db.appointments.aggregate([{"$facet": {
+            "total": [{"$count": "count"}],
+            "by_status": [{"$group": {"_id": "$status", "count": {"$sum": 1}}}],
+            "by_type": [{"$group": {"_id": "$appointment_type", "count": {"$sum": 1}}}],
+            "by_district": [{"$match": {"district": {"$ne": None}}}, {"$group": {"_id": "$district", "count": {"$sum": 1}}}],
+            # Appointments from before districts were stamped on them
+            "unstamped_by_provider": [{"$match": {"district": None}}, {"$group": {"_id": "$provider_id", "count": {"$sum": 1}}}],
+            "today_by_type": [{"$match": {"created_at": {"$gte": today}}}, {"$group": {"_id": "$appointment_type", "count": {"$sum": 1}}}],
+            "today_by_status": [{"$match": {"created_at": {"$gte": today}}}, {"$group": {"_id": "$status", "count": {"$sum": 1}}}]
+        }}]).to_list(1),
+        db.call_sessions.count_documents({"status": {"$in": ["active", "stable"]}})
+    )
+    users, appointments = users[0], appointments[0]
+
+    # Appointments carry their district; unstamped ones are attributed to their provider's
+    appointments_by_district = _counts(appointments["by_district"])
+    provider_counts = {bucket["_id"]: bucket["count"] for bucket in appointments["unstamped_by_provider"]}
+    providers = await db.users.find({"id": {"$in": list(provider_counts)}}, {"_id": 0, "id": 1, "district": 1}).to_list(None)
+    provider_districts = {provider["id"]: provider.get("district") for provider in providers}
+    for provider_id, count in provider_counts.items():
+        district = provider_districts.get(provider_id) or "unassigned"
+        appointments_by_district[district] = appointments_by_district.get(district, 0) + count
+
+    today_by_type = _counts(appointments["today_by_type"])
+    return {
+        "users": {
+            "total": _total(users["total"]),
+            "active": _total(users["active"]),
+            "by_role": _counts(users["by_role"]),
+            "by_district": _counts(users["by_district"])
+        },
+        "appointments": {
+            "total": _total(appointments["total"]),
+            "by_status": _counts(appointments["by_status"]),
+            "by_type": _counts(appointments["by_type"]),
+            "by_district": appointments_by_district,
+            "today": {
+                "total": sum(today_by_type.values()),
+                "by_type": today_by_type,
+                "by_status": _counts(appointments["today_by_status"])
+            }
+        },
+        "active_calls": active_calls
+    }
+
+class AdminStatsCache:
+    """Single-flight TTL cache around compute_admin_stats
+
+    `live_counts` adds in-process figures such as connected users, which are
+    part of the version but cost nothing to collect.
+    """
+    def __init__(self, db, live_counts: Optional[Callable[[], Dict[str, Any]]] = None):
+        self.db = db
+        self.live_counts = live_counts
+        self.stats: Optional[dict] = None
+        self.computed_at = 0.0
+        self.lock = asyncio.Lock()
+
+    def _fresh(self) -> bool:
+        return self.stats is not None and time.monotonic() - self.computed_at < ADMIN_STATS_TTL_SECONDS
+
+    async def get(self) -> dict:
+        if self._fresh():
+            return self.stats
+        async with self.lock:
+            if self._fresh():
+                return self.stats  # Computed by a concurrent caller while we waited
+            stats = await compute_admin_stats(self.db)
+            if self.live_counts:
+                stats.update(self.live_counts())
+            version = hashlib.sha1(json.dumps(stats, sort_keys=True).encode()).hexdigest()[:16]
+            self.stats = {**stats, "version": version, "generated_at": datetime.now(timezone.utc).isoformat()}
+            self.computed_at = time.monotonic()
+            return self.stats
+
+    def invalidate(self):
+        self.computed_at = 0.0
+
+# Per-user appointment counters
+# One document per provider ("provider:<id>"), per doctor ("doctor:<id>"), per
+# district ("district:<name>", "district:unassigned" for appointments without one)
+# and one for everything ("all") in `appointment_counters`, holding how many appointments
+# are in each status. Write paths apply an appointment's before/after state as
+# $inc deltas; reconcile_counters recomputes them from `appointments` and
+# `appointments_archive` to repair drift. Archived appointments still exist and are
+# still counted, so archival leaves the counters alone.
+
+COUNTED_STATUSES = ["pending", "accepted", "in_call", "completed", "cancelled"]
+COUNTER_FIELDS = COUNTED_STATUSES + ["other", "total"]
+COUNTED_COLLECTIONS = ["appointments", "appointments_archive"]
+COUNTER_RECONCILE_INTERVAL_SECONDS = int(os.environ.get('COUNTER_RECONCILE_INTERVAL_SECONDS', '21600'))
+
+def _status_field(status: Optional[str]) -> str:
+    # Status is free text on updates; never let it become an arbitrary field name
+    return status if status in COUNTED_STATUSES else "other"
+
+def district_counter_key(district: Optional[str]) -> str:
+    return f"district:{district or 'unassigned'}"
+
+def counter_keys(appointment: dict) -> list:
+    keys = ["all", f"provider:{appointment.get('provider_id')}", district_counter_key(appointment.get("district"))]
+    if appointment.get("doctor_id"):
+        keys.append(f"doctor:{appointment['doctor_id']}")
+    return keys
+
+def counter_deltas(before: Optional[dict], after: Optional[dict]) -> Dict[str, Dict[str, int]]:
+    """Per-counter increments for an appointment going from `before` to `after` (None = absent)"""
+    deltas: Dict[str, Dict[str, int]] = {}
+    for appointment, sign in ((before, -1), (after, 1)):
+        if not appointment:
+            continue
+        for key in counter_keys(appointment):
+            fields = deltas.setdefault(key, {})
+            for field in (_status_field(appointment.get("status")), "total"):
+                fields[field] = fields.get(field, 0) + sign
+    deltas = {key: {field: n for field, n in fields.items() if n} for key, fields in deltas.items()}
+    return {key: fields for key, fields in deltas.items() if fields}
+
+async def apply_counter_deltas(db, deltas: Dict[str, Dict[str, int]]):
+    if not deltas:
+        return
+    now = datetime.now(timezone.utc)
+    try:
+        await db.appointment_counters.bulk_write([
+            UpdateOne({"_id": key}, {"$inc": fields, "$set": {"updated_at": now}}, upsert=True)
+            for key, fields in deltas.items()
+        ], ordered=False)
+    except PyMongoError as e:
+        # The appointment write already happened; reconciliation repairs the counters
+        print(f"⚠️ Failed to update appointment counters: {e}")
+
+async def apply_appointment_change(db, before: Optional[dict], after: Optional[dict]):
+    """Update counters for one appointment create (before=None), update or delete (after=None)"""
+    await apply_counter_deltas(db, counter_deltas(before, after))
+
+async def apply_appointments_removed(db, appointments: list):
+    """Decrement counters for a batch of appointments deleted together"""
+    deltas: Dict[str, Dict[str, int]] = {}
+    for appointment in appointments:
+        for key, fields in counter_deltas(appointment, None).items():
+            merged = deltas.setdefault(key, {})
+            for field, n in fields.items():
+                merged[field] = merged.get(field, 0) + n
+    await apply_counter_deltas(db, deltas)
+
+async def get_counters(db, keys: list) -> Dict[str, Dict[str, int]]:
+    docs = await db.appointment_counters.find({"_id": {"$in": keys}}).to_list(None)
+    by_key = {doc["_id"]: doc for doc in docs}
+    return {key: {field: by_key.get(key, {}).get(field, 0) for field in COUNTER_FIELDS} for key in keys}
+
+async def reconcile_counters(db, context=None) -> dict:
+    """Recompute all counters from hot and archived appointments and fix any that drifted
+
+    The aggregation is not a snapshot, so counters are read both before and
+    after it: a counter that moved in between was written while the scan ran
+    and is left for the next run. The rest are corrected by $inc of
+    expected minus the earlier read.
+    """
+    def read_counters():
+        return db.appointment_counters.find({}, {field: 1 for field in COUNTER_FIELDS}).to_list(None)
+
+    before = {doc["_id"]: doc for doc in await read_counters()}
+    expected: Dict[str, Dict[str, int]] = {}
+    pipeline = [{"$group": {
+        "_id": {"provider_id": "$provider_id", "doctor_id": "$doctor_id", "district": "$district", "status": "$status"},
+        "count": {"$sum": 1}
+    }}]
+    for name in COUNTED_COLLECTIONS:
+        async for row in db[name].aggregate(pipeline):
+            for key in counter_keys(row["_id"]):
+                fields = expected.setdefault(key, {})
+                for field in (_status_field(row["_id"].get("status")), "total"):
+                    fields[field] = fields.get(field, 0) + row["count"]
+    after = {doc["_id"]: doc for doc in await read_counters()}
+
+    now = datetime.now(timezone.utc)
+    corrections = []
+    skipped = 0
+    for key in set(expected) | set(before) | set(after):
+        diff = {
+            field: expected.get(key, {}).get(field, 0) - before.get(key, {}).get(field, 0)
+            for field in COUNTER_FIELDS
+        }
+        diff = {field: n for field, n in diff.items() if n}
+        if not diff:
+            continue
+        if before.get(key) != after.get(key):
+            skipped += 1
+            continue
+        corrections.append(UpdateOne({"_id": key}, {"$inc": diff, "$set": {"updated_at": now, "reconciled_at": now}}, upsert=True))
+    if corrections:
+        await db.appointment_counters.bulk_write(corrections, ordered=False)
+        print(f"🧮 Reconciled appointment counters: {len(corrections)} of {len(expected)} corrected")
+    if skipped:
+        print(f"🧮 {skipped} appointment counters changed during reconciliation, left for the next run")
+    if context:
+        context.progress["corrected"] = len(corrections)
+        context.progress["skipped"] = skipped
+        await context.report("reconciled")
+    return {"counters": len(expected), "corrected": len(corrections), "skipped": skipped}
+
+async def counters_reconcile_loop(db):
+    """Periodically repair counter drift"""
+    while True:
+        await asyncio.sleep(COUNTER_RECONCILE_INTERVAL_SECONDS)
+        try:
+            await reconcile_counters(db)
+        except Exception as e:
+            print(f"❌ Counter reconciliation error: {e}")
@@ -142,6 +142,17 @@ class TestAppointments:
         assert isinstance(data, list)
         print(f"✅ Doctor can fetch appointments: {len(data)} found")
     
+    def test_get_appointments_include_archived(self, doctor_token):
+        """Test that archived appointments are only returned on request"""
+        headers = {"Authorization": f"Bearer {doctor_token}"}
+        hot = requests.get(f"{API_URL}/appointments", headers=headers)
+        everything = requests.get(f"{API_URL}/appointments", params={"include_archived": "true"}, headers=headers)
+        assert hot.status_code == 200
+        assert everything.status_code == 200
+        assert not any(apt.get("archived") for apt in hot.json())
+        assert len(everything.json()) >= len(hot.json())
+        print(f"✅ Archived appointments opt-in: {len(hot.json())} hot, {len(everything.json())} total")
+    
     def test_create_emergency_appointment(self, provider_token):
         """Test creating an emergency appointment"""
         headers = {"Authorization": f"Bearer {provider_token}"}
@@ -197,9 +208,181 @@ class TestAppointments:
         data = response.json()
         assert data["appointment_type"] == "non_emergency"
         print(f"✅ Non-emergency appointment created: {data['id']}")
-        
+
         return data["id"]
 
+    def test_appointment_embeds_patient_snapshot(self, provider_token):
+        """Test that appointments carry the patient summary without a join"""
+        headers = {"Authorization": f"Bearer {provider_token}"}
+        appointment_data = {
+            "patient": {
+                "name": "TEST_Snapshot_Patient",
+                "age": 52,
+                "gender": "male",
+                "vitals": {"blood_pressure": "130/85"},
+                "history": "Hypertension follow-up",
+                "area_of_consultation": "Cardiology"
+            },
+            "appointment_type": "non_emergency"
+        }
+
+        response = requests.post(f"{API_URL}/appointments", json=appointment_data, headers=headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["patient"]["name"] == "TEST_Snapshot_Patient"
+        assert data["patient"]["id"] == data["patient_id"]
+
+        response = requests.get(f"{API_URL}/appointments", headers=headers)
+        assert response.status_code == 200
+        listed = next(apt for apt in response.json() if apt["id"] == data["id"])
+        assert listed["patient"]["area_of_consultation"] == "Cardiology"
+        print(f"✅ Patient snapshot embedded in appointment: {data['id']}")
+
+    def test_appointment_stamped_with_provider_district(self, provider_token, doctor_token):
+        """Test that appointments carry the provider's district and doctors can opt out of scoping"""
+        provider = requests.post(f"{API_URL}/login", json=TEST_PROVIDER).json()["user"]
+        headers = {"Authorization": f"Bearer {provider_token}"}
+        appointment_data = {
+            "patient": {
+                "name": "TEST_District_Patient",
+                "age": 40,
+                "gender": "female",
+                "history": "Routine check",
+                "area_of_consultation": "General"
+            },
+            "appointment_type": "non_emergency"
+        }
+
+        response = requests.post(f"{API_URL}/appointments", json=appointment_data, headers=headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["district"] == provider.get("district")
+
+        doctor_headers = {"Authorization": f"Bearer {doctor_token}"}
+        scoped = requests.get(f"{API_URL}/appointments", headers=doctor_headers).json()
+        everything = requests.get(f"{API_URL}/appointments", params={"all_districts": "true"}, headers=doctor_headers).json()
+        assert any(apt["id"] == data["id"] for apt in everything)
+        assert len(everything) >= len(scoped)
+
+        requests.delete(f"{API_URL}/appointments/{data['id']}", headers=headers)
+        print(f"✅ Appointment stamped with district {data['district']}: {len(scoped)} scoped, {len(everything)} total")
+
+    def test_counters_follow_appointment_lifecycle(self, provider_token):
+        """Test that /me/counters moves with create and delete"""
+        headers = {"Authorization": f"Bearer {provider_token}"}
+        before = requests.get(f"{API_URL}/me/counters", headers=headers)
+        assert before.status_code == 200
+        pending = before.json()["counters"]["pending"]
+
+        appointment_data = {
+            "patient": {"name": "TEST_Counter_Patient", "age": 40, "gender": "female", "vitals": {}},
+            "appointment_type": "non_emergency"
+        }
+        response = requests.post(f"{API_URL}/appointments", json=appointment_data, headers=headers)
+        assert response.status_code == 200
+        appointment_id = response.json()["id"]
+
+        after_create = requests.get(f"{API_URL}/me/counters", headers=headers).json()
+        assert after_create["counters"]["pending"] == pending + 1
+
+        assert requests.delete(f"{API_URL}/appointments/{appointment_id}", headers=headers).status_code == 200
+        after_delete = requests.get(f"{API_URL}/me/counters", headers=headers).json()
+        assert after_delete["counters"]["pending"] == pending
+        print(f"✅ Counters tracked create/delete: pending {pending} -> {pending + 1} -> {pending}")
+
+    def test_long_poll_wakes_on_change(self, provider_token):
+        """Test that a waiting long-poll returns as soon as an appointment is created"""
+        from concurrent.futures import ThreadPoolExecutor
+        headers = {"Authorization": f"Bearer {provider_token}"}
+        version = requests.get(f"{API_URL}/appointments/changes/wait", headers=headers).json()["version"]
+
+        def wait():
+            started = time.time()
+            response = requests.get(
+                f"{API_URL}/appointments/changes/wait",
+                params={"since": version, "timeout": 10},
+                headers=headers,
+                timeout=20
+            )
+            return response, time.time() - started
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pending = pool.submit(wait)
+            time.sleep(0.5)
+            appointment_data = {
+                "patient": {"name": "TEST_LongPoll_Patient", "age": 33, "gender": "male", "vitals": {}},
+                "appointment_type": "non_emergency"
+            }
+            created = requests.post(f"{API_URL}/appointments", json=appointment_data, headers=headers)
+            response, elapsed = pending.result()
+
+        assert created.status_code == 200
+        assert response.status_code == 200
+        data = response.json()
+        assert data["changed"] is True
+        assert data["version"] > version
+        assert created.json()["id"] in [change["appointment_id"] for change in data["changes"]]
+        assert elapsed < 5
+        print(f"✅ Long-poll woke after {elapsed:.2f}s at version {data['version']}")
+
+    def test_changes_carry_updated_appointment(self, provider_token):
+        """Test that change records carry the appointment so clients need not refetch"""
+        headers = {"Authorization": f"Bearer {provider_token}"}
+        appointment_data = {
+            "patient": {"name": "TEST_Diff_Patient", "age": 61, "gender": "female", "vitals": {}},
+            "appointment_type": "non_emergency"
+        }
+        created = requests.post(f"{API_URL}/appointments", json=appointment_data, headers=headers)
+        assert created.status_code == 200
+        appointment_id = created.json()["id"]
+        version = requests.get(f"{API_URL}/appointments/changes/wait", headers=headers).json()["version"]
+
+        updated = requests.put(f"{API_URL}/appointments/{appointment_id}", json={"status": "cancelled"}, headers=headers)
+        assert updated.status_code == 200
+
+        response = requests.get(
+            f"{API_URL}/appointments/changes/wait",
+            params={"since": version, "timeout": 5},
+            headers=headers
+        )
+        assert response.status_code == 200
+        change = next(c for c in response.json()["changes"] if c["appointment_id"] == appointment_id)
+        assert change["version"] > version
+        assert change["appointment"]["status"] == "cancelled"
+        assert change["appointment"]["provider"]["id"] == created.json()["provider_id"]
+        print(f"✅ Change {change['version']} carried the updated appointment")
+
+    def test_dispatch_claim_next_assigns_once(self, provider_token, doctor_token):
+        """Test that claim-next hands out emergencies first and a claimed appointment cannot be re-accepted"""
+        headers = {"Authorization": f"Bearer {provider_token}"}
+        doctor_headers = {"Authorization": f"Bearer {doctor_token}"}
+        appointment_data = {
+            "patient": {
+                "name": "TEST_Dispatch_Patient",
+                "age": 58,
+                "gender": "male",
+                "history": "Collapsed at home",
+                "area_of_consultation": "Emergency"
+            },
+            "appointment_type": "emergency"
+        }
+        created = requests.post(f"{API_URL}/appointments", json=appointment_data, headers=headers)
+        assert created.status_code == 200
+        assert created.json()["priority"] > 0
+
+        response = requests.post(f"{API_URL}/dispatch/claim-next", params={"all_districts": "true"}, headers=doctor_headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["claimed"] is True
+        assert data["appointment"]["appointment_type"] == "emergency"
+        assert data["appointment"]["status"] == "accepted"
+
+        queue = requests.get(f"{API_URL}/dispatch/queue", params={"all_districts": "true"}, headers=doctor_headers).json()
+        assert all(apt["id"] != data["appointment"]["id"] for apt in queue["appointments"])
+
+        requests.delete(f"{API_URL}/appointments/{created.json()['id']}", headers=headers)
+        print(f"✅ Claimed {data['appointment']['id']}, {queue['count']} left in the dispatch queue")
+
 
 class TestVideoCallEndpoints:
     """Test video call related endpoints"""
@@ -360,6 +543,34 @@ class TestVideoCallEndpoints:
         assert "session_id" in data
         print(f"✅ Video call session retrieved: {data['session_id']}")
 
+    def test_call_invite_is_targeted_with_message_id(self, doctor_token, emergency_appointment_id):
+        """Test that call invites go only to the provider and carry a message id for ack/dedup"""
+        headers = {"Authorization": f"Bearer {doctor_token}"}
+        response = requests.post(f"{API_URL}/video-call/start/{emergency_appointment_id}", headers=headers)
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["message_id"]
+        assert data["notification_methods"]["broadcast"] == False
+        assert data["notification_methods"]["fcm"] == "fallback"
+        print(f"✅ Targeted call invite dispatched: {data['message_id']}")
+
+    def test_concurrent_call_attempts_get_distinct_numbers(self, doctor_token, emergency_appointment_id):
+        """Test that rapid repeated call taps never reuse an attempt number"""
+        from concurrent.futures import ThreadPoolExecutor
+        headers = {"Authorization": f"Bearer {doctor_token}"}
+
+        def start_call(_):
+            return requests.post(f"{API_URL}/video-call/start/{emergency_appointment_id}", headers=headers)
+
+        with ThreadPoolExecutor(max_workers=5) as pool:
+            responses = list(pool.map(start_call, range(5)))
+
+        assert all(r.status_code == 200 for r in responses)
+        attempts = sorted(r.json()["call_attempt"] for r in responses)
+        assert attempts == [1, 2, 3, 4, 5]
+        print(f"✅ Concurrent call attempts numbered {attempts}")
+
 
 class TestWebSocketStatus:
     """Test WebSocket status endpoints"""
@@ -383,6 +594,78 @@ class TestWebSocketStatus:
         assert "total_connections" in data["websocket_status"]
         print(f"✅ WebSocket status: {data['websocket_status']['total_connections']} connections")
 
+    def test_websocket_status_reports_heartbeat_metrics(self, auth_token):
+        """Test that heartbeat and ack delivery metrics are exposed"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        response = requests.get(f"{API_URL}/websocket/status", headers=headers)
+
+        assert response.status_code == 200
+        status = response.json()["websocket_status"]
+        assert status["heartbeat"]["mode"] in ["application", "protocol"]
+        assert "missed_pongs" in status["heartbeat"]
+        assert "timed_out" in status["acks"]
+        print(f"✅ Heartbeat metrics: {status['heartbeat']}")
+
+    def test_websocket_status_reports_coalescing(self, auth_token):
+        """Test that event coalescing metrics are exposed"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        response = requests.get(f"{API_URL}/websocket/status", headers=headers)
+
+        assert response.status_code == 200
+        coalescing = response.json()["websocket_status"]["coalescing"]
+        for key in ["held", "superseded", "batches", "urgent_bypass", "connections"]:
+            assert key in coalescing
+        print(f"✅ Coalescing metrics: {coalescing}")
+
+    def test_websocket_status_reports_offline_queues(self, auth_token):
+        """Test that offline queue totals stay within the configured budget"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        response = requests.get(f"{API_URL}/websocket/status", headers=headers)
+
+        assert response.status_code == 200
+        ws_status = response.json()["websocket_status"]
+        queues = ws_status["offline_queues"]
+        assert queues["messages"] == ws_status["total_queued_messages"]
+        assert queues["bytes"] <= queues["memory_budget"]
+        for key in ["dropped_overflow", "dropped_budget", "expired", "evicted_users"]:
+            assert key in queues
+        print(f"✅ Offline queues: {queues}")
+
+    def test_event_stream_resync_on_unknown_event_id(self, auth_token):
+        """Test that the SSE stream asks for a refetch when it cannot resume"""
+        response = requests.get(
+            f"{API_URL}/events/stream",
+            params={"token": auth_token},
+            headers={"Last-Event-ID": "unknown-1"},
+            stream=True,
+            timeout=10
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = []
+        for line in response.iter_lines(decode_unicode=True):
+            if line and line.startswith("data: "):
+                events.append(json.loads(line[len("data: "):])["type"])
+            if "connection_established" in events:
+                break
+        response.close()
+        assert events == ["resync_required", "connection_established"]
+        print(f"✅ SSE stream events: {events}")
+
+    def test_event_stream_subscribes_role_topics(self, auth_token):
+        """Test that a provider's stream starts on its own provider topic only"""
+        me = requests.post(f"{API_URL}/login", json=TEST_PROVIDER).json()["user"]
+        response = requests.get(f"{API_URL}/events/stream", params={"token": auth_token}, stream=True, timeout=10)
+        established = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line and line.startswith("data: "):
+                established = json.loads(line[len("data: "):])
+                if established["type"] == "connection_established":
+                    break
+        response.close()
+        assert established["topics"] == [f"provider:{me['id']}", "role:provider"]
+        print(f"✅ SSE topics: {established['topics']}")
+
 
 class TestAppointmentNotes:
     """Test appointment notes functionality"""
@@ -470,6 +753,88 @@ class TestAppointmentNotes:
         assert isinstance(data, list)
         print(f"✅ Retrieved {len(data)} notes for appointment")
 
+    def test_appointment_details_etag(self, provider_token, test_appointment_id):
+        """Test that details include notes and revalidate with ETag"""
+        headers = {"Authorization": f"Bearer {provider_token}"}
+        
+        response = requests.get(f"{API_URL}/appointments/{test_appointment_id}", headers=headers)
+        assert response.status_code == 200
+        assert isinstance(response.json()["notes"], list)
+        etag = response.headers.get("ETag")
+        assert etag
+        
+        # Unchanged appointment revalidates without a body
+        response = requests.get(
+            f"{API_URL}/appointments/{test_appointment_id}",
+            headers={**headers, "If-None-Match": etag}
+        )
+        assert response.status_code == 304
+        
+        # A new note changes the version
+        requests.post(
+            f"{API_URL}/appointments/{test_appointment_id}/notes",
+            json={"note": "Note that changes the ETag", "sender_role": "provider"},
+            headers=headers
+        )
+        response = requests.get(
+            f"{API_URL}/appointments/{test_appointment_id}",
+            headers={**headers, "If-None-Match": etag}
+        )
+        assert response.status_code == 200
+        assert len(response.json()["notes"]) >= 1
+        print(f"✅ Appointment details ETag revalidation works: {etag}")
+
+
+class TestAdminEndpoints:
+    """Test admin reporting endpoints"""
+    
+    @pytest.fixture
+    def admin_token(self):
+        """Get admin auth token"""
+        response = requests.post(f"{API_URL}/login", json=ADMIN_USER)
+        if response.status_code != 200:
+            pytest.skip("Admin login failed")
+        return response.json()["access_token"]
+    
+    def test_storage_report(self, admin_token):
+        """Test per-collection storage report with retention policies"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        response = requests.get(f"{API_URL}/admin/storage", headers=headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert "collections" in data
+        assert "totals" in data
+        by_name = {c["collection"]: c for c in data["collections"]}
+        if "call_attempts" in by_name:
+            assert by_name["call_attempts"]["retention"]["field"] == "initiated_at"
+        print(f"✅ Storage report: {len(data['collections'])} collections, {data['totals']['documents']} documents")
+    
+    def test_storage_report_requires_admin(self):
+        """Test that non-admins cannot read the storage report"""
+        response = requests.post(f"{API_URL}/login", json=TEST_PROVIDER)
+        if response.status_code != 200:
+            pytest.skip("Provider login failed")
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        response = requests.get(f"{API_URL}/admin/storage", headers=headers)
+        assert response.status_code == 403
+        print("✅ Storage report restricted to admins")
+
+    def test_admin_stats(self, admin_token):
+        """Test precomputed dashboard statistics and conditional polling"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        response = requests.get(f"{API_URL}/admin/stats", headers=headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert "by_role" in data["users"]
+        assert "by_status" in data["appointments"]
+        assert "by_district" in data["appointments"]
+        assert "active_calls" in data
+        assert response.headers["ETag"] == f'W/"{data["version"]}"'
+
+        cached = requests.get(f"{API_URL}/admin/stats", headers={**headers, "If-None-Match": response.headers["ETag"]})
+        assert cached.status_code in [200, 304]
+        print(f"✅ Admin stats version {data['version']}: {data['appointments']['total']} appointments")
+
 
 class TestCleanup:
     """Cleanup test data"""
@@ -0,0 +1,123 @@
+# Single-task timer scheduler
+# One background task sleeps until the earliest deadline in a binary heap and
+# fires due callbacks, instead of one sleeping task per timer. Timers are
+# keyed, so scheduling an existing key replaces it and cancelling by key is a
+# dict lookup; cancelled heap entries are dropped lazily when they surface.
+
+import asyncio
+import heapq
+import itertools
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+class _Timer:
+    __slots__ = ("key", "deadline", "callback", "args", "cancelled")
+
+    def __init__(self, key: Hashable, deadline: float, callback: Callable[..., Any], args: tuple):
+        self.key = key
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+class TimerScheduler:
+    def __init__(self, name: str = "timers"):
+        self.name = name
+        self._heap: List[Tuple[float, int, _Timer]] = []
+        self._timers: Dict[Hashable, _Timer] = {}
+        self._sequence = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running_callbacks: set = set()
+        self.fired_count = 0
+
+    def start(self):
+        """Start the driver task on the running loop (idempotent)"""
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def schedule(self, key: Hashable, delay: float, callback: Callable[..., Any], *args) -> None:
+        """Run `callback(*args)` after `delay` seconds, replacing any timer with the same key"""
+        self.start()
+        self.cancel(key)
+        timer = _Timer(key, asyncio.get_running_loop().time() + delay, callback, args)
+        self._timers[key] = timer
+        heapq.heappush(self._heap, (timer.deadline, next(self._sequence), timer))
+        # Only wake the driver when the new timer becomes the earliest deadline
+        if self._heap[0][2] is timer:
+            self._wakeup.set()
+
+    def cancel(self, key: Hashable) -> bool:
+        timer = self._timers.pop(key, None)
+        if timer is None:
+            return False
+        timer.cancelled = True
+        # Compact once cancelled entries dominate, keeping the heap O(pending)
+        if len(self._heap) > 64 and len(self._heap) > 2 * len(self._timers):
+            self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+            heapq.heapify(self._heap)
+        return True
+
+    def is_scheduled(self, key: Hashable) -> bool:
+        return key in self._timers
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._timers)
+
+    def get_status(self) -> dict:
+        return {
+            "name": self.name,
+            "pending_timers": self.pending_count,
+            "heap_entries": len(self._heap),
+            "running_callbacks": len(self._running_callbacks),
+            "fired": self.fired_count
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            while self._heap and self._heap[0][2].cancelled:
+                heapq.heappop(self._heap)
+
+            timeout = None
+            if self._heap:
+                timeout = max(0.0, self._heap[0][0] - loop.time())
+            self._wakeup.clear()
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                    continue  # Earlier timer added - recompute the deadline
+                except asyncio.TimeoutError:
+                    pass
+
+            now = loop.time()
+            while self._heap and self._heap[0][0] <= now:
+                _, _, timer = heapq.heappop(self._heap)
+                if timer.cancelled:
+                    continue
+                del self._timers[timer.key]
+                self._fire(timer)
+
+    def _fire(self, timer: _Timer):
+        self.fired_count += 1
+        try:
+            result = timer.callback(*timer.args)
+        except Exception as e:
+            print(f"❌ Timer {timer.key} in {self.name} failed: {e}")
+            return
+        if asyncio.iscoroutine(result):
+            task = asyncio.create_task(self._guard(timer.key, result))
+            self._running_callbacks.add(task)
+            task.add_done_callback(self._running_callbacks.discard)
+
+    async def _guard(self, key: Hashable, coroutine: Awaitable[Any]):
+        try:
+            await coroutine
+        except Exception as e:
+            print(f"❌ Timer {key} in {self.name} failed: {e}")
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Dispatch Claim Benchmark
+Measures POST /api/dispatch/claim-next throughput with many doctors claiming at once:
+1. Login as the test provider and test doctor
+2. Create N pending appointments (every fourth one an emergency)
+3. Claim them from D concurrent doctors until the queue is empty
+4. Check that no appointment was handed out twice and emergencies went first
+5. Delete the TEST_ appointments that were created
+
+Claims are atomic per appointment, so the benchmark doctors share the test
+doctor's account, claiming across all districts. Claim-next hands out any
+unassigned pending appointment, so run it where no real cases are waiting.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://docstream-sync.preview.emergentagent.com').rstrip('/')
+API_URL = f"{BASE_URL}/api"
+
+TEST_PROVIDER = {"username": "testprovider", "password": "test123"}
+TEST_DOCTOR = {"username": "testdoctor", "password": "test123"}
+
+
+def login(credentials):
+    response = requests.post(f"{API_URL}/login", json=credentials, timeout=30)
+    if response.status_code != 200:
+        print(f"❌ Login failed for {credentials['username']}: {response.status_code}")
+        sys.exit(1)
+    return response.json()["access_token"]
+
+
+def create_appointment(session, headers, index):
+    appointment_data = {
+        "patient": {
+            "name": f"TEST_Dispatch_Patient_{index}",
+            "age": 40,
+            "gender": "female",
+            "history": "Benchmark run",
+            "area_of_consultation": "General Medicine"
+        },
+        "appointment_type": "emergency" if index % 4 == 0 else "non_emergency",
+        "consultation_notes": "Created by dispatch_claim_benchmark.py"
+    }
+    response = session.post(f"{API_URL}/appointments", json=appointment_data, headers=headers, timeout=30)
+    return response.json() if response.status_code == 200 else None
+
+
+def doctor_worker(session, headers):
+    """Claim until the queue is empty; returns [(latency, claimed appointment, finished at)]"""
+    claims = []
+    while True:
+        started = time.perf_counter()
+        response = session.post(f"{API_URL}/dispatch/claim-next", params={"all_districts": "true"}, headers=headers, timeout=30)
+        elapsed = time.perf_counter() - started
+        if response.status_code != 200:
+            print(f"❌ Claim failed: {response.status_code} {response.text[:200]}")
+            return claims
+        data = response.json()
+        if not data["claimed"]:
+            return claims
+        claims.append((elapsed, data["appointment"], time.perf_counter()))
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark concurrent dispatch claims")
+    parser.add_argument("--appointments", type=int, default=500, help="pending appointments to create")
+    parser.add_argument("--doctors", type=int, default=100, help="concurrent claiming doctors")
+    parser.add_argument("--force", action="store_true", help="run even if non-benchmark appointments are queued")
+    parser.add_argument("--keep", action="store_true", help="do not delete created appointments")
+    args = parser.parse_args()
+
+    provider_headers = {"Authorization": f"Bearer {login(TEST_PROVIDER)}"}
+    doctor_headers = {"Authorization": f"Bearer {login(TEST_DOCTOR)}"}
+    session = requests.Session()
+    pool_size = max(args.doctors, 20)
+    session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=pool_size))
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=pool_size))
+
+    queue = session.get(f"{API_URL}/dispatch/queue", params={"limit": 100, "all_districts": "true"}, headers=doctor_headers, timeout=30).json()
+    foreign = [apt for apt in queue["appointments"] if not (apt.get("patient") or {}).get("name", "").startswith("TEST_")]
+    if foreign and not args.force:
+        print(f"❌ {len(foreign)} real appointments are waiting in the dispatch queue - refusing to claim them (use --force)")
+        return 1
+
+    print(f"📝 Creating {args.appointments} pending appointments")
+    with ThreadPoolExecutor(max_workers=20) as executor:
+        created = [apt for apt in executor.map(lambda i: create_appointment(session, provider_headers, i), range(args.appointments)) if apt]
+    created_ids = {apt["id"] for apt in created}
+
+    print(f"🚀 Claiming with {args.doctors} concurrent doctors against {API_URL}")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.doctors) as executor:
+        results = list(executor.map(lambda _: doctor_worker(session, doctor_headers), range(args.doctors)))
+    wall_time = time.perf_counter() - started
+
+    claims = [claim for worker in results for claim in worker]
+    latencies = [elapsed for elapsed, _, _ in claims]
+    claimed_ids = [apt["id"] for _, apt, _ in claims]
+    ours = [claim for claim in claims if claim[1]["id"] in created_ids]
+
+    # Every emergency should be claimed before every non-emergency
+    by_completion = sorted(ours, key=lambda claim: claim[2])
+    last_emergency = max((i for i, (_, apt, _) in enumerate(by_completion) if apt["appointment_type"] == "emergency"), default=-1)
+    first_routine = min((i for i, (_, apt, _) in enumerate(by_completion) if apt["appointment_type"] != "emergency"), default=len(by_completion))
+
+    print("\n📊 Results")
+    print(f"   Claimed:     {len(ours)}/{len(created)} benchmark appointments ({len(claims)} claims in total)")
+    print(f"   Duplicates:  {len(claimed_ids) - len(set(claimed_ids))}")
+    print(f"   Wall time:   {wall_time:.2f}s")
+    print(f"   Throughput:  {len(claims) / wall_time:.1f} claims/s")
+    if latencies:
+        print(f"   Latency p50: {statistics.median(latencies) * 1000:.1f}ms")
+        print(f"   Latency p95: {percentile(latencies, 95) * 1000:.1f}ms")
+        print(f"   Latency max: {max(latencies) * 1000:.1f}ms")
+    # With concurrent doctors a routine claim may finish just before the last emergency one
+    print(f"   Emergencies first: {'yes' if last_emergency < first_routine else f'overlap of {last_emergency - first_routine + 1} claims'}")
+
+    if not args.keep:
+        with ThreadPoolExecutor(max_workers=20) as executor:
+            list(executor.map(
+                lambda appointment_id: session.delete(f"{API_URL}/appointments/{appointment_id}", headers=provider_headers, timeout=30),
+                created_ids
+            ))
+        print(f"🧹 Deleted {len(created_ids)} benchmark appointments")
+
+    ok = len(ours) == len(created) and len(claimed_ids) == len(set(claimed_ids))
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import axios from 'axios';
 import { 
   Users, 
@@ -21,6 +21,7 @@ import {
 } from 'lucide-react';
 
 import { BACKEND_URL, API_URL } from '../config';
+import { applyAppointmentChange, canApplyInPlace } from '../utils/appointmentSync';
 const API = API_URL;
 
 // Set up axios defaults for authentication
@@ -38,6 +39,8 @@ const AdminDashboard = ({ user, onLogout }) => {
   const [activeTab, setActiveTab] = useState('overview');
   const [users, setUsers] = useState([]);
   const [appointments, setAppointments] = useState([]);
+  const [serverStats, setServerStats] = useState(null);
+  const statsEtagRef = useRef(null);
   const [loading, setLoading] = useState(true);
   const [showAddUserForm, setShowAddUserForm] = useState(false);
   const [formKey, setFormKey] = useState(0); // Key to force form reset
@@ -108,7 +111,8 @@ const AdminDashboard = ({ user, onLogout }) => {
       return;
     }
     
-    const wsUrl = `${BACKEND_URL.replace('https:', 'wss:').replace('http:', 'ws:')}/api/ws/${user.id}`;
+    // Admin views refresh on many events; let the server merge bursts per entity into one frame
+    const wsUrl = `${BACKEND_URL.replace('https:', 'wss:').replace('http:', 'ws:')}/api/ws/${user.id}?coalesce_ms=250`;
     console.log(`🔌 Admin WebSocket connecting to:`, wsUrl);
     console.log(`   User ID: ${user.id}`);
     console.log(`   Backend URL: ${BACKEND_URL}`);
@@ -117,6 +121,18 @@ const AdminDashboard = ({ user, onLogout }) => {
     ws.onmessage = (event) => {
       const notification = JSON.parse(event.data);
       
+      // Coalesced events about one entity arrive together - handle each in order
+      if (notification.type === 'event_batch') {
+        notification.events.forEach(batched => ws.onmessage({ data: JSON.stringify(batched) }));
+        return;
+      }
+      
+      // Answer server heartbeats so the connection isn't treated as dead
+      if (notification.type === 'heartbeat') {
+        ws.send(JSON.stringify({ type: 'heartbeat_response', timestamp: Date.now() }));
+        return;
+      }
+      
       // Auto-refresh data when receiving notifications
       if (notification.type === 'emergency_appointment' || 
           notification.type === 'appointment_accepted' || 
@@ -126,9 +142,19 @@ const AdminDashboard = ({ user, onLogout }) => {
           notification.type === 'user_updated' ||
           notification.type === 'user_deleted' ||
           notification.type === 'user_permanently_deleted' ||
+          notification.type === 'appointments_cleanup_completed' ||
           notification.type === 'new_appointment_created') {
-        console.log('📡 Admin Dashboard: Received real-time update, refreshing data...', notification.type);
-        fetchData(); // Refresh all data for instant UI update
+        if (notification.type === 'user_created' && notification.user) {
+          // The event carries the new user - add it in place and only refresh the counts
+          setUsers(prev => [...prev.filter(u => u.id !== notification.user.id), notification.user]);
+          fetchStats();
+        } else if (notification.list_version !== undefined && canApplyInPlace(notification)) {
+          setAppointments(prev => applyAppointmentChange(prev, notification, user));
+          fetchStats();
+        } else {
+          console.log('📡 Admin Dashboard: Received real-time update, refreshing data...', notification.type);
+          fetchData(); // Refresh all data for instant UI update
+        }
       }
       
       // Show browser notification for admin updates
@@ -173,9 +199,47 @@ const AdminDashboard = ({ user, onLogout }) => {
     } finally {
       setLoading(false);
     }
+    fetchStats();
+  };
+
+  // Overview counts come precomputed from the server; 304 means nothing changed
+  const fetchStats = async () => {
+    try {
+      const config = getAxiosConfig();
+      if (statsEtagRef.current) {
+        config.headers['If-None-Match'] = statsEtagRef.current;
+      }
+      const response = await axios.get(`${API}/admin/stats`, {
+        ...config,
+        validateStatus: (status) => status === 200 || status === 304
+      });
+      if (response.status === 200) {
+        statsEtagRef.current = response.headers['etag'] || null;
+        setServerStats(response.data);
+      }
+    } catch (error) {
+      console.error('Error fetching admin stats:', error);
+    }
   };
 
   const getStats = () => {
+    if (serverStats) {
+      const byRole = serverStats.users.by_role;
+      const today = serverStats.appointments.today;
+      return {
+        totalUsers: serverStats.users.total,
+        providers: byRole.provider || 0,
+        doctors: byRole.doctor || 0,
+        admins: byRole.admin || 0,
+        totalAppointments: serverStats.appointments.total,
+        emergencyAppointments: serverStats.appointments.by_type.emergency || 0,
+        completedAppointments: serverStats.appointments.by_status.completed || 0,
+        todayAppointments: today.total,
+        todayEmergency: today.by_type.emergency || 0,
+        todayCompleted: today.by_status.completed || 0
+      };
+    }
+
     const providers = users.filter(u => u.role === 'provider');
     const doctors = users.filter(u => u.role === 'doctor');
     const emergencyAppts = appointments.filter(a => a.appointment_type === 'emergency');
@@ -193,7 +257,10 @@ const AdminDashboard = ({ user, onLogout }) => {
       totalAppointments: appointments.length,
       emergencyAppointments: emergencyAppts.length,
       completedAppointments: completedAppts.length,
-      todayAppointments: todayAppts.length
+      todayAppointments: todayAppts.length,
+      admins: users.filter(u => u.role === 'admin').length,
+      todayEmergency: todayAppts.filter(a => a.appointment_type === 'emergency').length,
+      todayCompleted: todayAppts.filter(a => a.status === 'completed').length
     };
   };
 
@@ -825,13 +892,11 @@ const AdminDashboard = ({ user, onLogout }) => {
       
       console.log('Cleanup response:', response.data);
       
-      // Clear appointments state immediately
+      // Clear appointments state immediately - the server deletes in the background
+      // and broadcasts appointments_cleanup_completed when done, which refreshes data
       setAppointments([]);
       
-      alert(`Cleanup completed successfully! Deleted: ${response.data.deleted.appointments} appointments, ${response.data.deleted.notes} notes, ${response.data.deleted.patients} patients`);
-      
-      // Refresh data to confirm cleanup
-      await fetchData();
+      alert(`Cleanup started (job ${response.data.job_id}). Data will refresh automatically when it completes.`);
       
     } catch (error) {
       console.error('Error during cleanup:', error);
@@ -892,7 +957,8 @@ const AdminDashboard = ({ user, onLogout }) => {
         return updatedUsers;
       });
       
-      alert(`User "${userName}" permanently deleted successfully`);
+      // Deletion of the user's data continues in a background job (progress via admin_job_progress)
+      alert(`User "${userName}" removed. Their data is being deleted in the background (job ${response.data.job_id}).`);
       
       // Force multiple refresh attempts to ensure UI updates
       setTimeout(async () => {
@@ -1361,9 +1427,7 @@ const AdminDashboard = ({ user, onLogout }) => {
                   </div>
                   <div className="flex justify-between items-center">
                     <span className="text-gray-600">Admins</span>
-                    <span className="font-semibold">
-                      {users.filter(u => u.role === 'admin').length}
-                    </span>
+                    <span className="font-semibold">{stats.admins}</span>
                   </div>
                 </div>
               </div>
@@ -1377,23 +1441,11 @@ const AdminDashboard = ({ user, onLogout }) => {
                   </div>
                   <div className="flex justify-between items-center">
                     <span className="text-gray-600">Emergency Calls</span>
-                    <span className="font-semibold text-red-600">
-                      {appointments.filter(a => {
-                        const today = new Date().toDateString();
-                        const apptDate = new Date(a.created_at).toDateString();
-                        return today === apptDate && a.appointment_type === 'emergency';
-                      }).length}
-                    </span>
+                    <span className="font-semibold text-red-600">{stats.todayEmergency}</span>
                   </div>
                   <div className="flex justify-between items-center">
                     <span className="text-gray-600">Completed</span>
-                    <span className="font-semibold text-green-600">
-                      {appointments.filter(a => {
-                        const today = new Date().toDateString();
-                        const apptDate = new Date(a.created_at).toDateString();
-                        return today === apptDate && a.status === 'completed';
-                      }).length}
-                    </span>
+                    <span className="font-semibold text-green-600">{stats.todayCompleted}</span>
                   </div>
                 </div>
               </div>
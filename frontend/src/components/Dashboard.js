@@ -7,6 +7,7 @@ import NotificationPanelNew from './NotificationPanelNew';
 import CallButton from './CallButton';
 
 import { BACKEND_URL, API_URL } from '../config';
+import { applyAppointmentChange, canApplyInPlace, createVersionTracker } from '../utils/appointmentSync';
 const API = API_URL;
 
 const Dashboard = ({ user, onLogout }) => {
@@ -29,6 +30,8 @@ const Dashboard = ({ user, onLogout }) => {
   const [reconnectTimeout, setReconnectTimeout] = useState(null);
   // Force re-render on every appointments change
   const [renderKey, setRenderKey] = useState(0);
+  // List versions already applied from change events, shared by the WebSocket and long-poll
+  const [appliedVersions] = useState(createVersionTracker);
   const navigate = useNavigate();
 
   // Helper function to show notifications (Service Worker compatible)
@@ -69,15 +72,57 @@ const Dashboard = ({ user, onLogout }) => {
     }
   }, [showVideoCallInvitation, videoCallInvitation]);
 
-  // Simple polling - fetch every 2 seconds
+  // Apply a change event that carries its appointment; false when the list has to be refetched
+  const applyChangeEvent = (notification) => {
+    if (notification.list_version === undefined || !canApplyInPlace(notification)) {
+      return false;
+    }
+    appliedVersions.add(notification.list_version);
+    setAppointments(prev => applyAppointmentChange(prev, notification, user));
+    return true;
+  };
+
+  // Long-poll for appointment changes - the server holds the request until something
+  // changes (then we refetch) or 25s pass, instead of refetching every 2 seconds
   useEffect(() => {
-    fetchAppointments(); // Initial fetch
+    let cancelled = false;
     
-    const interval = setInterval(() => {
-      fetchAppointments();
-    }, 2000);
+    const waitForChanges = async () => {
+      let version = null;
+      while (!cancelled) {
+        try {
+          if (version === null) {
+            // Take the version before fetching, so changes made during the fetch still wake us
+            const current = await axios.get(`${API}/appointments/changes/wait`);
+            version = current.data.version;
+            await fetchAppointments();
+            continue;
+          }
+          const response = await axios.get(`${API}/appointments/changes/wait`, {
+            params: { since: version, timeout: 25 },
+            timeout: 35000
+          });
+          version = response.data.version;
+          if (response.data.changed && !cancelled) {
+            // Apply the changed appointments in place; refetch only when that is not possible
+            const pending = response.data.resync ? null : response.data.changes.filter(change => !appliedVersions.has(change.version));
+            if (pending && pending.every(canApplyInPlace)) {
+              pending.forEach(change => appliedVersions.add(change.version));
+              setAppointments(prev => pending.reduce((list, change) => applyAppointmentChange(list, change, user), prev));
+            } else {
+              await fetchAppointments();
+            }
+          }
+        } catch (error) {
+          if (error.response?.status === 401) return;
+          await new Promise(resolve => setTimeout(resolve, 2000)); // Back off, then resync
+          version = null;
+        }
+      }
+    };
     
-    return () => clearInterval(interval);
+    waitForChanges();
+    return () => { cancelled = true; };
   }, []); // Run once on mount
 
   // CRITICAL: Setup WebSocket for real-time call notifications
@@ -106,6 +151,7 @@ const Dashboard = ({ user, onLogout }) => {
     const maxReconnectAttempts = 50; // Increased for persistence
     let heartbeatInterval = null;
     let ws = null;
+    const seenMessageIds = new Set();
     
     const connectWebSocket = () => {
       try {
@@ -120,6 +166,8 @@ const Dashboard = ({ user, onLogout }) => {
           const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
           wsUrl = `${protocol}//${window.location.host}/api/ws/${user.id}`;
         }
+        // Let the server merge bursts of events about one appointment into a single frame
+        wsUrl += '?coalesce_ms=150';
         
         console.log(`🔌 Provider WebSocket connecting (attempt ${reconnectAttempts + 1}):`, wsUrl);
         console.log(`   User ID: ${user.id}`);
@@ -155,28 +203,44 @@ const Dashboard = ({ user, onLogout }) => {
           try {
             const notification = JSON.parse(event.data);
             console.log('📨 Provider received WebSocket notification:', notification);
+
+            // Coalesced events about one appointment arrive together - handle each in order
+            if (notification.type === 'event_batch') {
+              notification.events.forEach(batched => ws.onmessage({ data: JSON.stringify(batched) }));
+              return;
+            }
+
+            // Answer server heartbeats so the connection isn't treated as dead
+            if (notification.type === 'heartbeat') {
+              ws.send(JSON.stringify({ type: 'heartbeat_response', timestamp: Date.now() }));
+              return;
+            }
+
+            // Targeted call events carry a message id: ack it so the server skips the push fallback,
+            // and ignore replays of a message this tab has already handled
+            if (notification.message_id) {
+              if (notification.requires_ack && ws && ws.readyState === WebSocket.OPEN) {
+                ws.send(JSON.stringify({ type: 'ack', message_id: notification.message_id }));
+              }
+              if (seenMessageIds.has(notification.message_id)) {
+                console.log('🔁 Duplicate notification ignored:', notification.message_id);
+                return;
+              }
+              seenMessageIds.add(notification.message_id);
+              if (seenMessageIds.size > 200) {
+                seenMessageIds.delete(seenMessageIds.values().next().value);
+              }
+            }
             
             // CRITICAL: Handle new appointment creation for INSTANT sync
             if (notification.type === 'new_appointment_created') {
               console.log('🚨 NEW APPOINTMENT CREATED - FORCING IMMEDIATE SYNC:', notification);
               
-              // Add appointment directly to state for INSTANT display
-              if (notification.appointment) {
-                setAppointments(prevAppointments => {
-                  const newAppointment = notification.appointment;
-                  // Check if appointment already exists to prevent duplicates
-                  const exists = prevAppointments.some(apt => apt.id === newAppointment.id);
-                  if (!exists) {
-                    console.log('➕ PROVIDER: Adding new appointment to state immediately:', newAppointment.patient?.name);
-                    return [...prevAppointments, newAppointment];
-                  }
-                  return prevAppointments;
-                });
+              // Add appointment directly to state for INSTANT display, refetch only if it can't be applied
+              if (!applyChangeEvent(notification)) {
+                fetchAppointments();
               }
               
-              // Force immediate refresh
-              fetchAppointments();
-              
               // Show notification with full appointment details  
               if (notification.show_in_notification) {
                 const newNotification = {
@@ -222,52 +286,49 @@ const Dashboard = ({ user, onLogout }) => {
               
               console.log('📅 REAL-TIME: Appointment sync notification received:', notification.type);
               
-              // If appointment was deleted, remove it immediately from state
-              if (notification.type === 'appointment_deleted' && notification.appointment_id) {
-                console.log('🗑️ PROVIDER: Removing deleted appointment immediately:', notification.appointment_id);
-                setAppointments(prevAppointments => 
-                  prevAppointments.filter(apt => apt.id !== notification.appointment_id)
-                );
-              }
-              
-              // AGGRESSIVE REAL-TIME SYNC - NO MORE LOGOUT/LOGIN REQUIRED
-              console.log('🚨 FORCING IMMEDIATE APPOINTMENT SYNC');
-              
-              // Immediate sync (0ms delay)
-              fetchAppointments();
-              
-              // Force multiple UI refreshes
-              setLoading(prev => !prev);
-              setTimeout(() => setLoading(false), 10);
-              
-              // More aggressive sync attempts
-              setTimeout(() => {
-                console.log('🔄 AGGRESSIVE sync #1 after 100ms');
+              if (applyChangeEvent(notification)) {
+                // The event carried the changed appointment - no refetch needed
+                console.log('✅ PROVIDER: Applied appointment change in place, list version', notification.list_version);
+              } else {
+                // AGGRESSIVE REAL-TIME SYNC - NO MORE LOGOUT/LOGIN REQUIRED
+                console.log('🚨 FORCING IMMEDIATE APPOINTMENT SYNC');
+                
+                // Immediate sync (0ms delay)
                 fetchAppointments();
+                
+                // Force multiple UI refreshes
                 setLoading(prev => !prev);
                 setTimeout(() => setLoading(false), 10);
-              }, 100);
-              
-              setTimeout(() => {
-                console.log('🔄 AGGRESSIVE sync #2 after 500ms');
-                fetchAppointments();
-              }, 500);
-              
-              setTimeout(() => {
-                console.log('🔄 AGGRESSIVE sync #3 after 1 second');
-                fetchAppointments();
-              }, 1000);
-              
-              setTimeout(() => {
-                console.log('🔄 FINAL sync after 2 seconds');
-                fetchAppointments();
-              }, 2000);
-              
-              // Force page refresh if still not working after 5 seconds
-              setTimeout(() => {
-                console.log('🔄 EMERGENCY refresh check after 5 seconds');
-                window.dispatchEvent(new Event('focus'));
-              }, 5000);
+                
+                // More aggressive sync attempts
+                setTimeout(() => {
+                  console.log('🔄 AGGRESSIVE sync #1 after 100ms');
+                  fetchAppointments();
+                  setLoading(prev => !prev);
+                  setTimeout(() => setLoading(false), 10);
+                }, 100);
+                
+                setTimeout(() => {
+                  console.log('🔄 AGGRESSIVE sync #2 after 500ms');
+                  fetchAppointments();
+                }, 500);
+                
+                setTimeout(() => {
+                  console.log('🔄 AGGRESSIVE sync #3 after 1 second');
+                  fetchAppointments();
+                }, 1000);
+                
+                setTimeout(() => {
+                  console.log('🔄 FINAL sync after 2 seconds');
+                  fetchAppointments();
+                }, 2000);
+                
+                // Force page refresh if still not working after 5 seconds
+                setTimeout(() => {
+                  console.log('🔄 EMERGENCY refresh check after 5 seconds');
+                  window.dispatchEvent(new Event('focus'));
+                }, 5000);
+              }
               
               // Show visual notification to user
               if (notification.type === 'new_appointment' || notification.type === 'emergency_appointment') {
@@ -334,8 +395,10 @@ const Dashboard = ({ user, onLogout }) => {
                 }
               }, 7000);
               
-              // Force refresh appointments to show new note
-              fetchAppointments();
+              // Show the new note count in the list, refetching only if the event can't be applied
+              if (!applyChangeEvent(notification)) {
+                fetchAppointments();
+              }
               
               console.log('✅ Note notification processed and added to notifications panel');
             }
@@ -829,9 +892,8 @@ const Dashboard = ({ user, onLogout }) => {
       const response = await axios.get(`${API}/appointments/${appointment.id}`);
       setSelectedAppointment(response.data);
       
-      // Fetch appointment notes
-      const notesResponse = await axios.get(`${API}/appointments/${appointment.id}/notes`);
-      setAppointmentNotes(notesResponse.data);
+      // Notes come with the details response (revalidated via ETag on reopen)
+      setAppointmentNotes(response.data.notes || []);
       
       setShowAppointmentModal(true);
     } catch (error) {
@@ -21,11 +21,16 @@ import NotificationPanelNew from './NotificationPanelNew';
 import CallButton from './CallButton';
 
 import { BACKEND_URL, API_URL } from '../config';
+import { applyAppointmentChange, canApplyInPlace, createVersionTracker } from '../utils/appointmentSync';
 const API = API_URL;
 
 const DoctorDashboard = ({ user, onLogout }) => {
   const [appointments, setAppointments] = useState([]);
   const [loading, setLoading] = useState(true);
+  // List versions already applied from change events, shared by the WebSocket and long-poll
+  const [appliedVersions] = useState(createVersionTracker);
+  // Doctors see their own district (and unassigned appointments) unless they opt into every district
+  const [allDistricts, setAllDistricts] = useState(false);
   const [notifications, setNotifications] = useState([]);
   const [selectedAppointment, setSelectedAppointment] = useState(null);
   const [showAppointmentModal, setShowAppointmentModal] = useState(false);
@@ -87,20 +92,52 @@ const DoctorDashboard = ({ user, onLogout }) => {
     }
   };
 
-  // Simple polling - fetch every 2 seconds
+  // Long-poll for appointment changes - the server holds the request until something
+  // changes (then we refetch) or 25s pass, instead of refetching every 2 seconds
   useEffect(() => {
-    fetchAppointments(); // Initial fetch
+    let cancelled = false;
     
-    const interval = setInterval(() => {
-      fetchAppointments();
-    }, 2000);
+    const waitForChanges = async () => {
+      let version = null;
+      while (!cancelled) {
+        try {
+          if (version === null) {
+            // Take the version before fetching, so changes made during the fetch still wake us
+            const current = await axios.get(`${API}/appointments/changes/wait`);
+            version = current.data.version;
+            await fetchAppointments();
+            continue;
+          }
+          const response = await axios.get(`${API}/appointments/changes/wait`, {
+            params: { since: version, timeout: 25, all_districts: allDistricts },
+            timeout: 35000
+          });
+          version = response.data.version;
+          if (response.data.changed && !cancelled) {
+            // Apply the changed appointments in place; refetch only when that is not possible
+            const pending = response.data.resync ? null : response.data.changes.filter(change => !appliedVersions.has(change.version));
+            if (pending && pending.every(canApplyInPlace)) {
+              pending.forEach(change => appliedVersions.add(change.version));
+              setAppointments(prev => pending.reduce((list, change) => applyAppointmentChange(list, change, user), prev));
+            } else {
+              await fetchAppointments();
+            }
+          }
+        } catch (error) {
+          if (error.response?.status === 401) return;
+          await new Promise(resolve => setTimeout(resolve, 2000)); // Back off, then resync
+          version = null;
+        }
+      }
+    };
     
-    return () => clearInterval(interval);
-  }, []); // Run once on mount
+    waitForChanges();
+    return () => { cancelled = true; };
+  }, [allDistricts]); // Restart with a fresh list when the district scope changes
 
   const fetchAppointments = async () => {
     try {
-      const response = await axios.get(`${API}/appointments`);
+      const response = await axios.get(`${API}/appointments`, { params: { all_districts: allDistricts } });
       console.log('✅ DOCTOR: Fetched appointments:', response.data.length);
       
       // FORCE update by creating new array reference
@@ -332,9 +369,8 @@ const DoctorDashboard = ({ user, onLogout }) => {
       const response = await axios.get(`${API}/appointments/${appointment.id}`);
       setSelectedAppointment(response.data);
       
-      // Fetch appointment notes
-      const notesResponse = await axios.get(`${API}/appointments/${appointment.id}/notes`);
-      setAppointmentNotes(notesResponse.data);
+      // Notes come with the details response (revalidated via ETag on reopen)
+      setAppointmentNotes(response.data.notes || []);
       
       setShowAppointmentModal(true);
     } catch (error) {
@@ -521,6 +557,17 @@ const DoctorDashboard = ({ user, onLogout }) => {
           <h2 className="text-2xl font-bold text-gray-900 mb-6 flex items-center">
             <Calendar className="w-7 h-7 mr-3 text-blue-600" />
             All Appointments
+            {user.district && (
+              <label className="ml-auto flex items-center text-sm font-normal text-gray-600">
+                <input
+                  type="checkbox"
+                  className="mr-2"
+                  checked={allDistricts}
+                  onChange={(e) => setAllDistricts(e.target.checked)}
+                />
+                {allDistricts ? 'All districts' : `${user.district} only`}
+              </label>
+            )}
           </h2>
 
           {allAppointments.length === 0 ? (
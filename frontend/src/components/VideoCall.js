@@ -354,6 +354,16 @@ const VideoCall = ({ user }) => {
           }
           break;
 
+        case 'ice-candidates':
+          // The signaling server batches candidates trickled in quick succession
+          console.log(`📥 Received ${message.candidates.length} ICE candidates`);
+          for (const candidate of message.candidates) {
+            if (candidate) {
+              await pc.addIceCandidate(candidate);
+            }
+          }
+          break;
+
         case 'user-left':
           console.log('👋 User left');
           setRemoteUser(null);
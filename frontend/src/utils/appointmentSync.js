@@ -0,0 +1,49 @@
+/**
+ * Appointment list sync helpers
+ * Change events (WebSocket) and long-poll results carry the changed appointment as
+ * listed by GET /appointments plus the list version it produced, so dashboards patch
+ * their list in place and only refetch when a change cannot be applied.
+ */
+
+const DELETE_TYPES = ['deleted', 'appointment_deleted'];
+
+// True when the change carries everything needed to apply it without a refetch
+export function canApplyInPlace(change) {
+  if (DELETE_TYPES.includes(change.type)) {
+    return Boolean(change.appointment_id);
+  }
+  return Boolean(change.appointment && change.appointment.id);
+}
+
+// Returns the list with the change applied; providers ignore other providers' appointments
+export function applyAppointmentChange(appointments, change, user) {
+  if (DELETE_TYPES.includes(change.type)) {
+    return appointments.filter(apt => apt.id !== change.appointment_id);
+  }
+  const incoming = change.appointment;
+  if (user?.role === 'provider' && incoming.provider_id !== user.id) {
+    return appointments;
+  }
+  if (appointments.some(apt => apt.id === incoming.id)) {
+    return appointments.map(apt => (apt.id === incoming.id ? { ...apt, ...incoming } : apt));
+  }
+  return [...appointments, incoming];
+}
+
+// Remembers recently applied list versions, so the long-poll skips changes
+// that already arrived over the WebSocket
+export function createVersionTracker(limit = 500) {
+  const versions = new Set();
+  return {
+    add(version) {
+      if (version === undefined || version === null) return;
+      versions.add(version);
+      if (versions.size > limit) {
+        versions.delete(versions.values().next().value);
+      }
+    },
+    has(version) {
+      return versions.has(version);
+    }
+  };
+}
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+WebSocket Encoding Benchmark
+Compares the notification encodings offered on /api/ws/{user_id}:
+1. Build a typical event mix (appointment created/updated, notes, calls, heartbeats)
+2. Encode every event as JSON and as msgpack
+3. Compress each frame the way permessage-deflate does, with and without context takeover
+4. Report bytes on the wire and CPU time per message for each combination
+
+Runs offline against the server's own encode_frame, so no backend is needed.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'telehealth_benchmark')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+from server import encode_frame, WS_ENCODINGS  # noqa: E402
+
+# Share of each event type in the mix, roughly what a busy dashboard receives
+EVENT_MIX = {
+    "new_appointment_created": 0.25,
+    "appointment_updated": 0.25,
+    "new_note": 0.15,
+    "incoming_video_call": 0.05,
+    "call_cancelled": 0.05,
+    "heartbeat": 0.25,
+}
+
+
+def now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def patient(index):
+    return {
+        "id": str(uuid.uuid4()),
+        "name": f"Bench Patient {index}",
+        "age": 30 + index % 50,
+        "gender": random.choice(["male", "female"]),
+        "vitals": {"blood_pressure": "130/85", "heart_rate": 88, "temperature": 37.8, "oxygen_saturation": 97},
+        "history": "Intermittent chest pain for three days, worse on exertion. Known hypertension.",
+        "area_of_consultation": "Cardiology",
+        "created_at": now(),
+    }
+
+
+def make_event(event_type, index):
+    appointment_id = str(uuid.uuid4())
+    if event_type == "new_appointment_created":
+        return {
+            "type": "new_appointment_created",
+            "appointment_id": appointment_id,
+            "appointment": {
+                "id": appointment_id,
+                "patient_id": str(uuid.uuid4()),
+                "provider_id": str(uuid.uuid4()),
+                "appointment_type": "emergency",
+                "status": "pending",
+                "consultation_notes": "Urgent cardiac evaluation needed",
+                "provider_name": "Bench Provider",
+                "patient": patient(index),
+                "created_at": now(),
+                "updated_at": now(),
+            },
+            "timestamp": now(),
+        }
+    if event_type == "appointment_updated":
+        return {
+            "type": "appointment_updated",
+            "appointment_id": appointment_id,
+            "status": "accepted",
+            "doctor_id": str(uuid.uuid4()),
+            "doctor_name": "Dr. Bench",
+            "patient_name": f"Bench Patient {index}",
+            "timestamp": now(),
+        }
+    if event_type == "new_note":
+        return {
+            "type": "new_note",
+            "appointment_id": appointment_id,
+            "note": "Please repeat the ECG and send the reading before the call.",
+            "sender_role": "doctor",
+            "sender_name": "Dr. Bench",
+            "timestamp": now(),
+        }
+    if event_type == "incoming_video_call":
+        room_name = f"emergency-{appointment_id}-call-1-{int(time.time())}"
+        return {
+            "type": "incoming_video_call",
+            "message_id": str(uuid.uuid4()),
+            "requires_ack": True,
+            "call_id": str(uuid.uuid4()),
+            "appointment_id": appointment_id,
+            "doctor_name": "Dr. Bench",
+            "doctor_id": str(uuid.uuid4()),
+            "patient_name": f"Bench Patient {index}",
+            "jitsi_url": f"https://meet.jit.si/{room_name}#config.prejoinPageEnabled=false",
+            "room_name": room_name,
+            "call_attempt": 1,
+            "priority": "urgent",
+            "timestamp": now(),
+        }
+    if event_type == "call_cancelled":
+        return {
+            "type": "call_cancelled",
+            "message_id": str(uuid.uuid4()),
+            "requires_ack": True,
+            "appointment_id": appointment_id,
+            "reason": "Call cancelled by doctor",
+            "action": "dismiss_call",
+            "timestamp": now(),
+        }
+    return {"type": "heartbeat", "timestamp": now(), "server_status": "healthy"}
+
+
+def build_events(count, seed):
+    random.seed(seed)
+    types = random.choices(list(EVENT_MIX), weights=list(EVENT_MIX.values()), k=count)
+    return [make_event(event_type, index) for index, event_type in enumerate(types)]
+
+
+def frame_bytes(frame):
+    return frame if isinstance(frame, bytes) else frame.encode()
+
+
+def deflate_frames(frames, context_takeover):
+    """Compress frames like permessage-deflate: raw deflate, sync flush, trailing 4 bytes dropped"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    sizes = []
+    for frame in frames:
+        if not context_takeover:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        data = compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        sizes.append(len(data) - 4)
+    return sizes
+
+
+def run(events, encoding, compression, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        frames = [frame_bytes(encode_frame(event, encoding)) for event in events]
+        if compression != "none":
+            sizes = deflate_frames(frames, context_takeover=(compression == "deflate+context"))
+        else:
+            sizes = [len(frame) for frame in frames]
+    cpu_us = (time.process_time() - start) / (repeat * len(events)) * 1_000_000
+    return {"bytes": sum(sizes), "avg_bytes": sum(sizes) / len(sizes), "cpu_us": cpu_us}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark WebSocket notification encodings")
+    parser.add_argument("--messages", type=int, default=2000, help="events in the mix")
+    parser.add_argument("--repeat", type=int, default=5, help="passes used for CPU timing")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    events = build_events(args.messages, args.seed)
+    print(f"📦 {len(events)} events: " + ", ".join(f"{t} {int(w * 100)}%" for t, w in EVENT_MIX.items()))
+    print()
+    print(f"{'encoding':<10} {'compression':<17} {'total KB':>10} {'avg B/msg':>10} {'vs json':>8} {'CPU µs/msg':>11}")
+
+    baseline = None
+    for encoding in WS_ENCODINGS:
+        for compression in ["none", "deflate", "deflate+context"]:
+            result = run(events, encoding, compression, args.repeat)
+            if baseline is None:
+                baseline = result["bytes"]
+            print(
+                f"{encoding:<10} {compression:<17} {result['bytes'] / 1024:>10.1f} {result['avg_bytes']:>10.0f}"
+                f" {result['bytes'] / baseline * 100:>7.0f}% {result['cpu_us']:>11.1f}"
+            )
+
+    print()
+    print("deflate = permessage-deflate without context takeover (client_no_context_takeover)")
+    print("deflate+context = permessage-deflate with context takeover, what websockets negotiates when the server enables compression")
+
+
+if __name__ == "__main__":
+    main()